@@ -0,0 +1,146 @@
+"""
+Decomposition, hashing, fitting and substitution.
+
+asv style: time_* methods are timed, peakmem_* measure peak memory, params are the workloads
+(see workloads.py). run with benchmarks/run.py or asv.
+"""
+
+import itertools
+from collections import defaultdict
+from graphlearn import lsgg_core_interface_pair as lcip, csrcores
+from graphlearn.local_substitution_graph_grammar import LocalSubstitutionGraphGrammar
+from benchmarks import workloads
+
+
+class Decompose:
+    params = ['chem', 10, 100, 1000]
+    param_names = ['graphs']
+
+    def setup(self, kind):
+        self.graphs = workloads.graphs(kind)
+        self.grammar = LocalSubstitutionGraphGrammar(radii=[0, 1, 2], thickness=1)
+        self.decompositions = [lcip.decompose(g) for g in self.graphs]
+
+    def time_get_cores(self, kind):
+        for graph in self.graphs:
+            list(lcip.get_cores(lcip.decompose(graph), self.grammar.radii))
+
+    def time_get_cores_csr(self, kind):
+        for graph in self.graphs:
+            list(csrcores.get_cores(lcip.decompose(graph), self.grammar.radii))
+
+    def time_cips(self, kind):
+        for graph in self.graphs:
+            self.grammar._get_cips(graph)
+
+    def peakmem_cips(self, kind):
+        for graph in self.graphs:
+            self.grammar._get_cips(graph)
+
+    def time_graph_hash(self, kind):
+        hasher = lcip.GraphHasher()
+        for decomposition in self.decompositions:
+            hasher.graph_hash(decomposition.exgraph)
+
+    def time_graph_hash_csr(self, kind):
+        from graphlearn.csrhash import CSRGraphHasher
+        hasher = CSRGraphHasher()
+        for decomposition in self.decompositions:
+            hasher.graph_hash(decomposition.exgraph)
+
+
+class Hash:
+    """GraphHasher against CSRGraphHasher on what a grammar hashes: cores and interfaces"""
+    params = [['chem', 100], ['GraphHasher', 'CSRGraphHasher']]
+    param_names = ['graphs', 'hasher']
+
+    def setup(self, kind, hasher):
+        from graphlearn.csrhash import CSRGraphHasher
+        self.hasher = {'GraphHasher': lcip.GraphHasher, 'CSRGraphHasher': CSRGraphHasher}[hasher]()
+        grammar = LocalSubstitutionGraphGrammar(radii=[0, 1, 2], thickness=1)
+        cips = [cip for graph in workloads.graphs(kind)[:20] for cip in grammar._get_cips(graph)]
+        self.cores = [cip.graph.subgraph(cip.core_nodes) for cip in cips]
+        self.interfaces = [cip.interface for cip in cips]
+
+    def time_hash_cores(self, kind, hasher):
+        for core in self.cores:
+            self.hasher.graph_hash(core)
+
+    def time_hash_interfaces(self, kind, hasher):
+        for interface in self.interfaces:
+            self.hasher.graph_hash(interface, get_node_label=lambda id, node: node['ilabel'])
+
+
+class Fit:
+    params = [['chem', 100], [1, 2]]
+    param_names = ['graphs', 'n_jobs']
+    timeout = 600
+
+    def setup(self, kind, n_jobs):
+        self.graphs = workloads.graphs(kind)
+
+    def _fit(self, n_jobs):
+        grammar = LocalSubstitutionGraphGrammar(radii=[0, 1, 2], thickness=1)
+        if n_jobs == 1:
+            return grammar.fit(self.graphs)
+        return grammar.fit(self.graphs, n_jobs=n_jobs)
+
+    def time_fit(self, kind, n_jobs):
+        self._fit(n_jobs)
+
+    def peakmem_fit(self, kind, n_jobs):
+        self._fit(n_jobs)
+
+
+class Merge:
+    """what fit(n_jobs>1) does in the parent: merge the partial grammars of the shards one after another"""
+    params = [['chem', 100], [8, 32]]
+    param_names = ['graphs', 'shards']
+    timeout = 600
+
+    def setup(self, kind, shards):
+        from graphlearn.util.multi import chunks
+        graphs = workloads.graphs(kind)
+        self.grammar = LocalSubstitutionGraphGrammar(radii=[0, 1, 2], thickness=1)
+        self.partials = [LocalSubstitutionGraphGrammar(radii=[0, 1, 2], thickness=1)._fit_shard(shard)
+                         for shard in chunks(graphs, shards)]
+
+    def time_merge(self, kind, shards):
+        # counts accumulate in the cips of the partials from call to call, the work is the same
+        productions = defaultdict(dict)
+        for partial in self.partials:
+            self.grammar._merge_productions(productions, partial)
+
+
+class Neighbors:
+    params = ['chem', 100, 1000]
+    param_names = ['graphs']
+    timeout = 600
+
+    def setup(self, kind):
+        self.grammar = workloads.grammar(kind)
+        self.graphs = workloads.graphs(kind)[:5]
+        # (graph, cip, congruent cips) of the first cores with a congruent cip
+        self.substitutions = []
+        for graph in self.graphs:
+            for cip in itertools.islice(self.grammar._get_cips(graph), 10):
+                congruent = list(itertools.islice(self.grammar._get_congruent_cips(cip), 20))
+                if congruent:
+                    self.substitutions.append((graph, cip, congruent))
+
+    def time_neighbors(self, kind):
+        for graph in self.graphs:
+            list(itertools.islice(self.grammar.neighbors(graph), 100))
+
+    def time_neighbors_sample(self, kind):
+        for graph in self.graphs:
+            list(self.grammar.neighbors_sample(graph, 20))
+
+    def time_substitute_core(self, kind):
+        for graph, cip, congruent in self.substitutions:
+            for congruent_cip in congruent:
+                lcip.substitute_core(graph, cip, congruent_cip)
+
+    def peakmem_neighbors(self, kind):
+        for graph in self.graphs:
+            list(itertools.islice(self.grammar.neighbors(graph), 100))
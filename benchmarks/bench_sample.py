@@ -0,0 +1,54 @@
+"""
+Sampler steps, see sampler_throughput.py for steps/s, latencies and the time split.
+"""
+
+import random
+from graphlearn.choice import SelectClassic, SelectMax, SelectProbN
+from graphlearn.sample import Sampler
+from graphlearn.score import RandomEstimator
+from graphlearn.util.util import no_transform
+from benchmarks import workloads
+
+SELECTORS = {'SelectMax': SelectMax, 'SelectClassic': SelectClassic, 'SelectProbN': lambda: SelectProbN(1)}
+
+
+class _Steps:
+    timeout = 600
+
+    def _setup(self, selector):
+        self.grammar = workloads.grammar('chem')
+        self.start = workloads.graphs('chem')[0]
+        self.selector = SELECTORS[selector]()
+
+    def _run(self, method, n_steps):
+        rng = random.Random(0)
+        scorer, self.selector.rng = RandomEstimator(), rng
+        scorer.rng = rng
+        sampler = Sampler(grammar=self.grammar, transformer=no_transform(), scorer=scorer,
+                          selector=self.selector, num_sample=20, rng=rng)
+        graph = self.start
+        for i in range(n_steps):
+            graph, score = getattr(sampler, method)(graph, i)
+            if graph is None:
+                graph = self.start
+
+
+class Steps(_Steps):
+    params = [['SelectMax', 'SelectClassic', 'SelectProbN']]
+    param_names = ['selector']
+
+    def setup(self, selector):
+        self._setup(selector)
+
+    def time_sample_step(self, selector):
+        self._run('sample_step', 20)
+
+
+class StepsMulti(_Steps):
+    # sample_step_multi does not use the selector
+
+    def setup(self):
+        self._setup('SelectMax')
+
+    def time_sample_step_multi(self):
+        self._run('sample_step_multi', 5)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Run the benchmarks without asv, and compare results or commits.
+
+    python benchmarks/run.py                         # all benchmarks, results.json
+    python benchmarks/run.py -b Neighbors -o new.json
+    python benchmarks/run.py --compare old.json new.json
+    python benchmarks/run.py --commits master HEAD   # both in a git worktree, then compare
+
+the benchmark classes follow asv: params/param_names, setup(*params), time_* and peakmem_*
+methods. a time is the min and median of --repeat calls after one warmup call, peak memory
+is the peak of python allocations (tracemalloc) during one call. --commits runs the benchmarks
+of this tree against the graphlearn of each commit, benchmarks that fail there are reported
+as failed. compare exits with 1 if something got slower by more than --factor.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import os
+import pkgutil
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+
+
+def discover(pattern=None):
+    """(name, class, method name) of all benchmarks, name like bench_grammar.Fit.time_fit"""
+    import re
+    import benchmarks
+    for module_info in pkgutil.iter_modules(benchmarks.__path__):
+        if not module_info.name.startswith('bench_'):
+            continue
+        module = importlib.import_module('benchmarks.' + module_info.name)
+        for cls_name, cls in sorted(vars(module).items()):
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            for method in sorted(dir(cls)):
+                if method.startswith(('time_', 'peakmem_')):
+                    name = '%s.%s.%s' % (module_info.name, cls_name, method)
+                    if pattern is None or re.search(pattern, name):
+                        yield name, cls, method
+
+
+def param_combinations(cls):
+    params = getattr(cls, 'params', None)
+    if params is None:
+        return [()]
+    if params and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    return list(itertools.product(*params))
+
+
+def measure(cls, method, params, repeat):
+    instance = cls()
+    if hasattr(instance, 'setup'):
+        instance.setup(*params)
+    try:
+        func = getattr(instance, method)
+        func(*params)  # warmup: caches, pools, imports
+        if method.startswith('peakmem_'):
+            tracemalloc.start()
+            func(*params)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return {'peakmem': peak, 'unit': 'bytes'}
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            func(*params)
+            times.append(time.perf_counter() - start)
+        return {'min': min(times), 'median': statistics.median(times), 'repeat': repeat, 'unit': 's'}
+    finally:
+        if hasattr(instance, 'teardown'):
+            instance.teardown(*params)
+
+
+def run(pattern=None, repeat=5, verbose=True):
+    results = {}
+    for name, cls, method in discover(pattern):
+        for params in param_combinations(cls):
+            key = '%s(%s)' % (name, ', '.join(map(str, params)))
+            try:
+                results[key] = measure(cls, method, params, repeat)
+            except NotImplementedError:
+                continue  # asv: skip this combination
+            except Exception as e:
+                results[key] = {'error': '%s: %s' % (type(e).__name__, e)}
+            if verbose:
+                print('%-70s %s' % (key, _format(results[key])), flush=True)
+    return results
+
+
+def _format(result):
+    if 'error' in result:
+        return 'failed (%s)' % result['error']
+    if 'peakmem' in result:
+        return '%.1fM' % (result['peakmem'] / 2 ** 20)
+    return '%.4fs (median %.4fs)' % (result['min'], result['median'])
+
+
+def _value(result):
+    return result.get('min', result.get('peakmem'))
+
+
+def commit_of(tree):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=tree, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, factor=0.1):
+    """print old and new side by side, returns the names of the regressions"""
+    regressions = []
+    print('%-70s %12s %12s %7s' % ('benchmark', 'old', 'new', 'ratio'))
+    for key in sorted(set(old['results']) | set(new['results'])):
+        a, b = old['results'].get(key), new['results'].get(key)
+        if a is None or b is None or 'error' in a or 'error' in b:
+            mark = '?'
+            ratio = ''
+        else:
+            r = _value(b) / _value(a) if _value(a) else float('inf')
+            mark = '+' if r > 1 + factor else '-' if r < 1 / (1 + factor) else ' '
+            ratio = '%.2f' % r
+            if mark == '+':
+                regressions.append(key)
+        print('%s %-68s %12s %12s %7s' % (mark, key, _short(a), _short(b), ratio))
+    print('+ slower, - faster by more than %d%%, ? missing or failed' % (factor * 100))
+    return regressions
+
+
+def _short(result):
+    if result is None:
+        return 'missing'
+    if 'error' in result:
+        return 'failed'
+    if 'peakmem' in result:
+        return '%.1fM' % (result['peakmem'] / 2 ** 20)
+    return '%.4fs' % result['min']
+
+
+def run_commit(commit, args):
+    """run the benchmarks in a subprocess against graphlearn at commit, returns the results"""
+    directory = tempfile.mkdtemp(prefix='graphlearn-bench-')
+    tree = os.path.join(directory, 'tree')
+    output = os.path.join(directory, 'results.json')
+    subprocess.check_call(['git', 'worktree', 'add', '--detach', tree, commit], cwd=ROOT)
+    try:
+        command = [sys.executable, os.path.abspath(__file__), '--tree', tree, '-o', output,
+                   '--repeat', str(args.repeat)]
+        if args.bench:
+            command += ['-b', args.bench]
+        subprocess.check_call(command)
+        with open(output) as handle:
+            return json.load(handle)
+    finally:
+        subprocess.call(['git', 'worktree', 'remove', '--force', tree], cwd=ROOT)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-b', '--bench', help='regex, run only matching benchmarks')
+    parser.add_argument('-o', '--output', default='results.json')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tree', default=ROOT, help='import graphlearn from here')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--commits', nargs=2, metavar=('OLD', 'NEW'), help='run and compare two commits')
+    parser.add_argument('--factor', type=float, default=0.1, help='tolerated slowdown for compare')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as a, open(args.compare[1]) as b:
+            return 1 if compare(json.load(a), json.load(b), args.factor) else 0
+    if args.commits:
+        old, new = [run_commit(commit, args) for commit in args.commits]
+        return 1 if compare(old, new, args.factor) else 0
+
+    # graphlearn from the tree, the benchmarks from here
+    sys.path.insert(0, os.path.abspath(args.tree))
+    import graphlearn
+    sys.path.insert(1, ROOT)
+    results = run(args.bench, args.repeat)
+    with open(args.output, 'w') as handle:
+        json.dump({'commit': commit_of(args.tree), 'graphlearn': os.path.dirname(graphlearn.__file__),
+                   'python': platform.python_version(), 'machine': platform.node(), 'date': time.time(),
+                   'results': results}, handle, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
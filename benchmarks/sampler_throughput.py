@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+End-to-end throughput of the Sampler.
+
+    python benchmarks/sampler_throughput.py
+    python benchmarks/sampler_throughput.py --steps 200 --chains 4 --num-sample 50 -o throughput.json
+
+fits a LocalSubstitutionGraphGrammarSample on the chemtest molecules and runs chains with
+sample_step (SelectMax, SelectClassic, SelectProbN) and sample_step_multi (which picks the best
+proposal itself, the selector is not used). RandomEstimator stands in for the scorer, it draws
+from the chain's rng, so runs are repeatable and need no model.
+
+reported per configuration: steps/s, proposals/s (graphs yielded by the grammar), p50/p99 step
+latency and the time split between proposing (grammar), decoding (transformer), scoring,
+selecting and the rest of the step. the parts are timed by wrapping grammar, transformer,
+scorer and selector, the sampler itself is not changed.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graphlearn.choice import SelectClassic, SelectMax, SelectProbN
+from graphlearn.sample import LocalSubstitutionGraphGrammarSample, Sampler
+from graphlearn.score import RandomEstimator
+from graphlearn.util.util import no_transform
+from graphlearn.util import util
+
+STAGES = ['propose', 'decode', 'score', 'select']
+
+
+class _Timed(object):
+    """proxy that adds the time spent in some methods (and in the generators they return) to a Counter"""
+
+    def __init__(self, obj, stage, methods, times, counts=None):
+        self._obj, self._stage, self._methods = obj, stage, methods
+        self._times, self._counts = times, counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if name not in self._methods:
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = attr(*args, **kwargs)
+            self._times[self._stage] += time.perf_counter() - start
+            if hasattr(result, '__next__'):
+                return self._timed_iter(result)
+            return result
+        return timed
+
+    def _timed_iter(self, iterator):
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._times[self._stage] += time.perf_counter() - start
+                return
+            self._times[self._stage] += time.perf_counter() - start
+            if self._counts is not None:
+                self._counts[self._stage] += 1
+            yield item
+
+
+def fit_grammar(n_train=100):
+    graphs = util.get_chemgraphs()
+    return LocalSubstitutionGraphGrammarSample(radii=[0, 1, 2], thickness=1).fit(graphs[:n_train])
+
+
+def run_chains(grammar, selector, method, n_steps=100, n_chains=2, num_sample=20, seed=0):
+    """runs the chains, returns the report of one configuration"""
+    starts = util.get_chemgraphs()[200:]
+    times, counts, latencies = Counter(), Counter(), []
+    for chain in range(n_chains):
+        rng = random.Random(seed * 1000 + chain)
+        scorer = RandomEstimator()
+        scorer.rng = rng
+        if hasattr(selector, 'rng'):
+            selector.rng = rng
+        sampler = Sampler(grammar=_Timed(grammar, 'propose', {'neighbors_sample'}, times, counts),
+                          transformer=_Timed(no_transform(), 'decode', {'encode_single', 'decode', '_decode_single'}, times),
+                          scorer=_Timed(scorer, 'score', {'decision_function'}, times),
+                          selector=_Timed(selector, 'select', {'select'}, times),
+                          num_sample=num_sample, rng=rng)
+        step = getattr(sampler, method)
+        graph = starts[chain % len(starts)]
+        for i in range(n_steps):
+            start = time.perf_counter()
+            graph, score = step(graph, i)
+            latencies.append(time.perf_counter() - start)
+            if graph is None:
+                # dead end without history, start over
+                counts['restarts'] += 1
+                graph = starts[(chain + counts['restarts']) % len(starts)]
+    total = sum(latencies)
+    latencies = np.array(latencies)
+    split = {stage: times[stage] / total for stage in STAGES}
+    split['other'] = 1 - sum(split.values())
+    return {'selector': type(selector).__name__ if method == 'sample_step' else None, 'method': method,
+            'steps': len(latencies), 'seconds': total, 'steps_per_s': len(latencies) / total,
+            'proposals': counts['propose'], 'proposals_per_s': counts['propose'] / total,
+            'p50_ms': 1000 * float(np.percentile(latencies, 50)), 'p99_ms': 1000 * float(np.percentile(latencies, 99)),
+            'split': split, 'restarts': counts['restarts']}
+
+
+def configurations():
+    yield SelectMax(), 'sample_step'
+    yield SelectClassic(), 'sample_step'
+    yield SelectProbN(1), 'sample_step'
+    yield SelectMax(), 'sample_step_multi'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, default=100, help='steps per chain')
+    parser.add_argument('--chains', type=int, default=2)
+    parser.add_argument('--num-sample', type=int, default=20, help='proposals per sample_step_multi step')
+    parser.add_argument('--train', type=int, default=100, help='molecules to fit the grammar on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the reports as json')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    grammar = fit_grammar(args.train)
+    print('fit %.1fs %s' % (time.perf_counter() - start, grammar))
+    print('%-14s %-18s %8s %11s %8s %8s  %s' % ('selector', 'method', 'steps/s', 'proposals/s', 'p50 ms', 'p99 ms',
+                                                ' '.join('%7s' % s for s in STAGES + ['other'])))
+    reports = []
+    for selector, method in configurations():
+        report = run_chains(grammar, selector, method, args.steps, args.chains, args.num_sample, args.seed)
+        reports.append(report)
+        print('%-14s %-18s %8.1f %11.1f %8.1f %8.1f  %s' % (
+            report['selector'] or '-', method, report['steps_per_s'], report['proposals_per_s'],
+            report['p50_ms'], report['p99_ms'],
+            ' '.join('%6.1f%%' % (100 * report['split'][s]) for s in STAGES + ['other'])), flush=True)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({'args': vars(args), 'reports': reports}, handle, indent=1)
+
+
+if __name__ == '__main__':
+    main()
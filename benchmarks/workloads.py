@@ -0,0 +1,50 @@
+"""
+Fixed workloads for the benchmarks.
+
+a workload is a list of graphs: 'chem' are molecules from graphlearn/test/chemtest.json,
+an int n are synthetic molecule-like graphs with n nodes, about 1000 nodes per workload
+(100 graphs of 10 nodes ... 1 graph of 1000 nodes), so the times per node can be compared.
+workloads and grammars are built once per process.
+"""
+
+import functools
+import random
+import networkx as nx
+from graphlearn.util import util
+
+
+def synthetic_graph(n, seed=0):
+    """
+    molecule-like graph with n nodes: a chain with short branches (each node binds to one of
+    the 4 nodes before it) and a ring closure per 6 nodes. labels C, N, O and bonds 1, 2
+    """
+    rng = random.Random(seed)
+    graph = nx.Graph()
+    for i in range(n):
+        graph.add_node(i, label=rng.choice('CCCCNO'))
+        if i:
+            graph.add_edge(i, rng.randrange(max(0, i - 4), i), label=rng.choice('1112'))
+    for i in range(n // 6):
+        a = rng.randrange(n)
+        b = a + rng.choice([4, 5])
+        if b < n and not graph.has_edge(a, b):
+            graph.add_edge(a, b, label='1')
+    return graph
+
+
+@functools.lru_cache(maxsize=None)
+def graphs(kind, train=False):
+    """the graphs of a workload, train=True: other graphs of the same kind, e.g. to fit a grammar"""
+    if kind == 'chem':
+        chem = util.get_chemgraphs()
+        return chem[:200] if train else chem[200:250]
+    seeds = range(max(1, 1000 // kind))
+    offset = 10 ** 6 if train else 0
+    return [synthetic_graph(kind, offset + seed) for seed in seeds]
+
+
+@functools.lru_cache(maxsize=None)
+def grammar(kind, radii=(0, 1, 2), thickness=1):
+    """a sampling grammar fitted on the train graphs of a workload"""
+    from graphlearn.sample import LocalSubstitutionGraphGrammarSample
+    return LocalSubstitutionGraphGrammarSample(radii=list(radii), thickness=thickness).fit(graphs(kind, train=True))
@@ -1,93 +1,126 @@
-#!/usr/bin/python
-text='''verbose=1 # sets verbose level, is not passed to sampler
-nbit=20,
-random_state=None,
-vectorizer_complexity=3,
-radius_list=[0, 1],#asd
-thickness_list=[1, 2],
+#!/usr/bin/env python
+text='''verbose=1 # sets verbose level
+input="graphs.gspan", # gspan, .json or .jsonl file, read lazily
+num_graphs=-1, # limit number of graphs read, -1: all
+radius_list=[0, 1],
+thickness=1,
 min_cip_count=2,
 min_interface_count=2,
-input="asd.graph",
-output="model.gs",
-negative_input=None,
-lsgg_include_negatives=False,
-grammar_n_jobs=-1,
-grammar_batch_size=10,
-num_graphs=200 #limit number of graphs read by data sources
-num_graphs_neg=200'''
+max_num_substitutions=-1, # keep the most frequent cores per interface, -1: all
+n_jobs=1, # processes; 1 streams the graphs, more read them into memory first
+two_pass=False, # count the cips first, then store the ones that pass the filters (reads the input twice)
+output="model.gs", # grammar snapshot, see graphlearn.snapshot
+scorer_output=None, # also fit a OneClassEstimator on the graphs and pickle it here
+vectorizer_complexity=3,
+batch_size=100, # graphs per batch when vectorizing for the scorer
+profile=False, # print a cProfile summary to stderr
+stats=False, # print timings of the grammar stages as json to stderr'''
 
 
-# I excluded these so defaults will be used :)
-#graphtransformer=transform.GraphTransformer(),
-#feasibility_checker=feasibility.FeasibilityChecker(),
-#decomposergen=decompose.Decomposer,
-# grammar=None,
+from graphlearn.util import makeparser
+parser = makeparser.makeparser(text)
 
 
-import makeparser
-parser=makeparser.makeparser(text)
+def read(args):
+    from itertools import islice
+    from graphlearn.util.util import read_graphs
+    graphs = read_graphs(args['input'])
+    if args['num_graphs'] >= 0:
+        graphs = islice(graphs, args['num_graphs'])
+    return graphs
+
+
+def fit_grammar(args):
+    from graphlearn.sample import LocalSubstitutionGraphGrammarSample
+    grammar = LocalSubstitutionGraphGrammarSample(
+        radii=args['radius_list'],
+        thickness=args['thickness'],
+        filter_min_cip=args['min_cip_count'],
+        filter_min_interface=args['min_interface_count'],
+        filter_max_num_substitutions=None if args['max_num_substitutions'] < 0 else args['max_num_substitutions'])
+    # plain cips, the first pass of two_pass only hashes the cores
+    grammar.hash_only_keys = True
+    if args['stats']:
+        grammar.instrument()
+    graphs = read(args)
+    if args['two_pass'] and args['n_jobs'] == 1:
+        # a re-readable iterable instead of a list, the passes stream
+        graphs = Reread(args)
+    grammar.fit(graphs, n_jobs=args['n_jobs'], two_pass=args['two_pass'])
+    return grammar
+
+
+class Reread(object):
+    """iterating starts reading the input again"""
+
+    def __init__(self, args):
+        self.args = args
+
+    def __iter__(self):
+        return iter(read(self.args))
+
+
+def fit_scorer(args):
+    # vectorized in batches, only the sparse vectors are kept
+    import scipy as sp
+    from itertools import islice
+    from eden.graph import Vectorizer
+    from graphlearn.score import OneClassEstimator
+    scorer = OneClassEstimator(n_jobs=args['n_jobs'], vectorizer=Vectorizer(args['vectorizer_complexity']))
+    graphs = read(args)
+    vectors = []
+    while True:
+        batch = list(islice(graphs, args['batch_size']))
+        if not batch:
+            break
+        vectors.append(scorer.transform(batch))
+    scorer.model.fit(sp.sparse.vstack(vectors))
+    return scorer
+
+
+def main(args):
+    import json
+    import pickle
+    import sys
+    import time
+    start = time.perf_counter()
+    grammar = fit_grammar(args)
+    print(grammar)
+    grammar.save(args['output'])
+    stats = {'grammar_s': time.perf_counter() - start}
+    if args['scorer_output']:
+        start = time.perf_counter()
+        with open(args['scorer_output'], 'wb') as handle:
+            pickle.dump(fit_scorer(args), handle)
+        stats['scorer_s'] = time.perf_counter() - start
+    if args['stats']:
+        stats['grammar'] = dict(zip(['interfaces', 'cores', 'cips', 'productions'], grammar.size()))
+        stats.update(grammar.instrumentation.as_dict())
+        print(json.dumps(stats), file=sys.stderr)
 
 
 if __name__ == "__main__":
 
     # do argparse things:
-    args=vars(parser.parse_args())
+    args = vars(parser.parse_args())
 
     import os.path
     if not os.path.isfile(args['input']):
         parser.print_usage()
         print('at least provide a path to input')
-        exit()
-
-    print("*raw args")
-    print("*"*80)
-    print(args)
-
+        exit(1)
 
     # verbosity
     from eden.util import configure_logging
     import logging
-    configure_logging(logging.getLogger(),verbosity=args.pop('verbose'))
-
-
-    # handle Vectorizer:
-    from eden.graph import Vectorizer
-    args['vectorizer'] = Vectorizer(args.pop('vectorizer_complexity'))
-
-
-    # estimator, if the user is providing a negative graph set, we use
-    # the twoclass esti OO
-    import graphlearn.score as score
-    if args['negative_input']==None:
-        args['scorer']=score.OneClassEstimator(n_jobs=-1)
-    else:
-        args['scorer']=score.TwoClassEstimator(n_jobs=-1)
-
-    #args for fitting:
-    from eden.io.gspan import gspan_to_eden
-    from itertools import islice
-    fitargs={ k:args.pop(k) for k in ['lsgg_include_negatives','grammar_n_jobs','grammar_batch_size']}
-
-    if args['negative_input']!=None:
-        fitargs['negative_input'] = islice(gspan_to_eden(args.pop('negative_input')),args.pop('num_graphs_neg'))
+    configure_logging(logging.getLogger(), verbosity=args.pop('verbose'))
+
+    if args['profile']:
+        import cProfile
+        import pstats
+        import sys
+        profiler = cProfile.Profile()
+        profiler.runcall(main, args)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
     else:
-        args.pop('negative_input')
-        args.pop('num_graphs_neg')
-
-    fitargs['input'] = islice(gspan_to_eden(args.pop('input')),args.pop('num_graphs'))
-
-    #output
-    OUTFILE=args.pop('output')
-
-    print("*Sampler init")
-    print("*"*80)
-    print(args)
-
-    # CREATE SAMPLER, dumping the rest of the parsed args :)
-    from graphlearn.sample import Sampler
-    s=Sampler(**args)
-    print("*fit")
-    print("*"*80)
-    print(fitargs)
-    s.fit(**fitargs)
-    s.save(OUTFILE)
+        main(args)
@@ -1,79 +1,132 @@
-#!/usr/bin/python
-
-text='''verbose=1 # sets verbose level, is not passed to sampler
-start_graphs="asd",
-num_graphs=10,# number of graphs used
-model="model.gs",
-out="sdf",
-graph_iter=None,
-probabilistic_core_choice=True,
-score_core_choice=False,
-max_size_diff=-1,
-similarity=-1,
-n_samples=None,
-proposal_probability=False,
-batch_size=10,
-n_jobs=0,
-target_orig_cip=False,
+#!/usr/bin/env python
+
+text='''verbose=1 # sets verbose level
+start_graphs="graphs.gspan", # gspan, .json or .jsonl file, a chain starts at each graph
+num_graphs=-1, # limit number of start graphs, -1: all
+grammar="model.gs", # grammar snapshot written by graphlearn_fit.py
+scorer=None, # pickled scorer written by graphlearn_fit.py, default: fit a OneClassEstimator on the start graphs
+vectorizer_complexity=3, # of the default scorer
+selector="SelectClassic", # SelectClassic, SelectMax or SelectProbN
 n_steps=50,
-quick_skip_orig_cip=False,
-improving_threshold=-1,
-improving_linear_start=0,
-accept_static_penalty=0.0,
-accept_min_similarity=0.0,
-select_cip_max_tries=20,
 burnin=0,
-backtrack=0,
-include_seed=False,
-keep_duplicates=False,
-monitor=False,
-init_only=False,'''
+emit=1, # after burnin every emit-th graph is written
+num_sample=1, # proposals per step, more than 1 takes the best of them (sample_step_multi)
+history_depth=-1, # graphs a chain can backtrack to, -1: all
+n_jobs=1, # processes running chains
+seed=0, # chains are seeded by (seed, index), results do not depend on n_jobs
+out="samples.jsonl", # a node-link graph per line, with the chain and position, written as chains finish
+profile=False, # print a cProfile summary of this process to stderr
+stats=False, # print acceptance, throughput and stage timings as json to stderr'''
 
 
 # arg parse busines
-import makeparser
-parser= makeparser.makeparser(text)
+from graphlearn.util import makeparser
+parser = makeparser.makeparser(text)
 
-if __name__ == "__main__":
 
-    args=vars(parser.parse_args())
-    import os.path
-    if not os.path.isfile(args['start_graphs']):
-        parser.print_usage()
-        print('at least provide a path to input')
-        exit()
+def read(args):
+    from itertools import islice
+    from graphlearn.util.util import read_graphs
+    graphs = read_graphs(args['start_graphs'])
+    if args['num_graphs'] >= 0:
+        graphs = islice(graphs, args['num_graphs'])
+    return graphs
 
-    print("*raw args")
-    print("*" * 80)
-    print(args)
 
-    # verbosity
-    from eden.util import configure_logging
-    import logging
-    configure_logging(logging.getLogger(),verbosity=args['verbose'])
-    args.pop('verbose')
+def make_selector(name):
+    from graphlearn import choice
+    if name == 'SelectProbN':
+        return choice.SelectProbN(1)
+    return {'SelectClassic': choice.SelectClassic, 'SelectMax': choice.SelectMax}[name]()
 
-    # graphs
-    from eden.io.gspan import gspan_to_eden
-    from itertools import islice
-    args['graph_iter'] = islice(gspan_to_eden(args.pop('start_graphs')),args.pop('num_graphs'))
 
+def load_scorer(args):
+    import pickle
+    if args['scorer']:
+        with open(args['scorer'], 'rb') as handle:
+            scorer = pickle.load(handle)
+    else:
+        from eden.graph import Vectorizer
+        from graphlearn.score import OneClassEstimator
+        scorer = OneClassEstimator(vectorizer=Vectorizer(args['vectorizer_complexity'])).fit(list(read(args)))
+    # chains score a few graphs at a time, they run in parallel instead
+    if hasattr(scorer, 'n_jobs'):
+        scorer.n_jobs = 1
+    return scorer
 
-    #output
-    OUTFILE=args.pop('out')
-    MODEL=args.pop('model')
 
-    # CREATE SAMPLER
+def main(args):
+    import json
+    import os
+    import sys
+    import tempfile
+    import time
+    from graphlearn import snapshot
     from graphlearn.sample import Sampler
-    s=Sampler()
-    s.load(MODEL)
-    results=s.transform(**args)
+    from graphlearn.util.trace import Trace, JSONLSink
+    from graphlearn.util.util import no_transform, node_link_data
+
+    # the grammar is loaded once, chains in worker processes share the memory-mapped snapshot
+    grammar = snapshot.load(args['grammar'])
+    sampler = Sampler(grammar=grammar, scorer=load_scorer(args), selector=make_selector(args['selector']),
+                      transformer=no_transform(), n_steps=args['n_steps'], burnin=args['burnin'],
+                      emit=args['emit'], num_sample=args['num_sample'], history_depth=None if args['history_depth'] < 0 else args['history_depth'])
+    if args['stats']:
+        # workers append their records to the file, they are aggregated at the end
+        handle, trace_path = tempfile.mkstemp(prefix='graphlearn-trace-', suffix='.jsonl')
+        os.close(handle)
+        sampler.trace = Trace(JSONLSink(trace_path))
+        grammar.instrument()
 
+    start = time.perf_counter()
+    n_chains = n_graphs = 0
+    with open(args['out'], 'w') as out:
+        for i, graphs in sampler.sample_many(read(args), n_jobs=args['n_jobs'], seed=args['seed']):
+            for j, graph in enumerate(graphs):
+                if graph is None:
+                    continue  # the chain got stuck
+                out.write(json.dumps({'chain': i, 'position': j, 'graph': node_link_data(graph)}) + '\n')
+                n_graphs += 1
+            out.flush()
+            n_chains += 1
+    seconds = time.perf_counter() - start
+    print('%d chains, %d graphs written to %s in %.1fs' % (n_chains, n_graphs, args['out'], seconds))
 
-    import graphlearn.utils.draw_openbabel as ob
+    if args['stats']:
+        sampler.trace.sink.close()
+        trace = Trace(sink=lambda record: None)
+        if os.path.exists(trace_path):
+            with open(trace_path) as handle:
+                for line in handle:
+                    trace.emit(json.loads(line))
+            os.remove(trace_path)
+        stats = {'chains': n_chains, 'graphs': n_graphs, 'seconds': seconds, 'trace': trace.stats()}
+        if args['n_jobs'] == 1:
+            # with more processes the grammar stages are timed in the workers
+            stats['grammar'] = grammar.instrumentation.as_dict()
+        print(json.dumps(stats), file=sys.stderr)
 
-    for i,samplepath in enumerate(results):
-        for j,graph in enumerate(samplepath):
-            with open(str(i)+'.'+str(j)+'.'+OUTFILE,'w') as f:
-                f.write(ob.graph_to_molfile(graph))
 
+if __name__ == "__main__":
+
+    args = vars(parser.parse_args())
+    import os.path
+    if not os.path.isfile(args['start_graphs']) or not os.path.isfile(args['grammar']):
+        parser.print_usage()
+        print('at least provide a path to start graphs and the grammar')
+        exit(1)
+
+    # verbosity
+    from eden.util import configure_logging
+    import logging
+    configure_logging(logging.getLogger(), verbosity=args.pop('verbose'))
+
+    if args['profile']:
+        import cProfile
+        import pstats
+        import sys
+        profiler = cProfile.Profile()
+        profiler.runcall(main, args)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+    else:
+        main(args)
@@ -21,6 +21,7 @@ class SelectMaxN(object):
 
 
 class SelectClassic(object):
+    rng = random
 
     def __init__(self, reg=0.5):
         self.reg = reg
@@ -31,7 +32,7 @@ class SelectClassic(object):
 
         new = (proposals[0], scores[0])
         old = (proposals[1], scores[1])
-        rnd = random.random()
+        rnd = self.rng.random()
         if scores[0] <= 0 or scores[1] <= 0:
             return new if scores[0] < scores[1] else old
         if scores[0] > scores[1]:
@@ -44,6 +45,7 @@ class SelectClassic(object):
 
 
 class SelectProbN(object):
+    rng = random
 
     def __init__(self, n):
         self.n = n
@@ -53,9 +55,9 @@ class SelectProbN(object):
         scores = [s - neg for s in scores]
         stuff = list(zip(proposals, scores))
         if self.n > 1:
-            return list(zip(*random.choices(stuff, scores, k=self.n)))
+            return list(zip(*self.rng.choices(stuff, scores, k=self.n)))
         else:
-            return random.choices(stuff, scores, k=1)[0]
+            return self.rng.choices(stuff, scores, k=1)[0]
 
 
 def test_SelectMaxN():
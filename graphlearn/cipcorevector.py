@@ -41,10 +41,11 @@ class LsggCoreVec(LSGG):
         return node_vectors[core_ids,:].sum(axis=0)
 
     def _get_cips(self, graph, filter = lambda x:x):
-        exgraph = cip._edge_to_vertex(graph)
+        decomposition = self._decompose(graph)
+        exgraph = decomposition.exgraph
         matrix = vertex_vec(exgraph, self.core_vec_decomposer) 
-        for core in self._get_cores(graph):
-            x = self._get_cip(core=core, graph=graph)
+        for core in self._get_cores(decomposition):
+            x = self._get_cip(core=core, graph=decomposition)
             if x and filter(x.graph):
                 x.core_vec  = self.make_core_vector(x.graph, exgraph, matrix)
                 yield x
@@ -0,0 +1,150 @@
+"""
+Vectorized core enumeration.
+
+core_sets gives the same cores as lsgg_core_interface_pair.get_cores and
+get_cores_closeloop, in the same order, as arrays of node indices in BFS order
+(see Decomposition.adjacency). get_cores makes the same subgraphs of them.
+instead of one python BFS per root, the BFS of all roots advance together on
+the CSR adjacency of the expanded graph, one array step per level. the rule
+that adds an edge node connected twice to the border is evaluated once for
+all (root, node) pairs.
+
+different roots and radii often give the same node set (small rings, a radius that
+covers a whole branch). unique_core_sets and get_unique_cores give each node set once,
+with the number of times it was found.
+
+    for core in csrcores.get_cores(decomposition, radii):  # subgraphs, like get_cores
+    for core, multiplicity in csrcores.get_unique_cores(decomposition, radii):
+"""
+
+import numpy as np
+from graphlearn.lsgg_core_interface_pair import decompose
+
+# max roots * expanded nodes of a distance table, larger graphs are done in chunks of roots
+CHUNK_CELLS = 2 ** 22
+
+
+def bfs(indptr, indices, sources, cutoff):
+    """
+    BFS from each group of sources, bounded by cutoff.
+    sources: list of lists of node indices, a group starts at its nodes (at level 0)
+    returns (group, node, level) arrays, sorted by group and in BFS order within a group
+    (the order of networkx' _single_shortest_path_length), and the distance table
+    dist[group, node] (-1: not reached)
+    """
+    n = len(indptr) - 1
+    group = np.repeat(np.arange(len(sources)), [len(s) for s in sources])
+    node = np.array([v for s in sources for v in s], dtype=np.int64)
+    dist = np.full((len(sources), n), -1, dtype=np.int16)
+    dist[group, node] = 0
+    first = np.empty((len(sources), n), dtype=np.int64)
+    groups, nodes, levels = [group], [node], [np.zeros(len(node), dtype=np.int16)]
+    for level in range(1, cutoff + 1):
+        group, node = _expand(indptr, indices, group, node)
+        new = dist[group, node] < 0
+        group, node = group[new], node[new]
+        if len(node) == 0:
+            break
+        # a node is found by its first neighbor in the previous level
+        position = np.arange(len(node))
+        first[group, node] = len(node)
+        np.minimum.at(first, (group, node), position)
+        found = first[group, node] == position
+        group, node = group[found], node[found]
+        dist[group, node] = level
+        groups.append(group)
+        nodes.append(node)
+        levels.append(np.full(len(node), level, dtype=np.int16))
+    group, node, level = np.concatenate(groups), np.concatenate(nodes), np.concatenate(levels)
+    order = np.argsort(group, kind='stable')
+    return group[order], node[order], level[order], dist
+
+
+def _expand(indptr, indices, group, node):
+    """(group, neighbor) for each neighbor of each node, in order"""
+    starts = indptr[node]
+    counts = indptr[node + 1] - starts
+    total = int(counts.sum())
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(group, counts), indices[np.repeat(starts, counts) + offsets]
+
+
+def _twice_connected(indptr, indices, group, node, level, dist):
+    """for each (group, node): it has exactly 2 neighbors one level closer to the sources"""
+    counts = indptr[node + 1] - indptr[node]
+    pair = np.repeat(np.arange(len(node)), counts)
+    g, neighbor = _expand(indptr, indices, group, node)
+    closer = dist[g, neighbor] == level[pair] - 1
+    return (level > 0) & (np.bincount(pair, weights=closer, minlength=len(node)) == 2)
+
+
+def _group_cores(indptr, indices, sources, radii):
+    """the cores (node index arrays) of each group of sources, per group in order of radii"""
+    n = len(indptr) - 1
+    cutoff = max(radii) + 1
+    chunk = max(1, CHUNK_CELLS // max(n, 1))
+    for start in range(0, len(sources), chunk):
+        group, node, level, dist = bfs(indptr, indices, sources[start:start + chunk], cutoff)
+        twice = _twice_connected(indptr, indices, group, node, level, dist)
+        groups = np.arange(dist.shape[0] + 1)
+        cores = []
+        for r in radii:
+            # dist <= r, or an edge node twice connected to the border (dist == r)
+            selected = (level <= r) | ((level == r + 1) & twice)
+            cores.append((node[selected], np.searchsorted(group[selected], groups).tolist()))
+        for g in range(dist.shape[0]):
+            for core_nodes, bounds in cores:
+                if bounds[g + 1] - bounds[g] < n:
+                    yield core_nodes[bounds[g]:bounds[g + 1]]
+
+
+def core_sets(graph, radii, closeloop=False):
+    """
+    node index arrays of the cores of get_cores(graph, radii), or get_cores_closeloop,
+    indices into Decomposition.adjacency()[0].
+    graph: an unexpanded graph or its Decomposition
+    """
+    decomposition = decompose(graph)
+    nodes, indptr, indices = decomposition.adjacency()
+    index = {v: i for i, v in enumerate(nodes)}
+    sources = [[index[root]] for root in decomposition.graph.nodes()]
+    if closeloop:
+        deadends = [node for node, deg in decomposition.graph.degree() if deg == 1]
+        if len(deadends) > 1:
+            # same pairs (and start order of a pair) as get_cores_closeloop
+            sources += [[index[v] for v in frozenset([a, b])]
+                        for i, a in enumerate(deadends) for b in deadends[i:]]
+    return _group_cores(indptr, indices, sources, radii)
+
+
+def get_cores(graph, radii, closeloop=False):
+    """the cores of core_sets as subgraphs of the expanded graph, like lsgg_core_interface_pair.get_cores"""
+    decomposition = decompose(graph)
+    nodes = decomposition.adjacency()[0]
+    exgraph = decomposition.exgraph
+    for core in core_sets(decomposition, radii, closeloop):
+        yield exgraph.subgraph([nodes[i] for i in core.tolist()])
+
+
+def unique_core_sets(graph, radii, closeloop=False):
+    """
+    [(node index array, multiplicity)] of the distinct node sets of core_sets,
+    in order of their first occurrence
+    """
+    found = {}
+    for core in core_sets(graph, radii, closeloop):
+        key = frozenset(core.tolist())
+        if key in found:
+            found[key][1] += 1
+        else:
+            found[key] = [core, 1]
+    return [(core, multiplicity) for core, multiplicity in found.values()]
+
+
+def get_unique_cores(graph, radii, closeloop=False):
+    """[(subgraph, multiplicity)] of unique_core_sets, see get_cores"""
+    decomposition = decompose(graph)
+    nodes = decomposition.adjacency()[0]
+    exgraph = decomposition.exgraph
+    return [(exgraph.subgraph([nodes[i] for i in core.tolist()]), multiplicity)
+            for core, multiplicity in unique_core_sets(decomposition, radii, closeloop)]
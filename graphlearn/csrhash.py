@@ -0,0 +1,125 @@
+"""
+Vectorized graph hashing.
+
+CSRGraphHasher computes the same values as GraphHasher, but instead of one
+python BFS per node, the edges are read once into index arrays and the
+bounded distances of all nodes are found together with frontier products
+(dense for the typical core or interface, CSR for large graphs).
+Select it on the grammar:
+
+    LocalSubstitutionGraphGrammar(hasher=CSRGraphHasher())
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+from graphlearn.lsgg_core_interface_pair import GraphHasher
+
+
+def edge_index(graph):
+    """nodes of graph (in iteration order) and an (m,2) array of edges as node indices"""
+    nodes = list(graph.nodes())
+    index = {n: i for i, n in enumerate(nodes)}
+    edges = np.array([(index[a], index[b]) for a, b in graph.edges()], dtype=np.int64).reshape(-1, 2)
+    return nodes, edges
+
+
+def to_csr(n, edges):
+    """symmetric CSR adjacency, self loops are dropped"""
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    rows = np.concatenate((edges[:, 0], edges[:, 1]))
+    cols = np.concatenate((edges[:, 1], edges[:, 0]))
+    adj = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n, n))
+    adj.data[:] = 1  # parallel edges were summed
+    return adj
+
+
+def bounded_distances(n, edges, depth, dense_limit=512):
+    """(source, target, distance) arrays for all pairs with distance <= depth, sorted by source"""
+    if n <= dense_limit:
+        adj = np.zeros((n, n), dtype=np.float32)
+        adj[edges[:, 0], edges[:, 1]] = 1
+        adj[edges[:, 1], edges[:, 0]] = 1
+        np.fill_diagonal(adj, 0)
+        return _bounded_distances_dense(adj, depth)
+    return _bounded_distances_csr(to_csr(n, edges), depth)
+
+
+def _bounded_distances_dense(adj, depth):
+    n = adj.shape[0]
+    dist = np.full((n, n), -1, dtype=np.int64)
+    np.fill_diagonal(dist, 0)
+    frontier = np.eye(n, dtype=np.float32)
+    for d in range(1, depth + 1):
+        new = (frontier @ adj > 0) & (dist < 0)
+        if not new.any():
+            break
+        dist[new] = d
+        frontier = new.astype(np.float32)
+    source, target = np.nonzero(dist >= 0)
+    return source, target, dist[source, target]
+
+
+def _bounded_distances_csr(adj, depth):
+    n = adj.shape[0]
+    visited = sparse.identity(n, dtype=np.int32, format='csr')
+    frontier = visited
+    sources, targets, dists = [np.arange(n)], [np.arange(n)], [np.zeros(n, dtype=np.int64)]
+    for d in range(1, depth + 1):
+        reached = frontier @ adj
+        reached.data[:] = 1
+        new = (reached - reached.multiply(visited)).tocsr()
+        new.eliminate_zeros()
+        if new.nnz == 0:
+            break
+        s, t = new.nonzero()
+        sources.append(s)
+        targets.append(t)
+        dists.append(np.full(len(s), d, dtype=np.int64))
+        visited = visited + new
+        frontier = new
+    source, target, dist = np.concatenate(sources), np.concatenate(targets), np.concatenate(dists)
+    order = np.argsort(source, kind='stable')
+    return source[order], target[order], dist[order]
+
+
+class CSRGraphHasher(GraphHasher):
+    """GraphHasher with vectorized neighborhood hashing, the hashes are identical"""
+
+    def graph_hash(self, graph, get_node_label=lambda id, node: node['hlabel']):
+        nodes, edges = edge_index(graph)
+        labels = [self.node_code(get_node_label(n, graph.nodes[n])) for n in nodes]
+        node_hashes = self._neighborhood_hashes(len(nodes), edges, labels)
+
+        l = [(min(a, b), max(a, b)) for a, b in zip([node_hashes[i] for i in edges[:, 0]],
+                                                    [node_hashes[i] for i in edges[:, 1]])]
+        l.sort()
+
+        degree = np.bincount(edges.ravel(), minlength=len(nodes))
+        z = [labels[i] for i in np.flatnonzero(degree == 0)]
+        z.sort()
+        return self.fingerprint([len(l)] + [h for edge in l for h in edge] + z)
+
+    def _node_hashes(self, graph, get_node_label):
+        nodes, edges = edge_index(graph)
+        labels = [self.node_code(get_node_label(n, graph.nodes[n])) for n in nodes]
+        return dict(zip(nodes, self._neighborhood_hashes(len(nodes), edges, labels)))
+
+    def _neighborhood_hashes(self, n, edges, labels):
+        if n == 0:
+            return []
+        source, target, dist = bounded_distances(n, edges, self.depth)
+
+        # labels may be wider than 64 bit -> sort by rank of the label
+        uniq = sorted(set(labels))
+        rank = {l: i for i, l in enumerate(uniq)}
+        label_rank = np.array([rank[l] for l in labels], dtype=np.int64)[target]
+
+        # sort each neighborhood by (label, distance) like GraphHasher does
+        order = np.lexsort((dist, label_rank, source))
+        token_ids = (label_rank * (self.depth + 1) + dist)[order]
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(source, minlength=n))))
+
+        # one token 'label,distance' per (label, distance), joined per node
+        tokens = np.array([b'%d,%d' % (l, d) for l in uniq for d in range(self.depth + 1)], dtype=object)
+        return [self._digest(b','.join(tokens[token_ids[bounds[i]:bounds[i + 1]]].tolist()))
+                for i in range(n)]
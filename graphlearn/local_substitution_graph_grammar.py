@@ -2,16 +2,30 @@
 
 """Provides the graph grammar class."""
 
-from collections import defaultdict
-from graphlearn import lsgg_core_interface_pair
+from collections import defaultdict, Counter
+from types import SimpleNamespace
+from graphlearn import lsgg_core_interface_pair, csrcores
+import copy
 import logging
 
 logger = logging.getLogger(__name__)
-from graphlearn.util.multi import mpmap
+from graphlearn.util.multi import get_pool, WorkerPool
+from graphlearn.util.instrument import Instrumentation, OFF
 
 
 class LocalSubstitutionGraphGrammarCore(object):
 
+    # timers and counters of the stages, see instrument()
+    instrumentation = OFF
+    # grammars saved before count_duplicate_cores counted every occurrence
+    count_duplicate_cores = True
+    # fit(two_pass=True) may hash the cores of _get_weighted_cores instead of building cips.
+    # opt in (class or instance) only where the cips are the plain CoreInterfacePairs of the
+    # base _get_cips and _get_cip, other grammars count and store what their _get_cips makes
+    hash_only_keys = False
+    # neighbors keep a Substitution in graph.graph['substitution'], see score.IncrementalVectorizer
+    record_substitutions = False
+
     def __init__(self,
                  radii=[0, 1],
                  thickness=1,
@@ -19,7 +33,9 @@ class LocalSubstitutionGraphGrammarCore(object):
                  filter_min_interface=2,
                  filter_max_num_substitutions=None,
                  nodelevel_radius_and_thickness=True,
-                 combine_cips=False
+                 combine_cips=False,
+                 hasher=None,
+                 count_duplicate_cores=True
                  ):
         """Parameters
         ----------
@@ -28,6 +44,10 @@ class LocalSubstitutionGraphGrammarCore(object):
         cip_root_all : include edges as possible roots
         double_decomp_args: interpret options for radius and thickness
                 as half step (default is full step)
+        hasher: lsgg_core_interface_pair.GraphHasher, e.g. GraphHasher(bits=128)
+        count_duplicate_cores: a node set that is the core of several roots/radii of a graph
+                is counted that many times (default), False counts it once per graph.
+                either way its cip is built once and neighbors substitutes it once
         """
         self.radii = radii
         self.thickness = thickness
@@ -35,6 +55,8 @@ class LocalSubstitutionGraphGrammarCore(object):
         self.filter_min_interface = filter_min_interface
         self.filter_max_num_substitutions = filter_max_num_substitutions
         self.combine_cips = combine_cips
+        self.hasher = hasher or lsgg_core_interface_pair.GraphHasher()
+        self.count_duplicate_cores = count_duplicate_cores
 
         self.productions = defaultdict(dict)
         if nodelevel_radius_and_thickness:
@@ -44,13 +66,36 @@ class LocalSubstitutionGraphGrammarCore(object):
         self.radii = [i * 2 for i in self.radii]
         self.thickness = 2 * self.thickness
 
+    def instrument(self, enable=True):
+        """
+        time and count the stages of fit and neighbors from now on, returns the
+        Instrumentation (also in self.instrumentation), see graphlearn.util.instrument.
+        enable=False switches it off again.
+
+        stages: decompose, cores, cip, hash (within cip), store, filter, merge,
+        interface_map, isomorphism, compose, revert.
+        counts: cips, substitutions, substitution_failed.
+        with fit(n_jobs>1) the shards are processed in workers, their stages are not counted.
+        """
+        self.instrumentation = Instrumentation() if enable else OFF
+        return self.instrumentation
+
     def get(self):
         return [[(self.productions[interface][core].interface, self.productions[interface][core].graph) for core in self.productions[interface]] for interface in self.productions]
 
     ###########
     # FITTING
     ##########
-    def fit(self, graphs):
+    def fit(self, graphs, two_pass=False):
+        """
+        two_pass: first only count (interface_hash, core_hash) of all cips,
+            then extract and store the cips that pass the filters. this
+            needs far less memory when most cips are filtered.
+            graphs are iterated twice. set hash_only_keys to skip building
+            the cips of the first pass.
+        """
+        if two_pass:
+            return self._fit_two_pass(graphs)
         self._store_graphs(graphs)
         self._filter_cips()
         return self
@@ -64,58 +109,168 @@ class LocalSubstitutionGraphGrammarCore(object):
             self._store_cip(cip)
 
     def _get_cips(self, graph):
+        """the cips of graph, a cip whose core was found m times is in the list m times
+        (the same object) unless not count_duplicate_cores"""
+        return [cip for cip, multiplicity in self._get_weighted_cips(graph)
+                for i in range(self._multiplicity(multiplicity))]
+
+    def _get_weighted_cips(self, graph):
+        """[(cip, multiplicity)], one cip per distinct core"""
         base_cips = []
         combined_cips = []
 
-        for core in self._get_cores(graph):
-            x = self._get_cip(core=core, graph=graph)
+        # expand the graph once, all cores and cips share the decomposition
+        with self.instrumentation.timer('decompose'):
+            decomposition = self._decompose(graph)
+        for core, multiplicity in self._get_weighted_cores(decomposition):
+            x = self._get_cip(core=core, graph=decomposition)
             if x:
+                self.instrumentation.count('cips')
                 if self.combine_cips:
-                    for y in base_cips:
+                    for y, multiplicity_y in base_cips:
                         xy = lsgg_core_interface_pair.combine_cips(x, y)
                         if xy:
-                            combined_cips.append(xy)
+                            combined_cips.append((xy, multiplicity * multiplicity_y))
 
-                base_cips.append(x)
+                base_cips.append((x, multiplicity))
 
         return base_cips + combined_cips
 
+    def _multiplicity(self, multiplicity):
+        return multiplicity if self.count_duplicate_cores else 1
+
+    def _decompose(self, graph):
+        return lsgg_core_interface_pair.decompose(graph, hasher=self.hasher)
+
     def _get_cip(self, core=None, graph=None):
-        return lsgg_core_interface_pair.CoreInterfacePair(
-            core=core,
-            graph=graph,
-            thickness=self.thickness)
+        with self.instrumentation.timer('cip'):
+            return lsgg_core_interface_pair.CoreInterfacePair(
+                core=core,
+                graph=self._decompose(graph),
+                thickness=self.thickness,
+                instrumentation=self.instrumentation)
 
     def _store_cip(self, cip):
-        # setdefault is a fun function
-        self.productions[cip.interface_hash].setdefault(cip.core_hash, cip).count += 1
-
-    def _filter_cips(self):
-        self._filter_cips_by_counts()
-        if self.filter_max_num_substitutions is not None:
-            self._filter_cips_by_rank()
-        # remove interfaces with few substitutions
-        for interface in list(self.productions.keys()):
-            if len(self.productions[interface]) < self.filter_min_interface:
-                self.productions.pop(interface)
+        # the grammar keeps a compact copy of the first cip of each kind
+        with self.instrumentation.timer('store'):
+            cips = self.productions[cip.interface_hash]
+            if cip.core_hash not in cips:
+                cips[cip.core_hash] = cip.compact()
+            cips[cip.core_hash].count += 1
+
+    def _merge_productions(self, productions, other):
+        """add the cips of other to productions, the cips in productions are kept as representatives"""
+        with self.instrumentation.timer('merge'):
+            for interface, cips in other.items():
+                target = productions[interface]
+                for core, cip in cips.items():
+                    if core in target:
+                        self._merge_cip(target[core], cip)
+                    else:
+                        target[core] = cip
+        return productions
+
+    def _merge_cip(self, grammar_cip, cip):
+        grammar_cip.count += cip.count
+
+    def _fit_two_pass(self, graphs):
+        if iter(graphs) is graphs:
+            graphs = list(graphs)
+        counts = self._production_counts() + self._count_cip_keys(graphs)
+        survivors = self._surviving_keys(counts)
+        self._store_surviving_graphs(graphs, survivors)
+        self._finish_two_pass(counts, survivors)
+        return self
 
-    def _filter_cips_by_counts(self):
-        for interface in list(self.productions.keys()):
-            for core in list(self.productions[interface].keys()):
-                if self.productions[interface][core].count < self.filter_min_cip:
-                    self.productions[interface].pop(core)
+    def _production_counts(self):
+        return Counter({(interface, core): cip.count
+                        for interface in self.productions for core, cip in self.productions[interface].items()})
 
-    def _filter_cips_by_rank(self):
-        for interface in list(self.productions.keys()):
-            cores = list(self.productions[interface].keys())
+    def _count_cip_keys(self, graphs):
+        """Counter over (interface_hash, core_hash) of the cips in graphs"""
+        counts = Counter()
+        for graph in graphs:
+            counts.update(self._get_cip_keys(graph))
+        return counts
+
+    def _fast_cip_keys(self):
+        # the hash-only shortcut knows how plain CoreInterfacePairs are hashed
+        return self.hash_only_keys and not self.combine_cips
+
+    def _get_cip_keys(self, graph):
+        if not self._fast_cip_keys():
+            return [(cip.interface_hash, cip.core_hash) for cip in self._get_cips(graph)]
+        decomposition = self._decompose(graph)
+        return [key for core, multiplicity in self._get_weighted_cores(decomposition)
+                for key in [lsgg_core_interface_pair.cip_hashes(core, decomposition, self.thickness)]
+                * self._multiplicity(multiplicity)]
+
+    def _surviving_keys(self, counts):
+        """the keys that pass all filters, given the counts"""
+        productions = defaultdict(dict)
+        for (interface, core), count in counts.items():
+            productions[interface][core] = SimpleNamespace(count=count)
+        self._filter_cips(productions)
+        return {(interface, core) for interface in productions for core in productions[interface]}
+
+    def _store_surviving_graphs(self, graphs, survivors):
+        interfaces = {interface for interface, core in survivors}
+        for graph in graphs:
+            for cip in self._get_surviving_cips(graph, survivors, interfaces):
+                self._store_cip(cip)
+
+    def _get_surviving_cips(self, graph, survivors, interfaces):
+        if not self._fast_cip_keys():
+            return [cip for cip in self._get_cips(graph) if (cip.interface_hash, cip.core_hash) in survivors]
+        # most cips are dropped by interface, their core is not hashed and no cip is built
+        decomposition = self._decompose(graph)
+        cips = []
+        for core, multiplicity in self._get_weighted_cores(decomposition):
+            if lsgg_core_interface_pair.cip_interface_hash(core, decomposition, self.thickness) in interfaces:
+                cip = self._get_cip(core, decomposition)
+                if (cip.interface_hash, cip.core_hash) in survivors:
+                    cips += [cip] * self._multiplicity(multiplicity)
+        return cips
+
+    def _finish_two_pass(self, counts, survivors):
+        # stored cips get their total count, cips that were already in the grammar may be dropped
+        for interface in list(self.productions):
+            cips = self.productions[interface]
+            for core in list(cips):
+                if (interface, core) in survivors:
+                    cips[core].count = counts[(interface, core)]
+                else:
+                    cips.pop(core)
+            if not cips:
+                self.productions.pop(interface)
+
+    def _filter_cips(self, productions=None):
+        productions = self.productions if productions is None else productions
+        with self.instrumentation.timer('filter'):
+            self._filter_cips_by_counts(productions)
+            if self.filter_max_num_substitutions is not None:
+                self._filter_cips_by_rank(productions)
+            # remove interfaces with few substitutions
+            for interface in list(productions.keys()):
+                if len(productions[interface]) < self.filter_min_interface:
+                    productions.pop(interface)
+
+    def _filter_cips_by_counts(self, productions):
+        for interface in list(productions.keys()):
+            for core in list(productions[interface].keys()):
+                if productions[interface][core].count < self.filter_min_cip:
+                    productions[interface].pop(core)
+
+    def _filter_cips_by_rank(self, productions):
+        for interface in list(productions.keys()):
+            cores = list(productions[interface].keys())
             if self.filter_max_num_substitutions < len(cores):
-                counts = [self.productions[interface][core].count for core in cores]
+                counts = [productions[interface][core].count for core in cores]
                 sorted_counts = sorted(counts, reverse=True)
                 count_threshold = sorted_counts[self.filter_max_num_substitutions - 1]
-                for core in list(self.productions[interface].keys()):
-                    if self.productions[interface][core].count < count_threshold:
-                        self.productions[interface].pop(core)
-            cores = list(self.productions[interface].keys())
+                for core in list(productions[interface].keys()):
+                    if productions[interface][core].count < count_threshold:
+                        productions[interface].pop(core)
 
     ##############
     #  APPLYING A PRODUCTION
@@ -131,16 +286,42 @@ class LocalSubstitutionGraphGrammarCore(object):
     def _substitute_core(self, graph, cip, cip_):
         return lsgg_core_interface_pair.substitute_core(graph, cip, cip_)
 
+    def _substitute_cores(self, graph, cip, congruent_cips):
+        """lazily substitute the core of cip by each of the congruent_cips, None where it fails"""
+        if type(self)._substitute_core is not LocalSubstitutionGraphGrammarCore._substitute_core:
+            # subclass substitutes its own way
+            return (self._substitute_core(graph, cip, cip_) for cip_ in congruent_cips)
+        return lsgg_core_interface_pair.substitute_cores(graph, cip, congruent_cips, self.instrumentation,
+                                                         record=self.record_substitutions)
+
     def neighbors(self, graph):
         """iterator over all neighbors of graph (that are conceiveable by the grammar)"""
+        # _get_cips repeats the cip of a duplicate core, it would propose the same graphs again
+        seen = set()
         for cip in self._get_cips(graph):
-            for congruent_cip in self._get_congruent_cips(cip):
-                graph_ = self._substitute_core(graph, cip, congruent_cip)
+            if id(cip) in seen:
+                continue
+            seen.add(id(cip))
+            for graph_ in self._substitute_cores(graph, cip, self._get_congruent_cips(cip)):
                 if graph_ is not None:
                     yield graph_
 
     def _get_cores(self, graph):
-        return [core for core in lsgg_core_interface_pair.get_cores(graph, self.radii) if core]
+        """all cores of graph, a node set is in the list as often as it is found"""
+        with self.instrumentation.timer('cores'):
+            return [core for core in csrcores.get_cores(self._decompose(graph), self.radii) if core]
+
+    def _get_weighted_cores(self, graph):
+        """[(core, multiplicity)] of the distinct node sets of _get_cores, in order of first occurrence"""
+        found = {}
+        for core in self._get_cores(graph):
+            key = frozenset(core)
+            if key in found:
+                found[key][1] += 1
+            else:
+                found[key] = [core, 1]
+        self.instrumentation.count('duplicate_cores', sum(multiplicity - 1 for core, multiplicity in found.values()))
+        return [(core, multiplicity) for core, multiplicity in found.values()]
 
     def __repr__(self):
         return "interfaces %d cores: %d " % \
@@ -150,10 +331,11 @@ class LocalSubstitutionGraphGrammarCore(object):
 class LocalSubstitutionGraphGrammar(LocalSubstitutionGraphGrammarCore):
 
     def neighbors_core(self, graph, core):
-        """iterator over all neighbors of graph (that are conceiveable by the grammar)"""
-        cip = self._get_cip(core, graph)
-        for congruent_cip in self._get_congruent_cips(cip):
-            graph_ = self._substitute_core(graph, cip, congruent_cip)
+        """iterator over all neighbors of graph (that are conceiveable by the grammar)
+        graph may also be a Decomposition, see lsgg_core_interface_pair.decompose"""
+        decomposition = self._decompose(graph)
+        cip = self._get_cip(core, decomposition)
+        for graph_ in self._substitute_cores(decomposition.graph, cip, self._get_congruent_cips(cip)):
             if graph_ is not None:
                 yield graph_
 
@@ -196,17 +378,114 @@ class LocalSubstitutionGraphGrammar(LocalSubstitutionGraphGrammarCore):
         txt += '#production-rules: %5d' % n_productions
         return txt
 
-    def fit(self, graphs, n_jobs=1):
+    def fit(self, graphs, n_jobs=1, shard_size=None, two_pass=False):
+        """
+        n_jobs: number of processes (-1: all cpus), each fits a partial grammar on a shard
+            of the graphs, the partial grammars are merged here in order of
+            the shards as they arrive. the result is the same as for n_jobs=1
+        shard_size: graphs per shard, default: 4 shards per process
+        two_pass: see LocalSubstitutionGraphGrammarCore.fit, both passes run
+            on the shards
+        """
         if n_jobs == 1:
-            return super(LocalSubstitutionGraphGrammar, self).fit(graphs)
+            return super(LocalSubstitutionGraphGrammar, self).fit(graphs, two_pass=two_pass)
+
+        # -1 becomes the number of cpus before it sizes the shards
+        n_jobs = get_pool(n_jobs).processes
+        graphs = list(graphs)
+        shard_size = shard_size or max(1, -(-len(graphs) // (4 * n_jobs)))
+        shards = [graphs[i:i + shard_size] for i in range(0, len(graphs), shard_size)]
+
+        # workers get a copy without productions, each partial grammar is pickled once
+        worker = copy.copy(self)
+        worker.productions = None
+        if not two_pass:
+            for partial in get_pool(n_jobs).imap(worker._fit_shard, shards, chunksize=1):
+                self._merge_productions(self.productions, partial)
+            self._filter_cips()
+            return self
+
+        counts = self._production_counts()
+        for shard_counts in get_pool(n_jobs).imap_unordered(worker._count_cip_keys, shards, chunksize=1):
+            counts.update(shard_counts)
+        survivors = self._surviving_keys(counts)
+        # the survivors reach each worker once, with the pool initializer
+        # (set here too, in a worker process the pool runs the shards itself)
+        _init_fit_worker(worker, survivors)
+        try:
+            with WorkerPool(n_jobs, initializer=_init_fit_worker, initargs=(worker, survivors)) as pool:
+                for partial in pool.imap(_fit_surviving_shard, shards, chunksize=1):
+                    self._merge_productions(self.productions, partial)
+        finally:
+            _init_fit_worker(None, None)
+        self._finish_two_pass(counts, survivors)
+        return self
 
-        # this provides parallelism
-        for ciplist in mpmap(self._make_cips_list, graphs, poolsize=n_jobs):
-            for cip in ciplist:
-                self._store_cip(cip)
+    def partial_fit(self, graphs, sketch_width=2 ** 18, sketch_depth=4):
+        """
+        streaming fit, call with successive batches (any iterable) of graphs
+        and call finalize() at the end.
+
+        occurrences are counted in a count-min sketch, a cip is only stored
+        once its estimated count reaches filter_min_cip. memory is bounded by
+        the sketch (sketch_width*sketch_depth counters, set on the first call)
+        and the cips that can pass the count filter. counts of stored cips
+        may be overestimated if the sketch is too small for the stream.
+        """
+        from graphlearn.util.sketch import CountMinSketch
+        if getattr(self, '_sketch', None) is None:
+            self._sketch = CountMinSketch(sketch_width, sketch_depth)
+        for graph in graphs:
+            for cip in self._get_cips(graph):
+                self._stream_cip(cip)
+        return self
 
+    def _stream_cip(self, cip):
+        estimate = self._sketch.add((cip.interface_hash, cip.core_hash))
+        cips = self.productions.get(cip.interface_hash)
+        if cips is not None and cip.core_hash in cips:
+            self._store_cip(cip)
+        elif estimate >= self.filter_min_cip:
+            # earlier occurrences were only counted by the sketch
+            self._store_cip(cip)
+            self.productions[cip.interface_hash][cip.core_hash].count = estimate
+
+    def finalize(self):
+        """apply the filters after partial_fit and free the sketch"""
+        self._sketch = None
         self._filter_cips()
         return self
 
-    def _make_cips_list(self, graph):
-        return list(self._get_cips(graph))
+    def _fit_shard(self, graphs):
+        self.productions = defaultdict(dict)
+        self._store_graphs(graphs)
+        return self.productions
+
+    def _fit_surviving_shard(self, graphs, survivors):
+        self.productions = defaultdict(dict)
+        self._store_surviving_graphs(graphs, survivors)
+        return self.productions
+
+    def save(self, path):
+        """write a binary snapshot, see graphlearn.snapshot"""
+        from graphlearn import snapshot
+        snapshot.save(self, path)
+
+    def load(self, path, mmap=True):
+        """load a snapshot written by save into this grammar, it can run code: only load trusted files"""
+        from graphlearn import snapshot
+        return snapshot.load(path, grammar=self, mmap=mmap)
+
+
+# the grammar and surviving keys of a two-pass fit worker process
+_fit_worker = None
+
+
+def _init_fit_worker(grammar, survivors):
+    global _fit_worker
+    _fit_worker = grammar, survivors
+
+
+def _fit_surviving_shard(graphs):
+    grammar, survivors = _fit_worker
+    return grammar._fit_surviving_shard(graphs, survivors)
@@ -1,50 +1,145 @@
 import copy
+from collections import Counter, defaultdict
 import eden.graph as eg
+from hashlib import blake2b
+import numbers
+import numpy as np
 from typing import List, Optional
 from networkx.algorithms import isomorphism as iso
 import networkx as nx
 import logging
+import weakref
+from graphlearn.util.instrument import OFF
 
 from networkx.algorithms.shortest_paths.unweighted import _single_shortest_path_length as short_paths
 logger = logging.getLogger(__name__)
 
 
 
-def _add_hlabel(graph):
-    eg._label_preprocessing(graph)
+def _add_hlabel(graph, hasher=None):
+    (hasher or DEFAULT_HASHER).add_hlabel(graph)
 
 def _edge_to_vertex(graph: nx.Graph) -> nx.Graph:
     return eg._edge_to_vertex_transform(graph)
 
 
-def graph_hash(graph, get_node_label=lambda id, node: node['hlabel']):
+class GraphHasher:
     """
-    calculate a hash of a graph
-    """
-    node_neighborhood_hashes = {n: _graph_hash_neighborhood(graph, n, get_node_label) for n in graph.nodes()}
+    process stable fingerprints for labels and graphs.
 
-    edge_hash = lambda a, b: hash((min(a, b), max(a, b)))
-    l = [edge_hash(node_neighborhood_hashes[a],
-                   node_neighborhood_hashes[b]) for (a, b) in graph.edges()]
-    l.sort()
-
-    isolates = [n for (n, d) in graph.degree if d == 0]
-    z = [get_node_label(node_id, graph.nodes[node_id]) for node_id in isolates]
-    z.sort()
-    return hash(tuple(l + z))
+    python's hash() of strings changes between interpreter runs, so labels
+    are encoded with a keyed blake2b and all hashes are built from integer
+    label codes. values are the same in every process, grammars can be
+    stored and grammars fitted in different processes can be merged.
 
+    PARAMS:
+    bits: width of the fingerprints, 64 or 128 make collisions negligible
+    key: blake2b key, grammars are only compatible if the keys match
+    depth: radius of the node neighborhoods that are hashed
+    """
 
-def _graph_hash_neighborhood(graph, node, get_node_label=lambda id, node: node['hlabel']):
-    d = nx.single_source_shortest_path_length(graph, node, 5)
-    l = [hash((get_node_label(nid, graph.nodes[nid]), dis)) for nid, dis in d.items()]
-    l.sort()
-    return hash(tuple(l))
+    def __init__(self, bits=64, key=b'graphlearn', depth=5):
+        assert bits % 8 == 0 and 8 <= bits <= 512, "bits must be a multiple of 8 in [8,512]"
+        self.bits = bits
+        self.key = key
+        self.depth = depth
+        self._label_codes = {}
+
+    def _digest(self, data):
+        return int.from_bytes(blake2b(data, digest_size=self.bits // 8, key=self.key).digest(), 'big')
+
+    def fingerprint(self, ints):
+        """fingerprint of a sequence of integers"""
+        return self._digest(b','.join(b'%d' % i for i in ints))
+
+    def combine(self, *hashes):
+        """fingerprint of several hashes, order matters"""
+        return self.fingerprint(hashes)
+
+    def label_code(self, label):
+        code = self._label_codes.get(label)
+        if code is None:
+            code = self._label_codes[label] = self._digest(repr(label).encode())
+        return code
+
+    def node_code(self, label):
+        """integer for a label returned by get_node_label: ints are kept, other labels get their label_code"""
+        if isinstance(label, numbers.Integral):
+            return int(label)
+        return self.label_code(label)
+
+    def add_hlabel(self, graph, key_label='label'):
+        for n, d in graph.nodes(data=True):
+            d['hlabel'] = self.label_code(d[key_label])
+
+    def graph_hash(self, graph, get_node_label=lambda id, node: node['hlabel']):
+        """
+        calculate a hash of a graph
+        """
+        node_neighborhood_hashes = self._node_hashes(graph, get_node_label)
+
+        edge_hash = lambda a, b: (min(a, b), max(a, b))
+        l = [edge_hash(node_neighborhood_hashes[a],
+                       node_neighborhood_hashes[b]) for (a, b) in graph.edges()]
+        l.sort()
+
+        isolates = [n for (n, d) in graph.degree if d == 0]
+        z = [self.node_code(get_node_label(node_id, graph.nodes[node_id])) for node_id in isolates]
+        z.sort()
+        return self.fingerprint([len(l)] + [h for edge in l for h in edge] + z)
+
+    def _node_hashes(self, graph, get_node_label):
+        codes = {n: self.node_code(get_node_label(n, d)) for n, d in graph.nodes(data=True)}
+        return {n: self._graph_hash_neighborhood(graph, n, codes) for n in graph.nodes()}
+
+    def _graph_hash_neighborhood(self, graph, node, codes):
+        d = nx.single_source_shortest_path_length(graph, node, self.depth)
+        l = [(codes[nid], dis) for nid, dis in d.items()]
+        l.sort()
+        return self.fingerprint([x for label_dist in l for x in label_dist])
+
+    def interface_hash(self, interface):
+        def get_node_label(id, node): return node['ilabel']
+        return self.graph_hash(interface, get_node_label=get_node_label)
+
+    def canonical_components(self, graph, get_node_label=lambda id, node: node['hlabel']):
+        """
+        (key, components) where key is a fingerprint of all neighborhood hashes and components
+        lists (hashes, nodes, positions) per connected component: its nodes sorted by hash and
+        their positions in graph.nodes(). components are ordered by their first position.
+        (None, None) if two nodes of a component share a hash, the component may be symmetric.
+        """
+        hashes = self._node_hashes(graph, get_node_label)
+        position = {n: i for i, n in enumerate(graph.nodes())}
+        components = []
+        for component in nx.connected_components(graph):
+            nodes = sorted(component, key=hashes.get)
+            keys = tuple(hashes[n] for n in nodes)
+            if len(set(keys)) < len(keys):
+                return None, None
+            components.append((keys, tuple(nodes), tuple(position[n] for n in nodes)))
+        components.sort(key=lambda c: min(c[2]))
+        return self.fingerprint(sorted(hashes.values())), components
+
+    def __getstate__(self):
+        # the label code cache is rebuilt quickly, dont ship it to workers
+        state = dict(self.__dict__)
+        state['_label_codes'] = {}
+        return state
+
+
+DEFAULT_HASHER = GraphHasher()
+
+
+def graph_hash(graph, get_node_label=lambda id, node: node['hlabel'], hasher=None):
+    """
+    calculate a hash of a graph
+    """
+    return (hasher or DEFAULT_HASHER).graph_hash(graph, get_node_label)
 
 
-def interface_hash(interface):
-    def get_node_label(id, node): return node['ilabel']
-    interface_hash = graph_hash(interface, get_node_label=get_node_label)
-    return interface_hash
+def interface_hash(interface, hasher=None):
+    return (hasher or DEFAULT_HASHER).interface_hash(interface)
 
 
 
@@ -52,6 +147,68 @@ def interface_hash(interface):
 #  decompose
 ###############
 
+class Decomposition:
+    """
+    per-graph decomposition context.
+    the graph is expanded and hlabeled once, all cores and cips of the graph
+    are then cut from the same expanded graph.
+
+    ATTRIBUTES:
+    graph: the unexpanded graph
+    exgraph: expanded graph with hlabels, do not modify
+    hasher: GraphHasher used for hlabels and for all cips of the graph
+    """
+
+    def __init__(self, graph, hasher=None):
+        self.graph = graph
+        self.hasher = hasher or DEFAULT_HASHER
+        self.exgraph = _edge_to_vertex(graph)
+        _add_hlabel(self.exgraph, self.hasher)
+        self._distances = {}
+        self._original = None
+        self._adjacency = None
+
+    def distances(self, roots, cutoff):
+        """{node: distance} for all nodes within cutoff of roots, tables are cached"""
+        key = (frozenset(roots), cutoff)
+        if key not in self._distances:
+            self._distances[key] = dict(short_paths(self.exgraph, key[0], cutoff))
+        return self._distances[key]
+
+    def adjacency(self):
+        """(nodes, indptr, indices): exgraph as CSR arrays, rows in node order and
+        each row in adjacency order, computed once"""
+        if self._adjacency is None:
+            adj = self.exgraph._adj
+            nodes = list(adj)
+            index = {n: i for i, n in enumerate(nodes)}
+            indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(adj[n]) for n in nodes])
+            indices = np.fromiter((index[m] for n in nodes for m in adj[n]), dtype=np.int64, count=indptr[-1])
+            self._adjacency = nodes, indptr, indices
+        return self._adjacency
+
+    @property
+    def original(self):
+        """decomposition of graph.graph['original'] (layered graphs)"""
+        if self._original is None:
+            self._original = Decomposition(self.graph.graph['original'], self.hasher)
+        return self._original
+
+
+def decompose(graph, hasher=None):
+    """returns a Decomposition of graph, graph may already be one"""
+    if isinstance(graph, Decomposition):
+        return graph
+    return Decomposition(graph, hasher)
+
+
+def graph_fingerprint(graph, hasher=None):
+    """(size, graph_hash of the expanded graph) of an unexpanded graph, edge labels count"""
+    decomposition = decompose(graph, hasher)
+    return len(graph), decomposition.hasher.graph_hash(decomposition.exgraph)
+
+
 class CoreInterfacePair:
     """
     this is referred to throughout the code as cip
@@ -60,90 +217,245 @@ class CoreInterfacePair:
 
     PARAMS:
     core: an 'expanded' subgraph of graph
-    graph: an unexpanded graph
+    graph: an unexpanded graph or its Decomposition
     thickness: absolute thickness on expanded Graph
 
 
     ATTRIBUTES:
-    graph: expanded CIP-graph
+    graph: expanded CIP-graph, detached from the graph it was extracted from
     core_hash: hash of the core, used for filtering duplicates
     core_nodes: list of node-ids in the core
     interface: interface graph, augmented with a distance_dependant_label
         this label ensures that the correct isomorphism is found when
-        substituting
+        substituting. its node order is that of the expanded graph, where
+        the interface has automorphisms it decides which one is used
     interface_hash: finding congruent cips
     count: when this cip is placed in a grammar, we will count the number of
         occurences
+    hasher: the GraphHasher of the decomposition the cip was extracted from
 
+    instrumentation: hashing is timed as 'hash', see graphlearn.util.instrument
     """
 
 
-    def __init__(self,core,graph,thickness):
+    def __init__(self,core,graph,thickness, instrumentation=OFF):
 
             # preprocess, distances of core neighborhood, init counter
             exgraph, dist = self.initialize_params(core,graph, thickness)
 
             # core and graph, no surprises there
-            self.core_hash = graph_hash(core)
+            with instrumentation.timer('hash'):
+                self.core_hash = self.hasher.graph_hash(core)
             self.core_nodes = list(core.nodes())
-            self.graph = exgraph.subgraph([id for id, dst in dist.items() if dst <= thickness])
+            self.graph = exgraph.subgraph([id for id, dst in dist.items() if dst <= thickness]).copy()
             # interface and hash are more tricky...
-            self.interface,  self.interface_hash  = self.make_interface(exgraph, dist, self.core_nodes,self.graph)
+            self.interface,  self.interface_hash  = self.make_interface(dist, self.core_nodes,self.graph,
+                                                                        instrumentation)
 
 
-    def make_interface(self, exgraph, dist, core_nodes, cipgraph):
-        # generate graph
-        interface = exgraph.subgraph([n for n,dst in dist.items() if dst > 0])
+    def make_interface(self, dist, core_nodes, cipgraph, instrumentation=OFF):
+        # generate graph, ilabels are written to our own copy of the cip-graph
+        interface = cipgraph.subgraph([n for n in cipgraph.nodes() if dist[n] > 0])
 
         # adjust node-labels for matching and hashing...
-        for no in interface.nodes():
-            interface.nodes[no]['ilabel'] = interface.nodes[no]['hlabel'] + dist[no]
-            if dist[no] == 1 and 'edge' in interface.nodes[no] and \
-                    2==sum([cipgraph.has_edge(i,no) for i in core_nodes]):
-
-                interface.nodes[no]['ilabel'] += 1337
+        for no, ilabel in interface_labels(cipgraph, dist, core_nodes).items():
+            interface.nodes[no]['ilabel'] = ilabel
 
-        return interface, interface_hash(interface)
+        with instrumentation.timer('hash'):
+            return interface, self.hasher.interface_hash(interface)
 
 
     def initialize_params(self, core, graph, thickness):
         # preprocess, distances of core neighborhood, init counter
-        exgraph = _edge_to_vertex(graph)
-        _add_hlabel(exgraph)
-        _add_hlabel(core)
-        dist = {a: b for (a, b) in short_paths(exgraph, core.nodes(), thickness)}
+        decomposition = decompose(graph)
+        self.hasher = decomposition.hasher
+        _add_hlabel(core, self.hasher)
+        dist = decomposition.distances(core.nodes(), thickness)
         self.count=0
-        return exgraph, dist
+        return decomposition.exgraph, dist
 
     def copy_extend_core(self, new_core_nodes):
         new_cip = copy.copy(self)
         new_core_nodes_set = set(new_core_nodes)
         new_cip.core_nodes = new_cip.core_nodes + list(new_core_nodes)
-        new_cip.core_hash = graph_hash(new_cip.graph.subgraph(new_cip.core_nodes))
+        new_cip.core_hash = self.hasher.graph_hash(new_cip.graph.subgraph(new_cip.core_nodes))
         new_cip.interface = new_cip.interface.subgraph(
             {v for v in new_cip.interface.nodes() if v not in new_core_nodes_set})
-        new_cip.interface_hash = interface_hash(new_cip.interface)
+        new_cip.interface_hash = self.hasher.interface_hash(new_cip.interface)
+        new_cip.__dict__.pop('_canonical_interface', None)
 
         return new_cip
 
+    def canonical_interface(self):
+        """(key, components) of the interface, see GraphHasher.canonical_components, computed once"""
+        if getattr(self, '_canonical_interface', None) is None:
+            self._canonical_interface = self.hasher.canonical_components(
+                self.interface, get_node_label=lambda id, node: node['ilabel'])
+        return self._canonical_interface
+
     def ascii(self):
         '''return colored cip-graph'''
         import structout as so
         return so.graph.make_picture(self.graph, color=[ self.core_nodes , list(self.interface.nodes())  ])
 
+    def compact(self):
+        """detached array-backed copy, this is what a grammar stores"""
+        return CompactCoreInterfacePair(self)
+
     def __str__(self):
         return 'cip: int:%d, cor:%d, size:%d' % \
                (self.interface_hash,
                        self.core_hash,
                        len(self.core_nodes))
 
+
+def interface_labels(graph, dist, core_nodes):
+    """{node: ilabel} for the interface nodes (0 < dist) of graph"""
+    core_nodes = set(core_nodes)
+    ilabels = {}
+    for no, dst in dist.items():
+        if dst > 0 and no in graph:
+            d = graph.nodes[no]
+            ilabels[no] = d['hlabel'] + dst
+            # an edge node between 2 core nodes closes a cycle
+            if dst == 1 and 'edge' in d and 2 == sum(1 for i in graph.neighbors(no) if i in core_nodes):
+                ilabels[no] += 1337
+    return ilabels
+
+
+def cip_interface_hash(core, graph, thickness):
+    """interface_hash of CoreInterfacePair(core, graph, thickness) without building the cip"""
+    decomposition = decompose(graph)
+    dist = decomposition.distances(core.nodes(), thickness)
+    ilabels = interface_labels(decomposition.exgraph, dist, core.nodes())
+    interface = decomposition.exgraph.subgraph(ilabels)
+    return decomposition.hasher.graph_hash(interface, get_node_label=lambda id, node: ilabels[id])
+
+
+def cip_hashes(core, graph, thickness):
+    """
+    (interface_hash, core_hash) of CoreInterfacePair(core, graph, thickness)
+    without building the cip, nothing is copied
+    """
+    decomposition = decompose(graph)
+    return cip_interface_hash(core, decomposition, thickness), decomposition.hasher.graph_hash(core)
+
+
+class CompactCoreInterfacePair:
+    """
+    storage form of a CoreInterfacePair, the productions of a grammar hold these.
+
+    the cip-graph is kept as arrays, graph and interface are networkx graphs
+    that are built on demand (e.g. for substitution or printing), nothing
+    refers back to the graph the cip was extracted from.
+    hlabels are recomputed from the labels, ilabels from stored offsets.
+    attributes that are not part of a plain cip (e.g. pisi_vectors) are kept.
+
+    ATTRIBUTES:
+    core_hash, interface_hash, count, hasher: as in CoreInterfacePair
+    nodes: node ids of the cip-graph
+    labels: node labels, same order as nodes
+    is_edge: True for nodes that represent edges of the unexpanded graph
+    extra: {position: attribute dict} for nodes with further attributes or None
+    edges: (m,2) array, positions in nodes
+    core_mask: True for core nodes
+    ilabel_offset: ilabel - hlabel, -1 for nodes without ilabel
+    _canonical_interface: see canonical_interface, computed when the cip is stored
+    """
+
+    __slots__ = ('core_hash', 'interface_hash', 'count', 'hasher', 'nodes', 'labels',
+                 'is_edge', 'extra', 'edges', 'core_mask', 'ilabel_offset', '_canonical_interface', '__dict__')
+
+    _plain_attributes = {'core_hash', 'interface_hash', 'count', 'hasher', 'graph', 'interface', 'core_nodes',
+                         '_canonical_interface'}
+    _derived_node_attributes = {'label', 'node', 'edge', 'hlabel', 'ilabel'}
+
+    def __init__(self, cip):
+        self.core_hash = cip.core_hash
+        self.interface_hash = cip.interface_hash
+        self.count = cip.count
+        self.hasher = cip.hasher
+
+        graph = cip.graph
+        nodes = list(graph.nodes())
+        index = {n: i for i, n in enumerate(nodes)}
+        data = [graph.nodes[n] for n in nodes]
+        self.nodes = np.array(nodes, dtype=np.int64)
+        self.labels = tuple(d['label'] for d in data)
+        self.is_edge = np.array(['edge' in d for d in data], dtype=bool)
+        extra = {i: {k: v for k, v in d.items() if k not in self._derived_node_attributes}
+                 for i, d in enumerate(data)}
+        self.extra = {i: d for i, d in extra.items() if d} or None
+        self.edges = np.array([(index[a], index[b]) for a, b in graph.edges()], dtype=np.int32).reshape(-1, 2)
+        self.core_mask = np.isin(self.nodes, list(cip.core_nodes))
+        self.ilabel_offset = np.array([d['ilabel'] - d['hlabel'] if 'ilabel' in d else -1 for d in data],
+                                      dtype=np.int64)
+
+        for k, v in cip.__dict__.items():
+            if k not in self._plain_attributes:
+                setattr(self, k, v)
+
+        # positions refer to the node order of our own interface graphs
+        self._canonical_interface = None
+        self.canonical_interface()
+
+    def compact(self):
+        return self
+
+    @property
+    def core_nodes(self):
+        return self.nodes[self.core_mask].tolist()
+
+    @property
+    def graph(self):
+        return self.make_graph()
+
+    @property
+    def interface(self):
+        return self.make_graph(~self.core_mask)
+
+    def make_graph(self, mask=None, mapping=None, graph=None):
+        """
+        networkx graph of the cip (or of the nodes in mask), node ids can be renamed via mapping.
+        if graph is given, the nodes and edges are added to it (like nx.compose) and it is returned
+        """
+        ids = self.nodes.tolist()
+        if mapping is not None:
+            ids = [mapping.get(n, n) for n in ids]
+        positions = range(len(ids)) if mask is None else np.flatnonzero(mask).tolist()
+        if graph is None:
+            graph = nx.Graph()
+        graph.graph['expanded'] = True
+        for i in positions:
+            d = {'label': self.labels[i], 'hlabel': self.hasher.label_code(self.labels[i])}
+            d['edge' if self.is_edge[i] else 'node'] = True
+            if self.ilabel_offset[i] >= 0:
+                d['ilabel'] = d['hlabel'] + int(self.ilabel_offset[i])
+            if self.extra and i in self.extra:
+                d.update(self.extra[i])
+            graph.add_node(ids[i], **d)
+        edges = self.edges if mask is None else self.edges[mask[self.edges].all(axis=1)]
+        graph.add_edges_from(((ids[a], ids[b]) for a, b in edges.tolist()), label=None)
+        return graph
+
+    def canonical_interface(self):
+        # snapshots do not store it
+        return CoreInterfacePair.canonical_interface(self)
+
+    def ascii(self):
+        return CoreInterfacePair.ascii(self)
+
+    def __str__(self):
+        return CoreInterfacePair.__str__(self)
+
 #########
 # CORES
 #########
 def get_cores(graph, radii):
-    exgraph = _edge_to_vertex(graph)
-    for root in graph.nodes():
-        id_dst = {node: dis for (node, dis) in short_paths(exgraph, [root], max(radii)+1)}
+    decomposition = decompose(graph)
+    exgraph = decomposition.exgraph
+    for root in decomposition.graph.nodes():
+        id_dst = decomposition.distances([root], max(radii)+1)
         for e in loopradii_makesubgraphs(exgraph, id_dst, radii):
             yield e
 
@@ -169,14 +481,15 @@ def edgetest(border, id,g):
 
 def get_cores_closeloop(graph, radii):
     '''same as get_cores, but pairs of nodes with degree 1 are considered. this should allow the grammar to close cycles in graphs'''
-    for e in get_cores(graph,radii):
+    decomposition = decompose(graph)
+    for e in get_cores(decomposition,radii):
         yield e
-    deadends  =  [node for  node, deg in graph.degree() if deg == 1]
+    deadends  =  [node for  node, deg in decomposition.graph.degree() if deg == 1]
     if len(deadends) > 1:
-        exgraph = _edge_to_vertex(graph)
+        exgraph = decomposition.exgraph
         for i, nid in enumerate(deadends):
             for j, njd in enumerate(deadends[i:]):
-                id_dst = {node: dis for (node, dis) in short_paths(exgraph, [nid,njd], max(radii)+1)}
+                id_dst = decomposition.distances([nid,njd], max(radii)+1)
                 for e in loopradii_makesubgraphs(exgraph, id_dst, radii):
                     yield e
 
@@ -217,37 +530,146 @@ def combine_cips(cip1: CoreInterfacePair, cip2: CoreInterfacePair) -> Optional[C
         return None
 
 
+# how the interface of a congruent cip was mapped in substitute_core
+interface_map_counts = Counter()
+
+
+def canonical_interface_map(congruent_cip, cip):
+    """
+    map the interface of congruent_cip onto that of cip without search, None if it is ambiguous.
+    components with equal hashes are paired like VF2 pairs them in its first match
+    (on the same interfaces, with their node order):
+    the first node of each component of cip goes to the first unused node with its hash.
+    """
+    key, components = congruent_cip.canonical_interface()
+    key_, components_ = cip.canonical_interface()
+    if key is None or key != key_:
+        return None
+    candidates = defaultdict(list)
+    for i, (hashes, nodes, positions) in enumerate(components):
+        for h, pos in zip(hashes, positions):
+            candidates[h].append((pos, i))
+    for h in candidates:
+        candidates[h].sort()
+    used = set()
+    interface_map = {}
+    for hashes_, nodes_, positions_ in components_:
+        first = hashes_[positions_.index(min(positions_))]
+        i = next((i for pos, i in candidates[first] if i not in used), None)
+        if i is None or components[i][0] != hashes_:
+            return None
+        used.add(i)
+        interface_map.update(zip(components[i][1], nodes_))
+    return interface_map
+
+
 def find_all_isomorphisms(interface_graph, congruent_interface_graph):
     label_matcher = lambda x, y: x['ilabel'] == y['ilabel']  # and \ x.get('shard', 1) == y.get('shard', 1)
     return iso.GraphMatcher(interface_graph, congruent_interface_graph, node_match=label_matcher).match()
 
 
+class Substitution:
+    """
+    what substitute_core changed, kept in graph.graph['substitution'] of the new graph.
+    node ids are those of the graphs, not of their expansion.
+
+    parent: the graph the core was replaced in, a weak reference (None once it is
+        collected, after pickling or copying)
+    removed: nodes of the old core
+    inserted: nodes of the new core
+    interface: interface nodes, they are in both graphs
+    """
+    __slots__ = ('_parent', 'removed', 'inserted', 'interface')
+
+    def __init__(self, parent, removed, inserted, interface):
+        self._parent = None if parent is None else weakref.ref(parent)
+        self.removed = removed
+        self.inserted = inserted
+        self.interface = interface
+
+    @property
+    def parent(self):
+        return None if self._parent is None else self._parent()
+
+    def __getstate__(self):
+        return None, self.removed, self.inserted, self.interface
+
+    def __setstate__(self, state):
+        self._parent, self.removed, self.inserted, self.interface = state
+
+
 def substitute_core(graph, cip, congruent_cip):
+    return next(substitute_cores(graph, cip, [congruent_cip]))
+
+
+def substitute_cores(graph, cip, congruent_cips, instrumentation=OFF, record=False):
+    """
+    substitute_core for each of the congruent_cips, lazily.
+    the graph is expanded and the core removed once, every substitution starts from a copy of this host graph.
+    yields None where a substitution fails
+
+    record: keep a Substitution in graph.graph['substitution'] of each new graph
+        (for score.IncrementalVectorizer), json can not serialize it
+
+    where the interface is symmetric any of its isomorphisms is a valid substitution, which one
+    is used depends on the node order of the interfaces. graphlearn versions before the shared
+    Decomposition (and compact cips) ordered them differently, their neighbors of symmetric
+    molecules are the same substitutions with other automorphisms, i.e. partly different graphs.
+
+    instrumentation: times 'interface_map', 'isomorphism', 'compose' and 'revert',
+        counts 'substitutions' and 'substitution_failed', see graphlearn.util.instrument
+    """
 
     # expand edges and remove old core
-    graph = _edge_to_vertex(graph)
-    graph.remove_nodes_from(cip.core_nodes)
+    host = _edge_to_vertex(graph)
+    host.remove_nodes_from(cip.core_nodes)
+    maxid = max(host.nodes()) # if we die here, likely the cip covers the whole graph
 
+    removed = [n for n in cip.core_nodes if n in graph]
+    interface = [n for n in cip.interface if n in graph]
+    for congruent_cip in congruent_cips:
+        graph2 = _substitute_into(host, maxid, cip, congruent_cip, instrumentation)
+        instrumentation.count('substitutions')
+        if graph2 is None:
+            instrumentation.count('substitution_failed')
+        elif record:
+            inserted = [n for n in graph2 if n > maxid]
+            graph2.graph['substitution'] = Substitution(graph, removed, inserted, interface)
+        yield graph2
+
+
+def _substitute_into(host, maxid, cip, congruent_cip, instrumentation=OFF):
 
     # relabel the nodes in the congruent cip such that the interface node-ids match with the graph and the
     # core ids dont overlap
-    interface_map = next(find_all_isomorphisms(congruent_cip.interface, cip.interface))
+    with instrumentation.timer('interface_map'):
+        interface_map = canonical_interface_map(congruent_cip, cip)
+    if interface_map is not None:
+        interface_map_counts['canonical'] += 1
+    else:
+        # symmetric interface, VF2 finds one of the mappings
+        interface_map_counts['vf2'] += 1
+        with instrumentation.timer('isomorphism'):
+            interface_map = next(find_all_isomorphisms(congruent_cip.interface, cip.interface))
     if len(interface_map) != len(cip.interface):
         logger.log(10, "isomorphism failed, likely due to hash collision")
         return None
 
-    maxid = max(graph.nodes()) # if we die here, likely the cip covers the whole graph
     core_rename= { c: i+maxid+1 for i,c in enumerate(congruent_cip.core_nodes) }
     interface_map.update(core_rename)
-    newcip = nx.relabel_nodes(congruent_cip.graph, interface_map,copy=True)
-
 
     # compose and undo edge expansion
-    graph2= nx.compose(graph,newcip)
+    with instrumentation.timer('compose'):
+        if isinstance(congruent_cip, CompactCoreInterfacePair):
+            graph2 = congruent_cip.make_graph(mapping=interface_map, graph=host.copy())
+        else:
+            newcip = nx.relabel_nodes(congruent_cip.graph, interface_map,copy=True)
+            graph2= nx.compose(host,newcip)
 
     # if the reverserion fails, you use a wrong version of eden, where
     # expansion requires that edges are indexed by (0..n-1)
-    return   eg._revert_edge_to_vertex_transform(graph2)
+    with instrumentation.timer('revert'):
+        return   eg._revert_edge_to_vertex_transform(graph2)
 
     '''
     except Exception as e:
@@ -19,7 +19,7 @@ class lsgg_ego(graphlearn.sample.LocalSubstitutionGraphGrammarSample):
     '''
 
     def _get_cores(self, graph):
-        codes, ego_decomp_fragments = self.encoder(graph)
+        codes, ego_decomp_fragments = self.encoder(self._decompose(graph).graph)
         #graph = cip._edge_to_vertex(graph)
         return  ego_decomp_fragments
 
@@ -15,6 +15,9 @@ class lsgg_layered(graphlearn.sample.LocalSubstitutionGraphGrammarSample):
     def _substitute_core(self, graph, cip, cip_):
         return lsgg_core_interface_pair.substitute_core(graph.graph['original'], cip, cip_)
 
+    def _substitute_cores(self, graph, cip, congruent_cips):
+        return lsgg_core_interface_pair.substitute_cores(graph.graph['original'], cip, congruent_cips)
+
 
     def __init__(self,base_thickness=2,**kwargs):
         if kwargs.get("nodelevel_radius_and_thickness",True):
@@ -34,6 +37,7 @@ class lsgg_layered(graphlearn.sample.LocalSubstitutionGraphGrammarSample):
         get 2 cips -> make the lower the cip, and hash the interface hashes together -> done
         """
 
+        graph = self._decompose(graph)
         coarse_cip = lsgg_core_interface_pair.CoreInterfacePair(core=core,
                                                              graph=graph,
                                                              thickness=self.thickness)
@@ -42,7 +46,7 @@ class lsgg_layered(graphlearn.sample.LocalSubstitutionGraphGrammarSample):
             return None
 
 
-        base_cip.interface_hash = hash((base_cip.interface_hash,coarse_cip.interface_hash))
+        base_cip.interface_hash = base_cip.hasher.combine(base_cip.interface_hash,coarse_cip.interface_hash)
         return base_cip
 
 
@@ -54,10 +58,10 @@ class lsgg_layered(graphlearn.sample.LocalSubstitutionGraphGrammarSample):
         return base_core
 
     def _make_base_cip(self,graph,core):
-        exp_base_graph = lsgg_core_interface_pair._edge_to_vertex(graph.graph['original'])
-        base_core = self._make_base_core(exp_base_graph, core)
+        base = self._decompose(graph).original
+        base_core = self._make_base_core(base.exgraph, core)
         return  lsgg_core_interface_pair.CoreInterfacePair(core=base_core,
-                                                              graph=exp_base_graph,
+                                                              graph=base,
                                                               thickness=self.base_thickness)
 
 
@@ -36,14 +36,14 @@ class CIP_PiSi(CIP.CoreInterfacePair):
 
         # normal init
         exgraph, dist = self.initialize_params(core, graph, thickness_pisi)
-        self.core_hash = CIP.graph_hash(core)
+        self.core_hash = self.hasher.graph_hash(core)
         self.core_nodes = list(core.nodes())
-        self.graph = exgraph.subgraph([id for id, dst in dist.items() if dst <= thickness])
-        self.interface, self.interface_hash = self.make_interface(exgraph, dist)
+        self.graph = exgraph.subgraph([id for id, dst in dist.items() if dst <= thickness]).copy()
+        self.interface, self.interface_hash = self.make_interface(dist, self.core_nodes, self.graph)
 
-        # PISI Stuff
-        loosecontext = exgraph.subgraph([i for i,d in dist.items() if 0 < d < thickness_pisi])
-        self.pisi_hash = {CIP.graph_hash(loosecontext)}
+        # PISI Stuff, exgraph is shared by all cips of the graph -> vectorize a copy
+        loosecontext = exgraph.subgraph([i for i,d in dist.items() if 0 < d < thickness_pisi]).copy()
+        self.pisi_hash = {self.hasher.graph_hash(loosecontext)}
         self.pisi_vectors = CIP.eg.vectorize([loosecontext])
 
 
@@ -56,7 +56,7 @@ class PiSi(graphlearn.sample.LocalSubstitutionGraphGrammarSample):
         self.thickness_pisi = thickness_pisi*2
 
     def _get_cip(self, core=None, graph=None):
-        return CIP_PiSi( core=core, graph=graph,thickness=self.thickness,  thickness_pisi=self.thickness_pisi)
+        return CIP_PiSi( core=core, graph=self._decompose(graph),thickness=self.thickness,  thickness_pisi=self.thickness_pisi)
     
     def _get_congruent_cips(self, cip):
         cips = self.productions.get(cip.interface_hash, {}).values()
@@ -70,20 +70,30 @@ class PiSi(graphlearn.sample.LocalSubstitutionGraphGrammarSample):
 
             if len(cips_) == 0: logger.log(10,"0 cips with pisi-similarity > 0")
             for cip_, di in cips_:
-                cip_.pisisimilarity=di
                 yield cip_
     
-    def _sample_size_adjusted(self, subs):
-        sim = [c[1].pisisimilarity for c in subs ]
+    def _congruent_weights(self, cip, cips):
+        # pisi similarity, cips with similarity <= 0 are not proposed
+        vector = cip.pisi_vectors.toarray()[0]
+        sim = [np.max(cip_.pisi_vectors.dot(vector)) for cip_ in cips]
         logger.log(10, "pisi similarities: "+str(sim))
-        p_size = [a * b for a,b in zip (self._make_size_adjusted_probabilities(subs), sim)]
-        return self._sample(subs, p_size)
+        return sim
 
 
     def _store_cip(self, cip):
                     
-        grammarcip = self.productions[cip.interface_hash].setdefault(cip.core_hash, cip)
+        cips = self.productions[cip.interface_hash]
+        if cip.core_hash not in cips:
+            cips[cip.core_hash] = cip.compact()
+        grammarcip = cips[cip.core_hash]
         grammarcip.count+=1
+        self._merge_pisi(grammarcip, cip)
+
+    def _merge_cip(self, grammarcip, cip):
+        grammarcip.count += cip.count
+        self._merge_pisi(grammarcip, cip)
+
+    def _merge_pisi(self, grammarcip, cip):
         if not grammarcip.pisi_hash.intersection(cip.pisi_hash): 
             grammarcip.pisi_vectors= sparse.vstack( (grammarcip.pisi_vectors,  cip.pisi_vectors))
             grammarcip.pisi_hash= grammarcip.pisi_hash.union(cip.pisi_hash)
@@ -27,12 +27,12 @@ class lsgg_pisilayer( lsgg_layered.lsgg_layered ,lsgg_pisi.PiSi):
 
  
     def _make_base_cip(self,graph,core):
-        exp_base_graph = lsgg_core_interface_pair._edge_to_vertex(graph.graph['original'])
-        base_core = self._make_base_core(exp_base_graph, core)
-        if len(base_core) == len(exp_base_graph):
+        base = self._decompose(graph).original
+        base_core = self._make_base_core(base.exgraph, core)
+        if len(base_core) == len(base.exgraph):
             logger.log(10, 'core as big as graph -> no interface ->  return None')
             return None
-        return  lsgg_pisi.CIP_PiSi(core=base_core, graph=exp_base_graph,
+        return  lsgg_pisi.CIP_PiSi(core=base_core, graph=base,
                                       thickness=self.base_thickness,
                                       thickness_pisi = self.thickness_pisi)
 
@@ -1,7 +1,15 @@
+import copy
+import heapq
+import itertools
+from collections import deque
+import networkx as nx
 import numpy as np
 
 from graphlearn.local_substitution_graph_grammar import LocalSubstitutionGraphGrammar, logger
+from graphlearn.lsgg_core_interface_pair import graph_fingerprint
 from graphlearn.util import util
+from graphlearn.util.multi import WorkerPool, _in_worker
+from graphlearn.util.trace import Clock
 import random
 from graphlearn.choice import SelectMax
 
@@ -50,8 +58,14 @@ class Sampler(object):
     def __init__(self,**sampleargs):
         self.faster=False
         self.num_sample = 1
+        self.score_batch_size = 50 # sample_step_multi scores this many objects per call
+        self.rng = random # e.g. random.Random(seed), sample_many gives each chain its own
+        self.history_depth = None # see History, None keeps every step
+        self.history_keep = None
+        self.trace = None # graphlearn.util.trace.Trace, gets a record per step
+        self.chain_index = None # set for the chains of sample_many
         self.__dict__.update(sampleargs)
-        self.history=[]
+        self.history = History(self.history_depth, self.history_keep)
         
     
     def sample_sizeconstraint(self,graph, penalty=0.0):
@@ -76,124 +90,464 @@ class Sampler(object):
             graph, score = self.sample_step(graph,i)
         return graph
 
+    def sample_many(self, graphs, n_jobs=1, seed=None, method='sample_burnin'):
+        """
+        run one independent chain per start graph, yields (index, result) as the chains finish.
+        see ParallelSampler
+        """
+        sampler = ParallelSampler(self, n_jobs=n_jobs, seed=seed, method=method)
+        try:
+            yield from sampler.sample_many(graphs)
+        finally:
+            sampler.close()
+
+    def _chain(self, rng):
+        """a copy of the sampler for one chain: own rng and history, the grammar is shared"""
+        chain = copy.copy(self)
+        chain.rng = rng
+        chain.history = History(self.history_depth, self.history_keep)
+        # selectors and scorers that draw random numbers have an rng too
+        for name in ['selector', 'scorer']:
+            part = getattr(self, name, None)
+            if hasattr(part, 'rng'):
+                part = copy.copy(part)
+                part.rng = rng
+                setattr(chain, name, part)
+        return chain
+
+    def _emit(self, clock, step, method, proposals, decoded, score, startscore, accepted, event=None):
+        """send the record of a step to the trace, see graphlearn.util.trace"""
+        if self.trace is None:
+            return
+        record = {'chain': self.chain_index, 'step': step, 'method': method,
+                  'proposals': proposals, 'decoded': decoded,
+                  'score': None if score is None else float(score),
+                  'delta': None if score is None or startscore is None else float(score - startscore),
+                  'accepted': accepted, 'event': event}
+        record.update(clock.times())
+        self.trace.emit(record)
+
     def sample_step(self,object,step):
         if object is None: return None,0
-        graph = self.transformer.encode_single(object)
+        clock = Clock()
+        graph = clock.timed('decode_s', self.transformer.encode_single, object)
         util.valid_gl_graph(graph)
         if self.faster:
-            proposal_graphs = list(self.grammar.neighbors_sample_faster(graph,1))+[graph]
+            proposal_graphs = clock.timed('propose_s', list, self.grammar.neighbors_sample_faster(graph,1))+[graph]
         else:
-            proposal_graphs = list(self.grammar.neighbors_sample(graph,1))+[graph]
+            proposal_graphs = clock.timed('propose_s', list, self.grammar.neighbors_sample(graph,1,rng=self.rng))+[graph]
 
-        proposal_objects = list(self.transformer.decode(proposal_graphs))
+        proposal_objects = list(clock.timed('decode_s', self.transformer.decode, proposal_graphs))
         
         if len(proposal_objects) <= 1: 
-            logger.log(10,"reached a dead-end graph, attempting to backtrack at step " % step)
+            logger.log(10,"reached a dead-end graph, attempting to backtrack at step %d" % step)
             if len(self.history) < 2:
+                self._emit(clock, step, 'sample_step', len(proposal_graphs) - 1, len(proposal_objects) - 1,
+                           None, None, False, 'dead_end')
                 return None,0
             self.history.pop() # the problematic graph should be on top of the stack
-            return self.history.pop() 
+            obj_score = self.history.pop()
+            self._emit(clock, step, 'sample_step', len(proposal_graphs) - 1, len(proposal_objects) - 1,
+                       obj_score[1], None, False, 'backtrack')
+            return obj_score
 
-        scores = self.scorer.decision_function(proposal_objects)
+        scores = clock.timed('score_s', self.scorer.decision_function, proposal_objects)
         obj_score = self.selector.select(proposal_objects, scores)
         self.history.append(obj_score)
+        # the start object is the last proposal
+        self._emit(clock, step, 'sample_step', len(proposal_graphs) - 1, len(proposal_objects) - 1,
+                   obj_score[1], scores[-1], obj_score[0] is not proposal_objects[-1])
         return obj_score
 
     def sample_step_multi(self,object,step):
         if object is None: return None,0
 
         # a graph is something that the grammar understands
-        graph = self.transformer.encode_single(object)
+        clock = Clock()
+        graph = clock.timed('decode_s', self.transformer.encode_single, object)
         util.valid_gl_graph(graph)
-        startscore = self.scorer.decision_function([object])[0]
+        proposals = clock.timed_iter('propose_s', self.grammar.neighbors_sample(graph, self.num_sample, rng=self.rng))
+        proposal_objects = (clock.timed('decode_s', self.transformer._decode_single, g) for g in proposals)
+
+        # the start object is scored in the first batch
+        scored = self._score_batches(itertools.chain([object], proposal_objects), clock)
+        startscore = next(scored)[1]
         current = graph, startscore
-        scorehist= [] 
         backupmgr = Backupmgr(15)
-        for g in self.grammar.neighbors_sample(graph, self.num_sample):
-            proposal_object = self.transformer._decode_single(g)
-            score = self.scorer.decision_function([proposal_object])[0]
-            scorehist.append(score)
+        n_proposals = 0
+        for proposal_object, score in scored:
+            n_proposals += 1
             backupmgr.push((score,proposal_object))
             if score > current[1]:
                 current = proposal_object,score
-        
+
+        event = None
         if startscore == current[1]:
-            score,pobj = backupmgr.get() 
+            score,pobj = backupmgr.get(self.rng)
             logger.log(10,"reached a dead-end graph, choose probabilistically at step %d" % step)
             current = pobj,score
+            event = 'dead_end'
 
         self.history.append(current)
+        self._emit(clock, step, 'sample_step_multi', n_proposals, n_proposals, current[1], startscore,
+                   current[0] is not graph, event)
         return current
 
+    def _score_batches(self, objects, clock=None):
+        """(object, score) for all objects, the scorer is called once per batch"""
+        clock = clock or Clock()
+        objects = iter(objects)
+        while True:
+            batch = list(itertools.islice(objects, self.score_batch_size))
+            if not batch:
+                return
+            yield from zip(batch, clock.timed('score_s', self.scorer.decision_function, batch))
+
+class ParallelSampler(object):
+    """
+    runs independent chains of a Sampler in worker processes.
+
+    the workers are forked with the sampler in place, grammar and scorer are
+    shared copy-on-write and not pickled per chain (with the spawn start method
+    they are pickled once per worker).
+    chain i draws from its own random.Random seeded by (seed, i), results do not
+    depend on n_jobs or on which worker runs the chain.
+
+    sampler: Sampler with grammar, scorer, selector, transformer
+    n_jobs: number of processes, 1 runs the chains here
+    seed: base seed, None: drawn from random
+    method: name of the Sampler method that runs a chain, e.g. sample or sample_burnin
+    """
+
+    def __init__(self, sampler, n_jobs=2, seed=None, method='sample_burnin'):
+        self.sampler = sampler
+        self.n_jobs = n_jobs
+        self.seed = seed
+        self.method = method
+        self.pool = None
+        if n_jobs != 1:
+            self.pool = WorkerPool(n_jobs, initializer=_init_chain_worker, initargs=(sampler,))
+
+    def chain_rng(self, seed, i):
+        return random.Random(int(np.random.SeedSequence([seed, i]).generate_state(1, np.uint64)[0]))
+
+    def sample_many(self, graphs, ordered=False):
+        """yields (index, result) per start graph, in order of completion unless ordered"""
+        seed = random.getrandbits(64) if self.seed is None else self.seed
+        tasks = ((i, graph, self.chain_rng(seed, i), self.method) for i, graph in enumerate(graphs))
+        if self.pool is None or _in_worker():
+            # in a pool worker the chains run here, not in workers that got the sampler from _init_chain_worker
+            return (_run_chain(task, self.sampler) for task in tasks)
+        if ordered:
+            return self.pool.imap(_run_chain, tasks, chunksize=1)
+        return self.pool.imap_unordered(_run_chain, tasks, chunksize=1)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# the sampler of a ParallelSampler worker process
+_chain_sampler = None
+
+
+def _init_chain_worker(sampler):
+    global _chain_sampler
+    _chain_sampler = sampler
+
+
+def _run_chain(task, sampler=None):
+    i, graph, rng, method = task
+    chain = (sampler or _chain_sampler)._chain(rng)
+    chain.chain_index = i
+    return i, getattr(chain, method)(graph)
+
+
+class History(object):
+    """
+    the last depth (object, score) pairs of a chain, the sampler backtracks through them at dead ends.
+    depth=None keeps all of them.
+
+    older entries are dropped, or kept compact:
+    keep='fingerprint': (graph_fingerprint, score) in archive, they can not be restored
+    keep='delta': the edit that turns the next entry into it, pop() replays them
+        (node ids are kept, the node order of a replayed graph may differ)
+    objects that are not networkx graphs are kept as they are.
+    """
+
+    def __init__(self, depth=None, keep=None):
+        assert keep in (None, 'fingerprint', 'delta')
+        self.depth = depth
+        self.keep = keep
+        self.entries = deque()
+        self.archive = []  # oldest first, a delta refers to the entry after it
+
+    def append(self, entry):
+        self.entries.append(entry)
+        if self.depth is not None and len(self.entries) > self.depth:
+            old = self.entries.popleft()
+            if self.keep is not None:
+                self.archive.append(self._compact(old, self.entries[0]))
+
+    def pop(self):
+        entry = self.entries.pop()
+        if not self.entries and self.archive and self.keep == 'delta':
+            self.entries.append(self._restore(self.archive.pop(), entry))
+        return entry
+
+    def _compact(self, entry, next_entry):
+        obj, score = entry
+        if not isinstance(obj, nx.Graph):
+            return entry
+        if self.keep == 'fingerprint':
+            return graph_fingerprint(obj), score
+        if not isinstance(next_entry[0], nx.Graph):
+            return entry
+        return _GraphDelta(next_entry[0], obj), score
+
+    def _restore(self, archived, entry):
+        obj, score = archived
+        if isinstance(obj, _GraphDelta):
+            obj = obj.apply(entry[0])
+        return obj, score
+
+    def __len__(self):
+        # entries pop() can return
+        return len(self.entries) + (len(self.archive) if self.keep == 'delta' else 0)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def stats(self):
+        """sizes and approximate bytes of the kept and the archived entries"""
+        return {'entries': len(self.entries), 'archived': len(self.archive), 'depth': self.depth,
+                'keep': self.keep, 'nbytes': util.nbytes(list(self.entries)),
+                'archive_nbytes': util.nbytes(self.archive)}
+
+
+class _GraphDelta(object):
+    """the edit that turns graph into target, nodes are matched by id"""
+
+    def __init__(self, graph, target):
+        self.removed_nodes = [n for n in graph if n not in target]
+        self.nodes = [(n, d) for n, d in target.nodes.items() if n not in graph or graph.nodes[n] != d]
+        self.removed_edges = [(a, b) for a, b in graph.edges() if not target.has_edge(a, b)]
+        self.edges = [(a, b, d) for a, b, d in target.edges(data=True)
+                      if not graph.has_edge(a, b) or graph.edges[a, b] != d]
+        self.graph = target.graph
+
+    def apply(self, graph):
+        graph = graph.copy()
+        graph.remove_nodes_from(self.removed_nodes)
+        graph.remove_edges_from(self.removed_edges)
+        for n, d in self.nodes:
+            graph.add_node(n)
+            graph.nodes[n].clear()
+            graph.nodes[n].update(d)
+        for a, b, d in self.edges:
+            graph.add_edge(a, b)
+            graph.edges[a, b].clear()
+            graph.edges[a, b].update(d)
+        graph.graph = copy.copy(self.graph)
+        return graph
+
+
 class Backupmgr():
+    """keeps the maxsize pushed (score, object) pairs with the lowest scores"""
     def __init__(self, maxsize):
         self.maxsize = maxsize 
-        self.data = []
+        self.heap = [] # (-score, -n, x): the root is dropped first
+        self.n = 0
     def push(self,x):
-        self.data.append(x)
-        self.data.sort(key = lambda x: x[0] )
-        self.data=self.data[:self.maxsize]
-    def get(self):
-        return random.choices(self.data,[ p for p,g in self.data ])[0]
+        # on ties the later push is dropped
+        item = (-x[0], -self.n, x)
+        self.n += 1
+        if len(self.heap) < self.maxsize:
+            heapq.heappush(self.heap, item)
+        else:
+            heapq.heappushpop(self.heap, item)
+    @property
+    def data(self):
+        return [x for score, n, x in sorted(self.heap, reverse=True)]
+    def get(self, rng=random):
+        """
+        a pair drawn with its score as weight, like random.choices(data, scores).
+        scores that random.choices can not use are adapted: negative scores (e.g. of an
+        svm) are shifted to start at 0, like in SelectProbN, and if all are 0 the draw is uniform.
+        """
+        data = self.data
+        weights = [p for p, g in data]
+        low = min(weights)
+        if low < 0:
+            # e.g. svm scores, shifted like in SelectProbN
+            weights = [w - low for w in weights]
+        if not any(weights):
+            return rng.choice(data)
+        return rng.choices(data, weights)[0]
+
+
+class SizeBuckets(object):
+    """
+    the cips of one interface sorted by core size, built once per interface.
+
+    a graph cip splits them into smaller, same size and bigger cores. proposals are
+    sampled, such that increasing or decreasing the graph has equal probability:
+    each class has the same mass, uniformly spread over its cips. optional weights
+    (e.g. pisi similarities) multiply this.
+    cips are drawn lazily without replacement: O(1) per draw without weights,
+    O(log n) with weights (gumbel-top-k after O(n) setup).
+    """
+
+    def __init__(self, cips):
+        self.cips = sorted(cips, key=lambda c: len(c.core_nodes))
+        self.sizes = np.array([len(c.core_nodes) for c in self.cips])
+        self.index = {c.core_hash: i for i, c in enumerate(self.cips)}
+
+    def classes(self, core_size):
+        """index ranges of smaller, same size and bigger cores"""
+        lo = int(np.searchsorted(self.sizes, core_size, 'left'))
+        hi = int(np.searchsorted(self.sizes, core_size, 'right'))
+        return [(0, lo), (lo, hi), (hi, len(self.cips))]
+
+    def draw(self, cip, weights=None, rng=random):
+        """the congruent cips of cip (other core_hash) in random order, drawn lazily"""
+        exclude = self.index.get(cip.core_hash)
+        classes = self.classes(len(cip.core_nodes))
+        if weights is None:
+            order = _draw_classes(classes, exclude, rng)
+        else:
+            order = _draw_weighted(classes, exclude, weights, rng)
+        return (self.cips[i] for i in order)
+
+
+class _LazyShuffle(object):
+    """fisher-yates on range(start, stop), only swapped positions are stored"""
+
+    def __init__(self, start, stop):
+        self.start, self.stop = start, stop
+        self.swaps = {}
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def take(self, position):
+        value = self.swaps.get(position, position)
+        self.swaps[position] = self.swaps.get(self.start, self.start)
+        self.start += 1
+        return value
+
+    def draw(self, rng):
+        return self.take(self.start + int(rng.random() * len(self)))
+
+
+def _draw_classes(classes, exclude, rng):
+    # remaining mass of a class is remaining/initial size, as in sequential sampling without replacement
+    shuffles = [_LazyShuffle(a, b) for a, b in classes]
+    if exclude is not None:
+        shuffles[1].take(exclude)
+    sizes = [len(shuffle) for shuffle in shuffles]
+    while True:
+        masses = [len(shuffle) / n if n else 0 for shuffle, n in zip(shuffles, sizes)]
+        total = sum(masses)
+        if total == 0:
+            return
+        x = rng.random() * total
+        for shuffle, mass in zip(shuffles, masses):
+            if mass and x < mass:
+                break
+            x -= mass
+        else:
+            # rounding, take the last class that has cips left
+            shuffle = [shuffle for shuffle in shuffles if len(shuffle)][-1]
+        yield shuffle.draw(rng)
+
+
+def _draw_weighted(classes, exclude, weights, rng):
+    weights = np.array(weights, dtype=float)
+    if exclude is not None:
+        weights[exclude] = 0
+    p = np.zeros(len(weights))
+    for a, b in classes:
+        n = np.count_nonzero(weights[a:b] > 0)
+        if n:
+            p[a:b] = np.maximum(weights[a:b], 0) / n
+    # gumbel-top-k: sorting log(p) + gumbel noise is sampling without replacement
+    candidates = np.flatnonzero(p > 0)
+    uniform = 1.0 - np.array([rng.random() for i in range(len(candidates))])
+    keys = np.log(p[candidates]) - np.log(-np.log(uniform))
+    heap = list(zip((-keys).tolist(), candidates.tolist()))
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[1]
 
 
 class LocalSubstitutionGraphGrammarSample(LocalSubstitutionGraphGrammar):
 
-    def _sample_size_adjusted(self, subs):
-        '''proposals are sampled, such that increasing or decreasing the graph has equal probability'''
-        probs= self._make_size_adjusted_probabilities(subs)
-        return self._sample(subs, probs)
-
-    def _make_size_adjusted_probabilities(self, subs):
-
-        # get size change for each  substitution
-        diffs = [ len(b.core_nodes)-len(a.core_nodes) for a,b in subs  ]
-
-        z = diffs.count(0)
-        s = sum(x<0 for x in diffs)
-        g = sum(x>0 for x in diffs)
-        logger.log(5,"assigned probabilities: same: %d, smaller %d, bigger %d" % (z,s,g))
-        z = 1/z if z !=0 else 1
-        s = 1/s if s !=0 else 1
-        g = 1/g if g !=0 else 1
-        def f(d):
-            if d ==0:
-                return z
-            if d>0:
-                return g
-            return s
-        return [ f(d)  for d in diffs]
-
-    def _sample(self, subs, probabilities):
-        if len(subs)==0: return []
-        suu = sum(probabilities)
-        p=[x/suu for x in probabilities]
-        samples = np.random.choice( list(range(len(subs))) ,
-                size=len(subs),
-                replace=False,
-                p=p)
-        return [subs[i] for i in samples[::-1]]
-
-    def neighbors_core(self, graph, core):
-        """iterator over all neighbors of graph (that are conceiveable by the grammar)"""
-
-        graph_cip = self._get_cip(core, graph)
-        cip_substitutions = [(graph_cip, congruent_cip)
-                             for congruent_cip in self._get_congruent_cips(graph_cip)]
-
-        for cip, congruent_cip in  self._sample_size_adjusted(cip_substitutions):
-            graph_ = self._substitute_core(graph, cip, congruent_cip)
+    def _get_size_buckets(self, interface_hash):
+        """SizeBuckets of an interface, None if it is not in the grammar"""
+        buckets = self.__dict__.setdefault('_size_buckets', {})
+        if interface_hash not in buckets:
+            cips = self.productions.get(interface_hash)
+            buckets[interface_hash] = SizeBuckets(cips.values()) if cips else None
+        return buckets[interface_hash]
+
+    def _congruent_weights(self, cip, cips):
+        """weights for the cips of cip's interface, None: all the same"""
+        return None
+
+    def _propose(self, cip, rng=random):
+        """the congruent cips of cip, lazily in size adjusted random order"""
+        buckets = self._get_size_buckets(cip.interface_hash)
+        if buckets is None:
+            return iter(())
+        return buckets.draw(cip, self._congruent_weights(cip, buckets.cips), rng=rng)
+
+    def fit(self, *args, **kwargs):
+        self._size_buckets = {}
+        return super(LocalSubstitutionGraphGrammarSample, self).fit(*args, **kwargs)
+
+    def partial_fit(self, *args, **kwargs):
+        self._size_buckets = {}
+        return super(LocalSubstitutionGraphGrammarSample, self).partial_fit(*args, **kwargs)
+
+    def finalize(self):
+        self._size_buckets = {}
+        return super(LocalSubstitutionGraphGrammarSample, self).finalize()
+
+    def load(self, path, mmap=True):
+        self._size_buckets = {}
+        return super(LocalSubstitutionGraphGrammarSample, self).load(path, mmap=mmap)
+
+    def neighbors_core(self, graph, core, rng=random):
+        """iterator over all neighbors of graph (that are conceiveable by the grammar)
+        graph may also be a Decomposition, see lsgg_core_interface_pair.decompose"""
+
+        decomposition = self._decompose(graph)
+        graph_cip = self._get_cip(core, decomposition)
+        for graph_ in self._substitute_cores(decomposition.graph, graph_cip, self._propose(graph_cip, rng)):
             if graph_ is not None:
                 yield graph_
 
-    def neighbors_sample(self, graph, n_neighbors):
+    def neighbors_sample(self, graph, n_neighbors, rng=random):
         """neighbors_sample. might be a little bit faster by avoiding cip extractions,
         chooses a node first and then picks form the subs evenly
+        rng: source of randomness, e.g. a random.Random per chain
         """
-        cores = list(self._get_cores(graph))
-        random.shuffle(cores)
+        if n_neighbors <= 0:
+            return
+        decomposition = self._decompose(graph)
+        cores = list(self._get_cores(decomposition))
+        rng.shuffle(cores)
         for core in cores:
-            for graph_ in self.neighbors_core(graph, core):
-                if n_neighbors > 0:
-                    yield graph_
-                    n_neighbors = n_neighbors - 1
+            for graph_ in self.neighbors_core(decomposition, core, rng):
+                yield graph_
+                n_neighbors = n_neighbors - 1
+                # substitutions are made lazily, stop before the next one
+                if n_neighbors == 0:
+                    return
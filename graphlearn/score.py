@@ -2,16 +2,304 @@
 
 """Provides the wrapper for estimators."""
 
-from eden.graph import Vectorizer
+from eden.graph import Vectorizer, _edge_to_vertex_transform, _label_preprocessing, _clean_graph
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.svm import OneClassSVM
 import random
+import copy
+import weakref
+from collections import OrderedDict, defaultdict
 import numpy as np
-from graphlearn.util.multi import mpmap
+import networkx as nx
+from graphlearn import lsgg_core_interface_pair
+from graphlearn.csrhash import CSRGraphHasher
+from graphlearn.util.multi import get_pool, chunks
 import scipy as sp
 import logging 
 logger = logging.getLogger(__name__)
 
+class CachedEstimator():
+    """
+    memoizes the decision_function of an estimator per graph.
+
+    graphs are keyed by their size and a fingerprint (graph_hash of the expanded
+    graph, so edge labels count, CSRGraphHasher by default). the maxsize most recently used
+    scores are kept, graphs that are not cached are scored in one batch.
+    setting an attribute (e.g. sizefactor) sets it on the estimator and clears
+    the cache. other attributes are read from the estimator.
+
+    the fingerprint is computed for hits too, for a chem graph it costs about 1/8 of
+    scoring it with OneClassEstimator. it is kept per graph object, graphs must not be
+    changed once they are scored (the sampler rescores the current graph every step).
+    the fingerprint is a neighborhood hash, not a canonical form: graphs that it does
+    not tell apart (e.g. some regular graphs) get the score of the graph that was
+    cached first. verify=True keeps the cached graphs and checks hits for isomorphism
+    (labels count), this costs memory and a VF2 run per hit.
+    """
+    _own = {'estimator', 'maxsize', 'hasher', 'verify', 'hits', 'misses', '_cache', '_fingerprints'}
+
+    def __init__(self, estimator, maxsize=100000, hasher=None, verify=False):
+        self.estimator = estimator
+        self.maxsize = maxsize
+        self.hasher = hasher or CSRGraphHasher()
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+        # key: (score, graph if verify)
+        self._cache = OrderedDict()
+        self._fingerprints = weakref.WeakKeyDictionary()
+
+    def fingerprint(self, graph):
+        key = self._fingerprints.get(graph)
+        if key is None:
+            key = self._fingerprints[graph] = lsgg_core_interface_pair.graph_fingerprint(graph, self.hasher)
+        return key
+
+    def fit(self, *args, **kwargs):
+        self.estimator.fit(*args, **kwargs)
+        self.cache_clear()
+        return self
+
+    def decision_function(self, graphs):
+        keys = [self.fingerprint(g) for g in graphs]
+        result = [None] * len(graphs)
+        missing = {}
+        collided = []
+        for i, (key, graph) in enumerate(zip(keys, graphs)):
+            entry = self._cache.get(key)
+            if entry is not None and self._same(graph, entry[1]):
+                self._cache.move_to_end(key)
+                result[i] = entry[0]
+                self.hits += 1
+            elif key in missing and self._same(graph, missing[key]):
+                self.hits += 1
+            elif key in missing:
+                # collides with another graph of this batch, scored but not cached
+                collided.append(i)
+                self.misses += 1
+            else:
+                missing[key] = graph
+                self.misses += 1
+        batch = list(missing.values()) + [graphs[i] for i in collided]
+        batch_scores = list(self.estimator.decision_function(batch)) if batch else []
+        scores = dict(zip(missing, batch_scores))
+        for i, score in zip(collided, batch_scores[len(missing):]):
+            result[i] = score
+        for i, key in enumerate(keys):
+            if result[i] is None:
+                result[i] = scores[key]
+        for key, score in scores.items():
+            self._cache[key] = score, missing[key] if self.verify else None
+            self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return np.array(result)
+
+    def _same(self, graph, cached):
+        return not self.verify or graph is cached or \
+            nx.is_isomorphic(graph, cached, node_match=_same_label, edge_match=_same_label)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache), 'maxsize': self.maxsize}
+
+    def cache_clear(self):
+        self._cache.clear()
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in self._own:
+            raise AttributeError(name)
+        return getattr(self.estimator, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.estimator, name, value)
+            self.cache_clear()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_fingerprints'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._fingerprints = weakref.WeakKeyDictionary()
+
+    def __copy__(self):
+        # e.g. a sampler chain, nothing mutable is shared
+        new = CachedEstimator(copy.copy(self.estimator), self.maxsize, self.hasher, self.verify)
+        new._cache = OrderedDict(self._cache)
+        return new
+
+
+def _same_label(a, b):
+    return a.get('label') == b.get('label')
+
+
+class IncrementalVectorizer(Vectorizer):
+    """
+    eden Vectorizer that updates the vector of the parent graph for the result of a core substitution.
+
+    the features of a node only depend on the graph within r+d hops of it. for a graph with a
+    graph.graph['substitution'] (lsgg_core_interface_pair.Substitution) whose parent was vectorized
+    here, only the nodes within r+d hops of the old core, the new core and the interface are
+    vectorized again, their old features are subtracted from the parent's counts and the new
+    ones added. the result is that of Vectorizer.transform.
+
+    the features of every node are kept while a graph is alive. graphs with weights or nesting
+    edges, expanded graphs, discrete=False, positional=True and graphs whose parent is gone are
+    vectorized in full.
+    the grammar only keeps the substitution with grammar.record_substitutions = True.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._features = weakref.WeakKeyDictionary()
+
+    def set_params(self, **args):
+        super().set_params(**args)
+        self._features = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        state = dict(super().__getstate__())
+        state.pop('_features', None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._features = weakref.WeakKeyDictionary()
+
+    def _transform(self, graph):
+        features = self.features(graph)
+        if features is None:
+            return super()._transform(graph)
+        # the order of (radius, distance) in which Vectorizer._transform finds them
+        counts = features.counts
+        return self._normalization({k: counts[k] for k in sorted(counts, key=lambda k: (k[1], k[0]))})
+
+    def features(self, graph):
+        """_Features of graph, None if it is vectorized in full"""
+        if graph in self._features:
+            return self._features[graph]
+        if not self._is_local(graph):
+            return None
+        # graph.graph of graphs read with old versions of networkx can be a list
+        parent = graph.graph['substitution'].parent if 'substitution' in graph.graph else None
+        parent_features = self.features(parent) if parent is not None else None
+        if parent_features is None:
+            features = self._all_features(graph)
+        else:
+            features = self._update_features(graph, graph.graph['substitution'], parent, parent_features)
+        self._features[graph] = features
+        return features
+
+    def _is_local(self, graph):
+        # positional features see the ids of the edge nodes, they change with every expansion
+        return (self.discrete and not self.positional and 'expanded' not in graph.graph and
+                not any(d.get(self.key_weight, False) for n, d in graph.nodes(data=True)) and
+                not any(d.get(self.key_nesting, False) for a, b, d in graph.edges(data=True)))
+
+    def _all_features(self, graph):
+        # like Vectorizer._transform, the features of the nodes are only needed if graph becomes a parent
+        exgraph = self._graph_preprocessing(graph)
+        feature_list = defaultdict(lambda: defaultdict(float))
+        for v in exgraph.nodes():
+            if exgraph.nodes[v].get('node', False):
+                self._transform_vertex(exgraph, v, feature_list)
+        _clean_graph(exgraph)
+        graph = weakref.ref(graph)
+        return _Features({k: dict(v) for k, v in feature_list.items()}, nodes=lambda: self._node_features(graph()))
+
+    def _node_features(self, graph):
+        exgraph = self._graph_preprocessing(graph)
+        nodes = {v: self._vertex_features(exgraph, v) for v in exgraph.nodes() if exgraph.nodes[v].get('node', False)}
+        _clean_graph(exgraph)
+        return nodes
+
+    def _update_features(self, graph, substitution, parent, parent_features):
+        hops = self.r + self.d
+        affected = _neighborhood(graph, substitution.inserted + substitution.interface, hops)
+        if len(affected) == len(graph):
+            # nothing to gain
+            return self._all_features(graph)
+        affected |= _neighborhood(parent, substitution.removed + substitution.interface, hops)
+
+        # the nodes we vectorize again and their neighbors need remote_neighbours and neigh_graph_hash,
+        # these see max(r, d) hops, one more hop gets the degrees right
+        support = _neighborhood(graph, [v for v in affected if v in graph], self.d)
+        exgraph = _edge_to_vertex_transform(graph.subgraph(_neighborhood(graph, support, max(self.r, self.d) + 1)))
+        _label_preprocessing(exgraph, key_label=self.key_label, bitmask=self.bitmask)
+        for v in support:
+            self._single_vertex_breadth_first_visit(exgraph, v, max(self.r, self.d) * 2)
+            self._compute_neighborhood_graph_hash(v, exgraph)
+        changed = {v: self._vertex_features(exgraph, v) if v in graph else None for v in affected}
+
+        counts = {k: dict(v) for k, v in parent_features.counts.items()}
+        old_nodes = parent_features.nodes
+        for v in affected:
+            if v in parent:
+                for key, feature_list in old_nodes[v].items():
+                    features = counts[key]
+                    for feature, value in feature_list.items():
+                        features[feature] -= value
+                        if features[feature] == 0:
+                            del features[feature]
+            if changed[v] is not None:
+                for key, feature_list in changed[v].items():
+                    features = counts.setdefault(key, {})
+                    for feature, value in feature_list.items():
+                        features[feature] = features.get(feature, 0.0) + value
+        counts = {k: v for k, v in counts.items() if v}
+        return _Features(counts, parent=parent_features, changed=changed)
+
+    def _vertex_features(self, exgraph, v):
+        feature_list = defaultdict(lambda: defaultdict(float))
+        self._transform_vertex(exgraph, v, feature_list)
+        return feature_list
+
+
+class _Features(object):
+    """
+    feature counts of a graph, {(radius, distance): {feature: count}}, and the features of each node.
+    nodes is computed when it is first needed, by the function nodes or from the parent and the changed nodes
+    """
+    __slots__ = ('counts', '_nodes', '_parent', '_changed')
+
+    def __init__(self, counts, nodes=None, parent=None, changed=None):
+        self.counts = counts
+        self._nodes = nodes
+        self._parent = parent
+        self._changed = changed
+
+    @property
+    def nodes(self):
+        """{node: {(radius, distance): {feature: count}}}"""
+        if callable(self._nodes):
+            self._nodes = self._nodes()
+        elif self._nodes is None:
+            nodes = dict(self._parent.nodes)
+            for v, feature_list in self._changed.items():
+                if feature_list is None:
+                    nodes.pop(v, None)
+                else:
+                    nodes[v] = feature_list
+            self._nodes, self._parent, self._changed = nodes, None, None
+        return self._nodes
+
+
+def _neighborhood(graph, nodes, hops):
+    """nodes within hops of nodes"""
+    seen = set(nodes)
+    frontier = seen
+    for i in range(hops):
+        frontier = {u for v in frontier for u in graph[v]} - seen
+        if not frontier:
+            break
+        seen |= frontier
+    return seen
+
+
 class SimpleDistanceEstimator():
     def __init__(self):
         self.reference_vec, self.vectorizer = None, None
@@ -36,10 +324,12 @@ class OneClassEstimator():
         self.vectorizer=vectorizer
     
     def transform(self,graphs):
-        if self.n_jobs==1:
+        if self.n_jobs==1 or len(graphs) < 2:
             return self.vectorizer.transform(graphs)
         else: 
-            return sp.sparse.vstack( mpmap( self.vectorizer.transform, [[g] for g in graphs], poolsize=self.n_jobs ) ) 
+            # one batch per process, the pool lives across calls
+            pool = get_pool(self.n_jobs)
+            return sp.sparse.vstack( pool.map( self.vectorizer.transform, chunks(list(graphs), pool.processes), chunksize=1 ) ) 
 
     def fit(self,graphs):
         self.model.fit(self.transform(graphs) )
@@ -83,13 +373,14 @@ class OneClassAndSizeFactor(OneClassEstimator):
         return 1 - diff*self.sizepenalty
 
 class RandomEstimator():
+    rng = random
     def __init__(self):
         pass
     def fit(self, graph=None, vectorizer=Vectorizer()):
         return self
 
     def decision_function(self, graphs):
-        return np.array(  [random.random() for e in range(len(graphs))])
+        return np.array(  [self.rng.random() for e in range(len(graphs))])
 
 
 
@@ -0,0 +1,343 @@
+"""
+Binary snapshots of fitted grammars.
+
+    grammar.save('model.glsnap')
+    grammar = snapshot.load('model.glsnap')  # or SomeGrammar(..).load(path)
+
+layout of a snapshot file:
+    magic b'GLSNAP', version (uint16), header length (uint64)
+    header: json with the grammar class and parameters, the hasher and
+            the table of arrays (dtype, shape, offset)
+    arrays: raw, 64 byte aligned
+
+the arrays are opened with np.memmap, so loading costs almost nothing and
+several processes that load the same file share its pages. cips are
+rebuilt per interface on first access (see SnapshotProductions).
+labels, non-array cip attributes (e.g. pisi_vectors) and the grammar's parameters
+live in one pickled blob. the header repeats the parameters that json can
+represent, for reading them without loading the snapshot.
+
+trust: like a pickle file, a snapshot can run code when it is loaded. load
+imports the grammar and hasher classes named in the header and unpickles the
+blob. only load snapshots from sources you trust.
+
+arrays (cips are grouped by interface, interfaces sorted by hash):
+    interface_keys (n_interfaces, nbytes) uint8   big endian interface hashes
+    interface_cips (n_interfaces+1,)              cip ranges per interface
+    core_keys      (n_cips, nbytes) uint8         big endian core hashes
+    counts         (n_cips,)
+    node_offsets, edge_offsets (n_cips+1,)        ranges into the arrays below
+    nodes, label_ids, is_edge, core_mask, ilabel_offset (n_nodes,)
+    edges          (n_edges, 2)                   positions within the cip
+    objects                                       pickled labels and attributes
+"""
+
+import json
+import struct
+import pickle
+import importlib
+from collections.abc import MutableMapping
+import numpy as np
+from graphlearn import lsgg_core_interface_pair
+from graphlearn.util.util import jsonable
+
+MAGIC = b'GLSNAP'
+VERSION = 1
+_PREAMBLE = struct.Struct('<6sHQ')
+_ALIGN = 64
+
+
+def _qualname(obj):
+    return '%s.%s' % (type(obj).__module__, type(obj).__name__)
+
+
+def _import(qualname):
+    module, name = qualname.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def _picklable(value):
+    try:
+        pickle.dumps(value)
+        return True
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return False
+
+
+def _params(grammar):
+    """the attributes of grammar that are saved, not the productions, hasher, instrumentation and private caches"""
+    return {k: v for k, v in grammar.__dict__.items()
+            if k not in ('productions', 'hasher', 'instrumentation') and not k.startswith('_') and _picklable(v)}
+
+
+def _hash_bytes(h, nbytes):
+    return h.to_bytes(nbytes, 'big')
+
+
+###########
+# SAVE
+###########
+
+def save(grammar, path):
+    """
+    write grammar (parameters and productions, including counts) to path.
+    parameters are pickled as they are, attributes that can not be pickled
+    (e.g. lambdas) and private ones (starting with _) are not saved.
+    """
+    hasher = grammar.hasher
+    nbytes = hasher.bits // 8
+    params = _params(grammar)
+    cips = [(ih, cip) for ih, bucket in sorted(grammar.productions.items(), key=lambda item: item[0])
+            for cip in bucket.values()]
+    cips = [(ih, cip.compact()) for ih, cip in cips]
+
+    interface_keys = sorted(set(ih for ih, cip in cips))
+    interface_pos = {ih: i for i, ih in enumerate(interface_keys)}
+    interface_cips = np.zeros(len(interface_keys) + 1, dtype=np.int64)
+    for ih, cip in cips:
+        interface_cips[interface_pos[ih] + 1] += 1
+
+    labels, label_ids = {}, []
+    extra, attributes = {}, {}
+    for i, (ih, cip) in enumerate(cips):
+        label_ids.append(np.array([labels.setdefault(l, len(labels)) for l in cip.labels], dtype=np.int32))
+        if cip.extra:
+            extra[i] = cip.extra
+        if cip.__dict__:
+            attributes[i] = cip.__dict__
+    label_table = [None] * len(labels)
+    for l, i in labels.items():
+        label_table[i] = l
+
+    def concat(arrays, dtype, shape=(0,)):
+        return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(shape, dtype=dtype)
+
+    def keys(hashes):
+        return np.frombuffer(b''.join(_hash_bytes(h, nbytes) for h in hashes),
+                             dtype=np.uint8).reshape(-1, nbytes)
+
+    arrays = {
+        'interface_keys': keys(interface_keys),
+        'interface_cips': np.cumsum(interface_cips),
+        'core_keys': keys([cip.core_hash for ih, cip in cips]),
+        'counts': np.array([cip.count for ih, cip in cips], dtype=np.int64),
+        'node_offsets': np.cumsum([0] + [len(cip.nodes) for ih, cip in cips]).astype(np.int64),
+        'edge_offsets': np.cumsum([0] + [len(cip.edges) for ih, cip in cips]).astype(np.int64),
+        'nodes': concat([cip.nodes for ih, cip in cips], np.int64),
+        'label_ids': concat(label_ids, np.int32),
+        'is_edge': concat([cip.is_edge for ih, cip in cips], bool),
+        'core_mask': concat([cip.core_mask for ih, cip in cips], bool),
+        'ilabel_offset': concat([cip.ilabel_offset for ih, cip in cips], np.int64),
+        'edges': concat([cip.edges for ih, cip in cips], np.int32, (0, 2)),
+        'objects': np.frombuffer(pickle.dumps({'labels': label_table, 'extra': extra,
+                                               'attributes': attributes, 'params': params}), dtype=np.uint8),
+    }
+
+    header = {
+        'grammar': _qualname(grammar),
+        'params': {k: v for k, v in params.items() if jsonable(v)},
+        'hasher': {'class': _qualname(hasher), 'bits': hasher.bits,
+                   'key': hasher.key.hex(), 'depth': hasher.depth},
+        'arrays': {},
+    }
+
+    # offsets are relative to the data section, which starts after the header
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+        offset += _aligned(array.nbytes)
+    header_bytes = json.dumps(header).encode()
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    with open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+
+
+def _aligned(n):
+    return -(-n // _ALIGN) * _ALIGN
+
+
+###########
+# LOAD
+###########
+
+def read_header(path):
+    """(header dict, start of the data section)"""
+    with open(path, 'rb') as f:
+        magic, version, length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a grammar snapshot" % path)
+        if version != VERSION:
+            raise ValueError("snapshot version %d is not supported (expected %d)" % (version, VERSION))
+        header = json.loads(f.read(length).decode())
+    return header, _aligned(_PREAMBLE.size + length)
+
+
+def _open_arrays(path, header, data_start, mmap):
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + spec['offset'], shape=shape)
+        else:
+            count = int(np.prod(shape))
+            arrays[name] = np.fromfile(path, dtype=dtype, count=count,
+                                       offset=data_start + spec['offset']).reshape(shape)
+    return arrays
+
+
+def load(path, grammar=None, mmap=True):
+    """
+    load a snapshot. this imports the classes it names and unpickles its blob,
+    only load snapshots you trust (see the module docstring).
+    grammar: instance to load into, by default the saved grammar class is
+        instanciated without calling __init__. attributes that could not be
+        saved (e.g. functions) are kept from the instance.
+    mmap: memory-map the arrays instead of reading them
+    """
+    header, data_start = read_header(path)
+    if grammar is None:
+        cls = _import(header['grammar'])
+        grammar = cls.__new__(cls)
+    h = header['hasher']
+    hasher = _import(h['class'])(bits=h['bits'], key=bytes.fromhex(h['key']), depth=h['depth'])
+    productions = SnapshotProductions(path, hasher, mmap=mmap)
+    # snapshots written before the parameters were pickled only have the json ones
+    grammar.__dict__.update(productions._objects.get('params', header['params']))
+    grammar.hasher = hasher
+    grammar.productions = productions
+    return grammar
+
+
+class SnapshotProductions(MutableMapping):
+    """
+    productions ({interface_hash: {core_hash: cip}}) backed by a snapshot file.
+
+    an interface's cips are built from the arrays when it is first accessed.
+    the mapping can be changed like the defaultdict of a fitted grammar,
+    changes are kept in memory. pickling ships the path (and the changes),
+    not the arrays.
+    """
+
+    def __init__(self, path, hasher, mmap=True):
+        self.path = path
+        self.hasher = hasher
+        self.mmap = mmap
+        header, data_start = read_header(path)
+        self._arrays = _open_arrays(path, header, data_start, mmap)
+        self._objects = pickle.loads(self._arrays.pop('objects').tobytes())
+        self._nbytes = hasher.bits // 8
+        self._index = self._arrays['interface_keys'].view('S%d' % self._nbytes).ravel()
+        self._buckets = {}
+        self._deleted = set()
+
+    def __reduce__(self):
+        return (_reopen_productions, (self.path, self.hasher, self.mmap, self._buckets, self._deleted))
+
+    def _find(self, interface_hash):
+        """position of interface_hash in the file or None"""
+        if not isinstance(interface_hash, int) or not 0 <= interface_hash < 2 ** (8 * self._nbytes):
+            return None
+        key = _hash_bytes(interface_hash, self._nbytes)
+        pos = int(np.searchsorted(self._index, np.bytes_(key)))
+        if pos < len(self._index) and self._arrays['interface_keys'][pos].tobytes() == key:
+            return pos
+        return None
+
+    def _stored(self, interface_hash):
+        return interface_hash not in self._deleted and self._find(interface_hash) is not None
+
+    def _load_bucket(self, pos):
+        a = self._arrays
+        interface_hash = int.from_bytes(a['interface_keys'][pos].tobytes(), 'big')
+        bucket = {}
+        for i in range(a['interface_cips'][pos], a['interface_cips'][pos + 1]):
+            cip = self._load_cip(int(i), interface_hash)
+            bucket[cip.core_hash] = cip
+        return bucket
+
+    def _load_cip(self, i, interface_hash):
+        a = self._arrays
+        n0, n1 = a['node_offsets'][i], a['node_offsets'][i + 1]
+        e0, e1 = a['edge_offsets'][i], a['edge_offsets'][i + 1]
+        labels = self._objects['labels']
+        cip = lsgg_core_interface_pair.CompactCoreInterfacePair.__new__(lsgg_core_interface_pair.CompactCoreInterfacePair)
+        cip.core_hash = int.from_bytes(a['core_keys'][i].tobytes(), 'big')
+        cip.interface_hash = interface_hash
+        cip.count = int(a['counts'][i])
+        cip.hasher = self.hasher
+        cip.nodes = a['nodes'][n0:n1]
+        cip.labels = tuple(labels[l] for l in a['label_ids'][n0:n1].tolist())
+        cip.is_edge = a['is_edge'][n0:n1]
+        cip.core_mask = a['core_mask'][n0:n1]
+        cip.ilabel_offset = a['ilabel_offset'][n0:n1]
+        cip.edges = a['edges'][e0:e1]
+        cip.extra = self._objects['extra'].get(i)
+        cip.__dict__.update(self._objects['attributes'].get(i, {}))
+        return cip
+
+    def __getitem__(self, interface_hash):
+        if interface_hash not in self._buckets:
+            # like defaultdict(dict), unknown interfaces get an empty bucket
+            pos = self._find(interface_hash) if interface_hash not in self._deleted else None
+            self._buckets[interface_hash] = {} if pos is None else self._load_bucket(pos)
+            self._deleted.discard(interface_hash)
+        return self._buckets[interface_hash]
+
+    def __setitem__(self, interface_hash, cips):
+        self._buckets[interface_hash] = cips
+        self._deleted.discard(interface_hash)
+
+    def __delitem__(self, interface_hash):
+        if interface_hash not in self:
+            raise KeyError(interface_hash)
+        self._buckets.pop(interface_hash, None)
+        if self._find(interface_hash) is not None:
+            self._deleted.add(interface_hash)
+
+    def __contains__(self, interface_hash):
+        return interface_hash in self._buckets or self._stored(interface_hash)
+
+    def get(self, interface_hash, default=None):
+        return self[interface_hash] if interface_hash in self else default
+
+    _marker = object()
+
+    def pop(self, interface_hash, default=_marker):
+        if interface_hash not in self:
+            if default is self._marker:
+                raise KeyError(interface_hash)
+            return default
+        value = self[interface_hash]
+        del self[interface_hash]
+        return value
+
+    def _stored_keys(self):
+        for key in self._arrays['interface_keys']:
+            ih = int.from_bytes(key.tobytes(), 'big')
+            if ih not in self._deleted:
+                yield ih
+
+    def __iter__(self):
+        for ih in self._stored_keys():
+            yield ih
+        for ih in list(self._buckets):
+            if not self._stored(ih):
+                yield ih
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _reopen_productions(path, hasher, mmap, buckets, deleted):
+    productions = SnapshotProductions(path, hasher, mmap=mmap)
+    productions._buckets = buckets
+    productions._deleted = deleted
+    return productions
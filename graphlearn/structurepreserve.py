@@ -13,8 +13,8 @@ class StructurePreservingCIP(cip.CoreInterfacePair):
 
         super(StructurePreservingCIP,self).__init__(core,graph,thickness)
 
-        structhash = cip.graph_hash(core, get_node_label= lambda i,n: i if preserve_ids else 0)
-        self.interface_hash= hash((self.interface_hash,structhash)) 
+        structhash = self.hasher.graph_hash(core, get_node_label= lambda i,n: i if preserve_ids else 0)
+        self.interface_hash= self.hasher.combine(self.interface_hash,structhash)
 
 
 class StructurePreservingGrammar(lsgg):
@@ -23,5 +23,5 @@ class StructurePreservingGrammar(lsgg):
         self.preserve_ids= preserve_ids
 
     def _get_cip(self, core=None, graph=None):
-        return StructurePreservingCIP(core=core, graph=graph, thickness=self.thickness, 
+        return StructurePreservingCIP(core=core, graph=self._decompose(graph), thickness=self.thickness, 
                 preserve_ids=self.preserve_ids)
@@ -0,0 +1,50 @@
+from graphlearn.util import util
+from graphlearn import lsgg_core_interface_pair as lcip
+from graphlearn import csrcores
+import networkx as nx
+import random
+
+'''
+the vectorized core enumeration has to produce exactly the cores of get_cores and get_cores_closeloop
+'''
+
+
+def _labeled(graph):
+    for n in graph.nodes():
+        graph.nodes[n]['label'] = random.choice('ab')
+    for a, b in graph.edges():
+        graph[a][b]['label'] = random.choice('12')
+    return graph
+
+
+def _assert_same_cores(graph, radii):
+    for closeloop, reference in [(False, lcip.get_cores), (True, lcip.get_cores_closeloop)]:
+        expected = [list(core.nodes()) for core in reference(graph, radii)]
+        assert [list(core.nodes()) for core in csrcores.get_cores(graph, radii, closeloop)] == expected
+        nodes = lcip.decompose(graph).adjacency()[0]
+        # index arrays are in BFS order
+        assert [sorted(nodes[i] for i in core) for core in csrcores.core_sets(graph, radii, closeloop)] == \
+            [sorted(core) for core in expected]
+
+
+def test_chemgraphs():
+    for graph in util.get_chemgraphs()[:30] + util.get_cyclegraphs():
+        for radii in [[0, 2], [0, 2, 4], [4]]:
+            _assert_same_cores(graph, radii)
+
+
+def test_random_graphs():
+    random.seed(1)
+    for n in [2, 5, 20, 60]:
+        for p in [0.05, 0.2, 0.5]:
+            _assert_same_cores(_labeled(nx.gnp_random_graph(n, p, seed=n)), [0, 2, 4])
+
+
+def test_chunks():
+    chunk_cells = csrcores.CHUNK_CELLS
+    graph = util.get_chemgraphs()[0]
+    try:
+        csrcores.CHUNK_CELLS = 100
+        _assert_same_cores(graph, [0, 2, 4])
+    finally:
+        csrcores.CHUNK_CELLS = chunk_cells
@@ -0,0 +1,69 @@
+from graphlearn.util import util
+from graphlearn.lsgg_core_interface_pair import GraphHasher, Decomposition
+from graphlearn.csrhash import CSRGraphHasher
+from graphlearn import LSGG
+import networkx as nx
+import random
+
+'''
+the vectorized hasher has to produce exactly the values of GraphHasher
+'''
+
+
+def _hashers(**kwargs):
+    return GraphHasher(**kwargs), CSRGraphHasher(**kwargs)
+
+
+def _labeled(graph, labels='ab'):
+    for n in graph.nodes():
+        graph.nodes[n]['label'] = random.choice(labels)
+    for a, b in graph.edges():
+        graph[a][b]['label'] = random.choice('12')
+    return graph
+
+
+def _assert_same_hash(graph, **kwargs):
+    ref, csr = _hashers(**kwargs)
+    ref.add_hlabel(graph)
+    assert ref.graph_hash(graph) == csr.graph_hash(graph)
+
+
+def test_cyclegraphs():
+    for g in util.get_cyclegraphs():
+        _assert_same_hash(Decomposition(g).exgraph)
+
+
+def test_random_graphs():
+    random.seed(1)
+    for n in [1, 2, 5, 20, 60]:
+        for p in [0.05, 0.2, 0.5]:
+            _assert_same_hash(_labeled(nx.gnp_random_graph(n, p, seed=n)))
+
+
+def test_large_graph_uses_csr():
+    random.seed(3)
+    _assert_same_hash(_labeled(nx.random_regular_graph(3, 600, seed=1)))
+
+
+def test_isolates_and_empty():
+    g = _labeled(nx.path_graph(3))
+    g.add_node(10, label='a')
+    _assert_same_hash(g)
+    _assert_same_hash(nx.Graph())
+
+
+def test_depth_and_bits():
+    random.seed(2)
+    g = _labeled(nx.cycle_graph(15))
+    for depth in [0, 1, 3, 8]:
+        _assert_same_hash(g, depth=depth)
+    _assert_same_hash(g, bits=128)
+
+
+def test_grammar_cores_and_interfaces():
+    graphs = util.get_chemgraphs()[:10]
+    ref = LSGG(radii=[0, 1, 2], filter_min_cip=1, filter_min_interface=1).fit(graphs)
+    csr = LSGG(radii=[0, 1, 2], filter_min_cip=1, filter_min_interface=1, hasher=CSRGraphHasher()).fit(graphs)
+    assert {i: set(c) for i, c in ref.productions.items()} == {i: set(c) for i, c in csr.productions.items()}
+    assert [cip.count for c in ref.productions.values() for cip in c.values()] == \
+           [cip.count for c in csr.productions.values() for cip in c.values()]
@@ -0,0 +1,93 @@
+from graphlearn.util import util
+from graphlearn import lsgg_core_interface_pair as lcip
+from graphlearn.test import cycler
+import networkx as nx
+
+
+def _graphs():
+    return util.get_chemgraphs()[:10] + util.get_cyclegraphs()[:3]
+
+
+def _expanded(graph, hasher=None):
+    """the expanded, hlabeled graph without a Decomposition"""
+    exgraph = lcip._edge_to_vertex(graph)
+    lcip._add_hlabel(exgraph, hasher)
+    return exgraph
+
+
+def _same_graph(a, b):
+    return dict(a.nodes(data=True)) == dict(b.nodes(data=True)) and \
+        {frozenset(e): d for *e, d in a.edges(data=True)} == {frozenset(e): d for *e, d in b.edges(data=True)}
+
+
+def test_exgraph_and_distances():
+    for graph in _graphs():
+        decomposition = lcip.decompose(graph)
+        assert lcip.decompose(decomposition) is decomposition
+        reference = _expanded(graph)
+        assert _same_graph(decomposition.exgraph, reference)
+        nodes = list(reference)
+        for roots in [nodes[:1], nodes[2:5], nodes[::3]]:
+            for cutoff in [0, 1, 3, 6]:
+                distances = decomposition.distances(roots, cutoff)
+                assert distances == dict(lcip.short_paths(reference, roots, cutoff))
+                # cached, the order of the roots does not matter
+                assert decomposition.distances(roots[::-1], cutoff) is distances
+
+
+def test_adjacency():
+    for graph in _graphs():
+        decomposition = lcip.decompose(graph)
+        nodes, indptr, indices = decomposition.adjacency()
+        assert decomposition.adjacency()[1] is indptr
+        assert nodes == list(decomposition.exgraph)
+        for i, node in enumerate(nodes):
+            assert [nodes[j] for j in indices[indptr[i]:indptr[i + 1]]] == list(decomposition.exgraph[node])
+
+
+def _layered_graphs():
+    graph = util.test_get_circular_graph()
+    other = graph.copy()
+    other.nodes[0]['label'] = 'weird'
+    encoder = cycler.Cycler()
+    return [encoder.encode_single(graph), encoder.encode_single(other)]
+
+
+def test_original():
+    hasher = lcip.GraphHasher(bits=128)
+    for graph in _layered_graphs():
+        decomposition = lcip.decompose(graph, hasher)
+        original = decomposition.original
+        assert decomposition.original is original and original.hasher is hasher
+        assert original.graph is graph.graph['original']
+        assert _same_graph(original.exgraph, _expanded(graph.graph['original'], hasher))
+
+
+def test_layered_cips():
+    # the base cips cut from the cached .original are the ones of a fresh expansion of the original
+    from graphlearn.lsgg_layered import lsgg_layered
+    from graphlearn.lsgg_pisilayer import lsgg_pisilayer
+    from graphlearn.lsgg_pisi import CIP_PiSi
+    grammars = [lsgg_layered(radii=[0, 1], thickness=1),
+                lsgg_pisilayer(radii=[0, 1], thickness=1, thickness_pisi=1)]
+    for grammar in grammars:
+        for graph in _layered_graphs():
+            decomposition = grammar._decompose(graph)
+            for core in grammar._get_cores(decomposition):
+                cip = grammar._get_cip(core, decomposition)
+                if cip is None:
+                    continue
+                base_graph = graph.graph['original']
+                base_core = grammar._make_base_core(_expanded(base_graph), core)
+                coarse = lcip.CoreInterfacePair(core=lcip._edge_to_vertex(graph).subgraph(core.nodes()),
+                                                graph=graph, thickness=grammar.thickness)
+                if isinstance(grammar, lsgg_pisilayer):
+                    base = CIP_PiSi(core=base_core, graph=base_graph, thickness=grammar.base_thickness,
+                                    thickness_pisi=grammar.thickness_pisi)
+                    assert cip.pisi_hash == base.pisi_hash
+                else:
+                    base = lcip.CoreInterfacePair(core=base_core, graph=base_graph, thickness=grammar.base_thickness)
+                assert sorted(cip.core_nodes) == sorted(base.core_nodes)
+                assert cip.core_hash == base.core_hash
+                assert cip.interface_hash == base.hasher.combine(base.interface_hash, coarse.interface_hash)
+                assert nx.is_isomorphic(cip.graph, base.graph)
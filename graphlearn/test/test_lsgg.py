@@ -8,7 +8,10 @@
 
 import logging
 from graphlearn.util import util
+from graphlearn import lsgg_core_interface_pair
+from graphlearn import LSGG
 import networkx as nx
+import numpy as np
 
 import sys
 logging.basicConfig(stream=sys.stdout, level=5) 
@@ -86,3 +89,289 @@ def visualize_test_pathgraphs_thin_interface():
     print("APPLYING ALL PRODUCTIONS:")
     so.gprint(list(lsgg.neighbors(g)))
 
+
+
+def _grammar_keys_in_subprocess(hashseed):
+    import subprocess, os, sys
+    code = "from graphlearn.test.test_lsgg import _grammar_keys; print(_grammar_keys())"
+    env = dict(os.environ, PYTHONHASHSEED=str(hashseed))
+    return subprocess.check_output([sys.executable, "-c", code], env=env).decode().strip()
+
+
+def _grammar_keys():
+    from graphlearn import LSGG
+    lsgg = LSGG(filter_min_cip=1, filter_min_interface=1)
+    lsgg.fit(util.get_cyclegraphs())
+    return sorted((i, c) for i in lsgg.productions for c in lsgg.productions[i])
+
+
+def test_hash_is_process_stable():
+    assert _grammar_keys_in_subprocess(1) == _grammar_keys_in_subprocess(2)
+
+
+def test_hash_width():
+    from graphlearn.lsgg_core_interface_pair import GraphHasher
+    graphs = [util._edenize_for_testing(nx.gnm_random_graph(n, 2 * n, seed=n)) for n in range(2, 40)]
+    for bits in [8, 64, 128, 256]:
+        hasher = GraphHasher(bits=bits)
+        hashes = []
+        for g in graphs:
+            hasher.add_hlabel(g)
+            hashes += [hasher.graph_hash(g)] + list(hasher._node_hashes(g, lambda id, node: node['hlabel']).values())
+        assert all(h.bit_length() <= bits for h in hashes)
+        # the full width is used
+        assert max(h.bit_length() for h in hashes) > bits - 8
+
+
+def test_hash_labels():
+    # labels of any hashable type, ints hash as before
+    from graphlearn.lsgg_core_interface_pair import GraphHasher
+    from graphlearn.csrhash import CSRGraphHasher
+    g = util._edenize_for_testing(nx.path_graph(5))
+    g.add_node(10, label='x')
+    for hasher in [GraphHasher(), CSRGraphHasher()]:
+        hasher.add_hlabel(g)
+        by_int = hasher.graph_hash(g)
+        assert by_int == hasher.graph_hash(g, get_node_label=lambda id, node: np.uint64(node['hlabel']))
+        # a label is coded like add_hlabel codes it
+        assert by_int == hasher.graph_hash(g, get_node_label=lambda id, node: node['label'])
+        assert by_int != hasher.graph_hash(g, get_node_label=lambda id, node: (node['label'], 1))
+    assert GraphHasher().graph_hash(g, lambda id, node: str(node['label'])) == \
+        CSRGraphHasher().graph_hash(g, lambda id, node: str(node['label']))
+
+
+def test_compact_cip():
+    from graphlearn import LSGG
+    g = util.get_cyclegraphs()[1]
+    for cip in LSGG()._get_cips(g):
+        compact = cip.compact()
+        assert dict(compact.graph.nodes(data=True)) == dict(cip.graph.nodes(data=True))
+        assert nx.utils.edges_equal(compact.graph.edges(), cip.graph.edges())
+        assert dict(compact.interface.nodes(data=True)) == dict(cip.interface.nodes(data=True))
+        assert compact.core_nodes == cip.core_nodes
+        assert (compact.core_hash, compact.interface_hash) == (cip.core_hash, cip.interface_hash)
+
+
+def test_sharded_fit():
+    from graphlearn import LSGG
+    graphs = util.get_chemgraphs()[:12]
+    serial = LSGG(filter_min_cip=2).fit(graphs)
+    sharded = LSGG(filter_min_cip=2).fit(graphs, n_jobs=2, shard_size=2)
+    counts = lambda g: [(i, c, cip.count, cip.core_nodes) for i in g.productions for c, cip in g.productions[i].items()]
+    assert counts(serial) == counts(sharded)
+
+
+def test_sharded_fit_all_cpus(monkeypatch):
+    # n_jobs=-1 makes 4 shards per cpu, not one per graph
+    import multiprocessing
+    from graphlearn import LSGG
+    monkeypatch.setattr(multiprocessing, 'cpu_count', lambda: 2)
+    merged = []
+    monkeypatch.setattr(LSGG, '_merge_productions', lambda self, productions, other: merged.append(other))
+    LSGG().fit(util.get_chemgraphs()[:16], n_jobs=-1)
+    assert len(merged) == 8
+
+
+def test_partial_fit():
+    from graphlearn import LSGG
+    graphs = util.get_chemgraphs()[:12]
+    batch = LSGG().fit(graphs)
+    stream = LSGG()
+    for i in range(0, 12, 5):
+        stream.partial_fit(iter(graphs[i:i + 5]))
+    stream.finalize()
+    counts = lambda g: sorted((i, c, cip.count) for i in g.productions for c, cip in g.productions[i].items())
+    assert counts(batch) == counts(stream)
+
+
+def test_two_pass_fit():
+    from graphlearn import LSGG
+    from graphlearn.structurepreserve import StructurePreservingGrammar
+    graphs = util.get_chemgraphs()[:12]
+    counts = lambda g: sorted((i, c, cip.count, cip.core_nodes) for i in g.productions for c, cip in g.productions[i].items())
+    def hash_only():
+        lsgg = LSGG(filter_max_num_substitutions=3)
+        lsgg.hash_only_keys = True
+        return lsgg
+
+    for make in [lambda: LSGG(filter_max_num_substitutions=3), hash_only,
+                 lambda: StructurePreservingGrammar(preserve_ids=False), TaggedGrammar]:
+        reference = counts(make().fit(graphs))
+        assert reference == counts(make().fit(iter(graphs), two_pass=True))
+        assert reference == counts(make().fit(graphs, n_jobs=2, two_pass=True))
+    # both passes go through the overridden _get_cips
+    grammar = TaggedGrammar().fit(graphs, two_pass=True)
+    assert all(cip.tag == 'tagged' for cips in grammar.productions.values() for cip in cips.values())
+
+
+class TaggedGrammar(LSGG):
+    """_get_cips adds an attribute and drops the cips of single nodes, like LsggCoreVec"""
+
+    def _get_cips(self, graph):
+        cips = [cip for cip in super(TaggedGrammar, self)._get_cips(graph) if len(cip.core_nodes) > 1]
+        for cip in cips:
+            cip.tag = 'tagged'
+        return cips
+
+
+def test_canonical_interface_map():
+    # without search we have to find the same mapping as VF2
+    from graphlearn import LSGG
+    graphs = util.get_chemgraphs()
+    lsgg = LSGG(radii=[0, 1], thickness=1).fit(graphs[:20])
+    found = 0
+    for graph in graphs[100:102]:
+        for cip in lsgg._get_cips(graph):
+            for congruent_cip in lsgg._get_congruent_cips(cip):
+                interface_map = lsgg_core_interface_pair.canonical_interface_map(congruent_cip, cip)
+                if interface_map is not None:
+                    found += 1
+                    assert interface_map == next(lsgg_core_interface_pair.find_all_isomorphisms(
+                        congruent_cip.interface, cip.interface))
+    assert found
+    counts = lsgg_core_interface_pair.interface_map_counts
+    before = sum(counts.values())
+    list(lsgg.neighbors(graphs[100]))
+    assert sum(counts.values()) > before
+
+
+def test_substitute_cores():
+    from graphlearn import LSGG
+    graphs = util.get_chemgraphs()
+    lsgg = LSGG(radii=[0, 1], thickness=1).fit(graphs[:20])
+    graph = graphs[100]
+    key = lambda g: nx.weisfeiler_lehman_graph_hash(g, node_attr='label', edge_attr='label') if g else None
+    for cip in lsgg._get_cips(graph):
+        congruent_cips = lsgg._get_congruent_cips(cip)
+        single = [lsgg_core_interface_pair.substitute_core(graph, cip, c) for c in congruent_cips]
+        batch = list(lsgg_core_interface_pair.substitute_cores(graph, cip, congruent_cips))
+        assert list(map(key, single)) == list(map(key, batch))
+
+
+def test_substitution_automorphism():
+    # a substitution is the one of an interface isomorphism, symmetric interfaces have several
+    from graphlearn import LSGG
+    graphs = util.get_chemgraphs()
+    lsgg = LSGG(radii=[0, 1], thickness=1).fit(graphs[:20])
+    graph = graphs[116]
+    key = lambda g: nx.weisfeiler_lehman_graph_hash(g, node_attr='label', edge_attr='label', iterations=5)
+    symmetric = 0
+    for cip in lsgg._get_cips(graph):
+        host = lsgg_core_interface_pair._edge_to_vertex(graph)
+        host.remove_nodes_from(cip.core_nodes)
+        maxid = max(host)
+        for congruent_cip in lsgg._get_congruent_cips(cip):
+            substitutions = set()
+            for interface_map in lsgg_core_interface_pair.find_all_isomorphisms(congruent_cip.interface,
+                                                                                cip.interface):
+                interface_map = dict(interface_map)
+                interface_map.update({c: i + maxid + 1 for i, c in enumerate(congruent_cip.core_nodes)})
+                graph2 = congruent_cip.make_graph(mapping=interface_map, graph=host.copy())
+                substitutions.add(key(lsgg_core_interface_pair.eg._revert_edge_to_vertex_transform(graph2)))
+            assert key(lsgg_core_interface_pair.substitute_core(graph, cip, congruent_cip)) in substitutions
+            symmetric += len(substitutions) > 1
+    assert symmetric
+
+
+def test_instrument():
+    from graphlearn import LSGG
+    import pickle
+    graphs = util.get_chemgraphs()
+    lsgg = LSGG(radii=[0, 1], thickness=1)
+    assert lsgg.instrumentation.as_dict() == {'stages': {}, 'counts': {}}
+    n_cips = len(lsgg._get_cips(graphs[100]))
+    instrumentation = lsgg.instrument()
+    lsgg.fit(graphs[:20])
+    neighbors = list(lsgg.neighbors(graphs[100]))
+    stats = instrumentation.as_dict()
+    for stage in ['decompose', 'cores', 'cip', 'hash', 'store', 'filter', 'interface_map', 'compose', 'revert']:
+        assert stats['stages'][stage]['calls'] > 0
+    # a cip is built once per distinct core and stored once per occurrence
+    assert stats['stages']['store']['calls'] == \
+        stats['counts']['cips'] + stats['counts']['duplicate_cores'] - n_cips
+    counts = stats['counts']
+    assert counts['substitutions'] - counts.get('substitution_failed', 0) == len(neighbors)
+    assert pickle.loads(pickle.dumps(lsgg)).instrumentation.as_dict()['counts'] == counts
+
+    lsgg.instrument(False)
+    list(lsgg.neighbors(graphs[100]))
+    assert instrumentation.as_dict()['counts'] == counts
+
+
+def test_read_graphs(tmp_path):
+    import json
+    from graphlearn import LSGG
+    graphs = util.get_chemgraphs()
+    lsgg = LSGG(radii=[0, 1], thickness=1).fit(graphs[:20])
+    # neighbors are plain graphs unless substitutions are recorded
+    assert 'substitution' not in next(lsgg.neighbors(graphs[100])).graph
+    json.dumps(nx.node_link_data(next(lsgg.neighbors(graphs[100]))))
+    lsgg.record_substitutions = True
+    neighbor = next(lsgg.neighbors(graphs[100]))
+    assert 'substitution' in neighbor.graph
+    path = str(tmp_path / 'graphs.jsonl')
+    with open(path, 'w') as handle:
+        for graph in [graphs[0], neighbor]:
+            handle.write(json.dumps(util.node_link_data(graph)) + '\n')
+    read = list(util.read_graphs(path))
+    assert 'substitution' not in read[1].graph
+    assert all(nx.is_isomorphic(a, b, node_match=dict.__eq__, edge_match=dict.__eq__)
+               for a, b in zip(read, [graphs[0], neighbor]))
+
+
+def test_duplicate_cores():
+    from graphlearn import LSGG
+    from graphlearn import csrcores
+    # in a short path a larger radius covers the whole branch, its cores are found from several roots
+    graphs = util.get_chemgraphs()[:20] + [util._edenize_for_testing(nx.path_graph(4))]
+    path = graphs[-1]
+    decomposition = lsgg_core_interface_pair.decompose(path)
+    cores = list(csrcores.get_cores(decomposition, [0, 2, 4]))
+    unique = csrcores.get_unique_cores(decomposition, [0, 2, 4])
+    assert len(unique) < len(cores)
+    assert sum(multiplicity for core, multiplicity in unique) == len(cores)
+    assert len({frozenset(core) for core in cores}) == len(unique)
+
+    # _get_cores keeps the duplicates, subclasses built on it count as before
+    lsgg = LSGG(radii=[0, 1, 2], thickness=1)
+    assert len(lsgg._get_cores(decomposition)) == len(cores)
+    weighted = lsgg._get_weighted_cores(decomposition)
+    assert [(set(core), m) for core, m in weighted] == [(set(core), m) for core, m in unique]
+
+    def counts(grammar):
+        return {(i, c): cip.count for i in grammar.productions for c, cip in grammar.productions[i].items()}
+
+    args = dict(radii=[0, 1, 2], thickness=1, filter_min_cip=1, filter_min_interface=1)
+    lsgg = LSGG(**args).fit(graphs)
+    once = LSGG(count_duplicate_cores=False, **args).fit(graphs)
+    assert set(counts(lsgg)) == set(counts(once))
+    assert all(counts(once)[key] <= count for key, count in counts(lsgg).items())
+    assert any(counts(once)[key] < count for key, count in counts(lsgg).items())
+    # cips are built once per distinct core, two_pass counts like fit
+    instrumentation = lsgg.instrument()
+    cips = lsgg._get_cips(path)
+    assert len({id(cip) for cip in cips}) == instrumentation.counts['cips'] < len(cips)
+    assert counts(LSGG(**args).fit(graphs, two_pass=True)) == counts(lsgg)
+    assert counts(LSGG(count_duplicate_cores=False, **args).fit(graphs, two_pass=True)) == counts(once)
+    # neighbors substitutes each distinct core once
+    keys = [(cip.interface_hash, cip.core_hash) for cip in cips]
+    n_substitutions = sum(len(lsgg._get_congruent_cips(cip)) for cip in {id(cip): cip for cip in cips}.values())
+    instrumentation.reset()
+    list(lsgg.neighbors(path))
+    assert instrumentation.counts['substitutions'] == n_substitutions
+    assert len(set(keys)) < len(keys)
+
+
+def test_neighbors_subclass_cips():
+    # neighbors proposes from the cips of an overridden _get_cips only
+    graphs = util.get_chemgraphs()[:20]
+    args = dict(radii=[0, 1, 2], thickness=1, filter_min_cip=1, filter_min_interface=1)
+    tagged = TaggedGrammar(**args).fit(graphs)
+    plain = LSGG(**args).fit(graphs)
+    tagged.productions = plain.productions
+    for grammar in [tagged, plain]:
+        cips = list({id(cip): cip for cip in grammar._get_cips(graphs[0])}.values())
+        instrumentation = grammar.instrument()
+        list(grammar.neighbors(graphs[0]))
+        assert instrumentation.counts['substitutions'] == sum(len(grammar._get_congruent_cips(cip)) for cip in cips)
+    assert tagged.instrumentation.counts['substitutions'] < plain.instrumentation.counts['substitutions']
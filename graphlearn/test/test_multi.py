@@ -0,0 +1,41 @@
+from graphlearn.util.multi import WorkerPool, get_pool, mpmap, chunks
+import os
+
+
+def _square(x):
+    return x * x
+
+
+def _pid(x):
+    return os.getpid()
+
+
+def test_pool_is_reused():
+    pool = get_pool(2)
+    assert get_pool(2) is pool
+    assert mpmap(_square, range(20)) == [x * x for x in range(20)]
+    workers = {process.pid for process in pool.pool._pool}
+    assert set(pool.map(_pid, range(40), chunksize=1)) <= workers
+    assert {process.pid for process in pool.pool._pool} == workers
+    assert sorted(pool.imap_unordered(_square, iter(range(20)))) == [x * x for x in range(20)]
+
+
+def test_pool_lifecycle():
+    with WorkerPool(2) as pool:
+        assert not pool.started
+        assert pool.map(_square, [1, 2, 3]) == [1, 4, 9]
+        pool.close()
+        assert not pool.started
+        assert list(pool.imap(_square, [4])) == [16]
+    assert not pool.started
+
+
+def test_chunks():
+    assert pool_chunks(10, 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert pool_chunks(2, 4) == [[0], [1]]
+    assert WorkerPool(2).chunksize(100) == 13
+    assert WorkerPool(2).chunksize(None) == 1
+
+
+def pool_chunks(n, parts):
+    return chunks(list(range(n)), parts)
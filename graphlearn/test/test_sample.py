@@ -0,0 +1,175 @@
+from graphlearn.sample import SizeBuckets
+from collections import Counter
+from types import SimpleNamespace
+import random
+
+
+def _cip(core_hash, size):
+    return SimpleNamespace(core_hash=core_hash, core_nodes=list(range(size)))
+
+
+def _buckets():
+    # 1 smaller, 3 of the same size (one is the graph cip), 6 bigger
+    return SizeBuckets([_cip(h, s) for h, s in enumerate([1, 2, 2, 2, 3, 3, 3, 3, 3, 3])])
+
+
+def test_draw_all():
+    buckets = _buckets()
+    rng = random.Random(0)
+    drawn = [c.core_hash for c in buckets.draw(_cip(1, 2), rng=rng)]
+    assert sorted(drawn) == [0, 2, 3, 4, 5, 6, 7, 8, 9]
+
+
+def test_draw_size_adjusted():
+    # each size class is proposed first with probability 1/3
+    buckets = _buckets()
+    rng = random.Random(0)
+    sizes = Counter(len(next(buckets.draw(_cip(1, 2), rng=rng)).core_nodes) for i in range(3000))
+    assert all(900 < sizes[s] < 1100 for s in [1, 2, 3])
+
+
+def test_draw_weighted():
+    buckets = _buckets()
+    rng = random.Random(0)
+    weights = [0, 1, 1, 1, 0, 0, 0, 0, 1, 2]
+    drawn = [c.core_hash for c in buckets.draw(_cip(1, 2), weights=weights, rng=rng)]
+    assert sorted(drawn) == [2, 3, 8, 9]
+    first = Counter(next(buckets.draw(_cip(1, 2), weights=weights, rng=rng)).core_hash for i in range(3000))
+    # weight / class size: same size class 2 * 1/2, bigger class 1/2 + 2/2
+    assert 1050 < first[2] + first[3] < 1350
+    assert 1.6 < first[9] / first[8] < 2.4
+
+
+def test_backupmgr():
+    from graphlearn.sample import Backupmgr
+    import random
+    random.seed(1)
+    backup = Backupmgr(5)
+    reference = []
+    for i in range(100):
+        x = (random.choice([.1, .2, .3, .4, .5, .6]), i)
+        backup.push(x)
+        # the list implementation it replaces
+        reference.append(x)
+        reference.sort(key=lambda x: x[0])
+        reference = reference[:5]
+        assert backup.data == reference
+
+    # weighted by score as in the list implementation, random.choices(data, scores)
+    for rng_seed in range(20):
+        assert backup.get(random.Random(rng_seed)) == \
+            random.Random(rng_seed).choices(reference, [p for p, g in reference])[0]
+    # scores random.choices can not use: shifted when negative, uniform when all are 0
+    backup = Backupmgr(3)
+    for x in [(-2., 'a'), (-1., 'b'), (0., 'c')]:
+        backup.push(x)
+    rng = random.Random(0)
+    draws = Counter(backup.get(rng)[1] for i in range(3000))
+    assert draws['a'] == 0 and 800 < draws['b'] < 1200 and 1800 < draws['c'] < 2200
+    backup = Backupmgr(3)
+    for x in [(0., 'a'), (0., 'b')]:
+        backup.push(x)
+    assert {backup.get(rng)[1] for i in range(100)} == {'a', 'b'}
+
+
+def _sampler():
+    from graphlearn.sample import LocalSubstitutionGraphGrammarSample, Sampler
+    from graphlearn.score import RandomEstimator
+    from graphlearn.choice import SelectClassic
+    from graphlearn.util.util import no_transform
+    from graphlearn.util import util
+    graphs = util.get_chemgraphs()
+    grammar = LocalSubstitutionGraphGrammarSample(radii=[0, 1], thickness=1).fit(graphs[:30])
+    sampler = Sampler(grammar=grammar, scorer=RandomEstimator(), selector=SelectClassic(),
+                      transformer=no_transform(), n_steps=4, burnin=1, emit=1)
+    return sampler, graphs[40:44]
+
+
+def test_sample_many():
+    sampler, seeds = _sampler()
+    import networkx as nx
+    wl = lambda g: nx.weisfeiler_lehman_graph_hash(g, node_attr='label', edge_attr='label') if g else None
+    key = lambda results: [[wl(g) for g in res] for i, res in sorted(results, key=lambda x: x[0])]
+    serial = key(sampler.sample_many(seeds, seed=3))
+    assert serial == key(sampler.sample_many(seeds, seed=3))
+    assert serial == key(sampler.sample_many(seeds, n_jobs=2, seed=3))
+    assert len(serial) == 4 and len(sampler.history) == 0
+    assert serial != key(sampler.sample_many(seeds, seed=4))
+    # in a pool worker the chains run in the worker, with this sampler
+    from graphlearn.util.multi import get_pool
+    nested, = get_pool(2).map(_sample_many_in_worker, [3])
+    assert serial == key(nested)
+
+
+def _sample_many_in_worker(seed):
+    sampler, seeds = _sampler()
+    return list(sampler.sample_many(seeds, n_jobs=2, seed=seed))
+
+
+def test_history():
+    from graphlearn.sample import History
+    from graphlearn.util import util
+    import networkx as nx
+    graphs = util.get_chemgraphs()[:6]
+    # consecutive graphs of a chain share most nodes
+    chain = [graphs[0]]
+    for i in range(5):
+        g = chain[-1].copy()
+        g.remove_node(max(g))
+        g.add_edge(0, 100 + i, label='2')
+        g.nodes[100 + i]['label'] = 'N'
+        chain.append(g)
+    same = lambda a, b: (dict(a.nodes(data=True)) == dict(b.nodes(data=True)) and
+                         {frozenset(e): d for *e, d in a.edges(data=True)} == {frozenset(e): d for *e, d in b.edges(data=True)})
+
+    dropped, fingerprints, deltas = History(2), History(2, 'fingerprint'), History(2, 'delta')
+    for history in [dropped, fingerprints, deltas]:
+        for i, g in enumerate(chain):
+            history.append((g, i))
+        assert len(history.entries) == 2
+    assert len(dropped) == 2 and dropped.archive == []
+    assert len(fingerprints) == 2 and len(fingerprints.archive) == 4
+    assert len(deltas) == 6 and deltas.stats()['archive_nbytes'] < deltas.stats()['nbytes']
+    popped = [deltas.pop() for i in range(6)]
+    assert [score for g, score in popped] == [5, 4, 3, 2, 1, 0]
+    assert all(same(g, original) for (g, score), original in zip(popped, chain[::-1]))
+
+    # unbounded unless the sampler is given a depth
+    from graphlearn.sample import Sampler
+    history = Sampler().history
+    for i in range(500):
+        history.append((i, i))
+    assert history.depth is None and len(history) == 500
+    assert Sampler(history_depth=2).history.depth == 2
+
+
+def test_trace(tmp_path):
+    from graphlearn.sample import LocalSubstitutionGraphGrammarSample, Sampler
+    from graphlearn.score import RandomEstimator
+    from graphlearn.choice import SelectClassic
+    from graphlearn.util.util import no_transform
+    from graphlearn.util import util
+    from graphlearn.util.trace import Trace, RingSink, JSONLSink
+    import json
+    graphs = util.get_chemgraphs()
+    grammar = LocalSubstitutionGraphGrammarSample(radii=[0, 1], thickness=1).fit(graphs[:30])
+    ring, path, called = RingSink(5), str(tmp_path / 'trace.jsonl'), []
+    sampler = Sampler(grammar=grammar, scorer=RandomEstimator(), selector=SelectClassic(),
+                      transformer=no_transform(), n_steps=8, burnin=0, emit=1, trace=Trace(ring))
+    sampler.sample_burnin(graphs[40])
+    sampler.trace = Trace(JSONLSink(path))
+    sampler.sample_burnin(graphs[40])
+    sampler.trace.sink.close()
+    sampler.trace, sampler.num_sample = Trace(called.append), 5
+    sampler.sample_burnin(graphs[40])
+
+    records = [json.loads(line) for line in open(path)]
+    assert len(ring.records) == 5 and len(records) == 8 and len(called) == 8
+    assert [r['step'] for r in records] == list(range(8))
+    for record in records + called:
+        assert record['total_s'] >= record['propose_s'] + record['decode_s'] + record['score_s']
+        assert record['event'] in (None, 'dead_end', 'backtrack')
+    assert {r['method'] for r in called} == {'sample_step_multi'}
+    assert all(r['proposals'] <= 5 for r in called)
+    stats = sampler.trace.stats()
+    assert stats['steps'] == 8 and 0 <= stats['acceptance_rate'] <= 1 and stats['proposals_per_s'] > 0
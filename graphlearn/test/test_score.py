@@ -0,0 +1,88 @@
+from graphlearn.score import CachedEstimator, OneClassEstimator, OneClassAndSizeFactor, IncrementalVectorizer
+from graphlearn.util import util
+import numpy as np
+import pickle
+import networkx as nx
+from eden.graph import Vectorizer
+
+
+class _Counting(object):
+    def __init__(self):
+        self.batches = []
+
+    def decision_function(self, graphs):
+        self.batches.append(len(graphs))
+        return [len(g) + g.number_of_edges() / 100. for g in graphs]
+
+
+def test_cached_estimator():
+    graphs = util.get_chemgraphs()[:20]
+    estimator = OneClassEstimator().fit(graphs)
+    cached = CachedEstimator(OneClassEstimator()).fit(graphs)
+    assert np.allclose(cached.decision_function(graphs[5:15]), estimator.decision_function(graphs[5:15]))
+    assert np.allclose(cached.decision_function(graphs), estimator.decision_function(graphs))
+    assert cached.stats() == {'hits': 10, 'misses': 20, 'size': 20, 'maxsize': 100000}
+
+
+def test_cache_lru():
+    graphs = util.get_chemgraphs()[:6]
+    counting = _Counting()
+    cached = CachedEstimator(counting, maxsize=3)
+    cached.decision_function(graphs[:3] + graphs[:1])  # 0 is scored once
+    cached.decision_function(graphs[:1] + graphs[3:4])  # 1 is evicted
+    cached.decision_function(graphs[1:2])
+    assert counting.batches == [3, 1, 1]
+    assert (cached.hits, cached.misses) == (2, 5)
+    cached.batches = []  # attributes are set on the estimator, the cache is cleared
+    assert counting.batches == [] and cached.stats()['size'] == 0
+
+
+class _Components(object):
+    def decision_function(self, graphs):
+        return [nx.number_connected_components(g) for g in graphs]
+
+
+def test_cache_collision():
+    # two rings and a ring of twice the size look the same to the neighborhood hash
+    def labeled(graph):
+        nx.set_node_attributes(graph, 'C', 'label')
+        nx.set_edge_attributes(graph, '1', 'label')
+        return graph
+    rings = labeled(nx.disjoint_union(nx.cycle_graph(20), nx.cycle_graph(20)))
+    ring = labeled(nx.cycle_graph(40))
+    cached = CachedEstimator(_Components())
+    assert cached.fingerprint(rings) == cached.fingerprint(ring)
+    assert list(cached.decision_function([rings])) == [2]
+    assert list(cached.decision_function([ring])) == [2]  # the documented collision
+    verified = CachedEstimator(_Components(), verify=True)
+    assert list(verified.decision_function([rings, ring, rings])) == [2, 1, 2]
+    assert list(verified.decision_function([ring, rings.copy()])) == [1, 2]
+    assert verified.stats()['size'] == 1
+
+
+def test_cache_attributes():
+    graphs = util.get_chemgraphs()[:10]
+    cached = CachedEstimator(OneClassAndSizeFactor()).fit(graphs)
+    cached.sizefactor, cached.sizepenalty = 10, 0
+    before = cached.decision_function(graphs)
+    cached.sizepenalty = 0.1
+    assert not np.allclose(before, cached.decision_function(graphs))
+
+
+def test_incremental_vectorizer():
+    from graphlearn import LSGG
+    graphs = util.get_chemgraphs()
+    lsgg = LSGG(radii=[0, 1], thickness=1).fit(graphs[:20])
+    lsgg.record_substitutions = True
+    graph = graphs[100]
+    children = list(lsgg.neighbors(graph))[:50]
+    grandchildren = list(lsgg.neighbors(children[0]))[:50]
+    assert children[0].graph['substitution'].parent is graph
+    for complexity in [1, 3]:
+        vectorizer = IncrementalVectorizer(complexity=complexity)
+        vectorizer.transform([graph])
+        for proposals in [children, grandchildren]:
+            assert np.allclose(vectorizer.transform(proposals).toarray(),
+                               Vectorizer(complexity=complexity).transform(proposals).toarray())
+    # the parent is not pickled
+    assert pickle.loads(pickle.dumps(children[0])).graph['substitution'].parent is None
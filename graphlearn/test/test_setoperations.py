@@ -0,0 +1,104 @@
+import pytest
+from graphlearn.util import setoperations, util
+from graphlearn import LSGG
+from graphlearn.lsgg_core_interface_pair import GraphHasher
+
+
+def _fit(graphs):
+    return LSGG(radii=[0, 1], thickness=1, filter_min_cip=1, filter_min_interface=1).fit(graphs)
+
+
+def _counts(grammar):
+    return {(i, c): cip.count for i in grammar.productions for c, cip in grammar.productions[i].items()}
+
+
+def test_merge():
+    graphs = util.get_chemgraphs()[:40]
+    shards = [_fit(graphs[i:i + 10]) for i in range(0, 40, 10)]
+    before = [_counts(shard) for shard in shards]
+    merged = setoperations.merge(shards)
+    assert _counts(merged) == _counts(_fit(graphs))
+    # inputs are unchanged, also when the result is fit further
+    assert [_counts(shard) for shard in shards] == before
+    merged.fit(graphs[:5])
+    assert [_counts(shard) for shard in shards] == before
+
+    a, b = shards[:2]
+    union = setoperations.union(a, b)
+    assert set(_counts(union)) == set(_counts(a)) | set(_counts(b))
+    assert all(union.productions[i][c].count == a.productions[i][c].count for i, c in _counts(a))
+    summed = setoperations.union(a, b, sum_counts=True)
+    assert _counts(summed) == _counts(setoperations.merge([a, b]))
+
+
+def test_copy_on_write():
+    graphs = util.get_chemgraphs()[:20]
+    a, b = _fit(graphs[:10]), _fit(graphs[10:])
+    before = _counts(a), _counts(b)
+    merged = setoperations.merge([a, b])
+    shared = lambda result, grammar: {i for i in result.productions if result.productions.get(i) is grammar.productions.get(i)}
+    # buckets of interfaces in one grammar are shared, the others share the cips they do not change
+    only_a, only_b = set(a.productions) - set(b.productions), set(b.productions) - set(a.productions)
+    assert only_a and only_b
+    assert shared(merged, a) == only_a and shared(merged, b) == only_b
+    both = set(a.productions) & set(b.productions)
+    for i in both:
+        bucket = merged.productions.get(i)
+        for c in bucket:
+            assert (bucket.get(c) is a.productions[i].get(c)) == (c not in b.productions[i])
+    assert shared(setoperations.intersect(a, a), a) == {i for i in a.productions if len(a.productions[i]) >= 2}
+    assert shared(setoperations.difference(a, b), a) == {i for i in a.productions if len(a.productions[i]) >= 2 and
+                                                         not set(a.productions[i]) & set(b.productions.get(i, {}))}
+    # the first write copies
+    interface = next(iter(only_a))
+    core = next(iter(a.productions[interface]))
+    merged.productions[interface][core].count += 1
+    assert merged.productions.get(interface) is not a.productions[interface]
+    assert merged.productions[interface][core].count == a.productions[interface][core].count + 1
+    merged.fit(graphs)
+    assert (_counts(a), _counts(b)) == before
+
+
+def test_intersect_difference():
+    graphs = util.get_chemgraphs()[:40]
+    a, b = _fit(graphs[:20]), _fit(graphs[20:])
+    before = _counts(a), _counts(b)
+
+    def keys(grammar):
+        # interfaces with less than 2 cores are dropped
+        return {(i, c) for i, c in grammar if sum(1 for i_, c_ in grammar if i_ == i) >= 2}
+
+    assert set(_counts(setoperations.intersect(a, b))) == keys(set(_counts(a)) & set(_counts(b)))
+    assert set(_counts(setoperations.difference(a, b))) == keys(set(_counts(a)) - set(_counts(b)))
+    subtracted = _counts(setoperations.difference(a, b, substract_cip_count=True))
+    assert all(count == _counts(a)[key] - _counts(b).get(key, 0) > 0 for key, count in subtracted.items())
+    assert (_counts(a), _counts(b)) == before
+
+
+class Sources(LSGG):
+    """merging a cip also merges the shards it was found in, like the pisi vectors of lsgg_pisi.PiSi"""
+
+    def _merge_cip(self, grammar_cip, cip):
+        super(Sources, self)._merge_cip(grammar_cip, cip)
+        grammar_cip.sources = grammar_cip.sources | cip.sources
+
+
+def test_merge_hooks():
+    graphs = util.get_chemgraphs()[:20]
+    shards = []
+    for i in range(0, 20, 10):
+        shard = Sources(radii=[0, 1], thickness=1, filter_min_cip=1, filter_min_interface=1).fit(graphs[i:i + 10])
+        for bucket in shard.productions.values():
+            for cip in bucket.values():
+                cip.sources = frozenset([i])
+        shards.append(shard)
+    merged = setoperations.merge(shards)
+    both = set(_counts(shards[0])) & set(_counts(shards[1]))
+    assert both and all(merged.productions[i][c].sources == {0, 10} for i, c in both)
+    assert all(cip.sources == {0} for bucket in shards[0].productions.values() for cip in bucket.values())
+
+    other = _fit(graphs[:10])
+    other.hasher = GraphHasher(bits=128)
+    for operation in [setoperations.union, setoperations.intersect, setoperations.difference]:
+        with pytest.raises(ValueError):
+            operation(shards[0], other)
@@ -0,0 +1,89 @@
+from graphlearn.util import util
+from graphlearn import LSGG, snapshot
+from graphlearn.csrhash import CSRGraphHasher
+import numpy as np
+import pickle
+import pytest
+
+
+def _fit(**kwargs):
+    return LSGG(radii=[0, 1], filter_min_cip=1, filter_min_interface=1, **kwargs).fit(util.get_chemgraphs()[:15])
+
+
+def _table(grammar):
+    return {(ih, ch): cip for ih in grammar.productions for ch, cip in grammar.productions[ih].items()}
+
+
+def _assert_same(a, b):
+    ta, tb = _table(a), _table(b)
+    assert ta.keys() == tb.keys()
+    for key in ta:
+        x, y = ta[key], tb[key]
+        assert x.count == y.count
+        assert x.labels == y.labels
+        assert x.core_nodes == y.core_nodes
+        for name in ['nodes', 'is_edge', 'edges', 'core_mask', 'ilabel_offset']:
+            assert np.array_equal(getattr(x, name), getattr(y, name))
+
+
+def test_roundtrip(tmp_path):
+    grammar = _fit()
+    path = str(tmp_path / 'grammar.glsnap')
+    grammar.save(path)
+    for mmap in [True, False]:
+        loaded = snapshot.load(path, mmap=mmap)
+        assert type(loaded) is LSGG
+        assert (loaded.radii, loaded.thickness, loaded.filter_min_cip) == (grammar.radii, grammar.thickness, 1)
+        _assert_same(grammar, loaded)
+        graph = util.get_chemgraphs()[20]
+        assert sorted(map(len, grammar.neighbors(graph))) == sorted(map(len, loaded.neighbors(graph)))
+
+
+def test_params(tmp_path):
+    grammar = _fit(filter_max_num_substitutions=3)
+    grammar.note = ('a', 1)
+    grammar.tags = {1, 2}
+    grammar.selector = lambda x: x
+    grammar.instrument()
+    path = str(tmp_path / 'grammar.glsnap')
+    grammar.save(path)
+    loaded = snapshot.load(path)
+    params = ['radii', 'thickness', 'filter_max_num_substitutions', 'combine_cips', 'note', 'tags']
+    assert [getattr(loaded, k) for k in params] == [getattr(grammar, k) for k in params]
+    assert 'selector' not in loaded.__dict__ and 'instrumentation' not in loaded.__dict__
+    # loading into an instance keeps what could not be saved
+    instance = LSGG()
+    instance.selector = grammar.selector
+    assert instance.load(path).selector is grammar.selector
+    assert snapshot.read_header(path)[0]['params']['note'] == ['a', 1]
+
+
+def test_hasher_and_wide_hashes(tmp_path):
+    grammar = _fit(hasher=CSRGraphHasher(bits=128))
+    path = str(tmp_path / 'grammar.glsnap')
+    grammar.save(path)
+    loaded = LSGG().load(path)
+    assert type(loaded.hasher) is CSRGraphHasher and loaded.hasher.bits == 128
+    _assert_same(grammar, loaded)
+
+
+def test_changes_and_pickle(tmp_path):
+    grammar = _fit()
+    path = str(tmp_path / 'grammar.glsnap')
+    grammar.save(path)
+    loaded = snapshot.load(path)
+    interface = next(iter(loaded.productions))
+    loaded.productions.pop(interface)
+    assert interface not in loaded.productions
+    assert loaded.productions.get(interface) is None
+    assert len(loaded.productions) == len(grammar.productions) - 1
+    loaded._filter_cips()
+    again = pickle.loads(pickle.dumps(loaded))
+    _assert_same(loaded, again)
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / 'junk'
+    path.write_bytes(b'x' * 100)
+    with pytest.raises(ValueError):
+        snapshot.load(str(path))
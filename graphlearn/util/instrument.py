@@ -0,0 +1,107 @@
+"""
+Timers and counters for the stages of fitting and substitution.
+
+    grammar.instrument()           # start counting, returns the Instrumentation
+    list(grammar.neighbors(graph))
+    grammar.instrumentation.as_dict()
+    grammar.instrumentation.log(logger)
+
+an instrumented piece of code is
+
+    with instrumentation.timer('stage'):
+        ...
+
+instrumentation is OFF unless enabled, OFF does nothing: a timer is one
+method call that returns a shared do-nothing context manager.
+times include those of the stages they contain (e.g. 'cip' contains 'hash').
+"""
+
+import json
+import logging
+import time
+from collections import Counter
+
+
+class Instrumentation(object):
+    """seconds and calls per timed stage, counts of events"""
+
+    enabled = True
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.counts = Counter()
+
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def count(self, event, n=1):
+        self.counts[event] += n
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self.counts.clear()
+
+    def update(self, other):
+        """add the measurements of other, e.g. of a worker"""
+        self.seconds.update(other.seconds)
+        self.calls.update(other.calls)
+        self.counts.update(other.counts)
+
+    def as_dict(self):
+        """{'stages': {stage: {'seconds', 'calls'}}, 'counts': {event: n}}"""
+        return {'stages': {stage: {'seconds': self.seconds[stage], 'calls': self.calls[stage]}
+                           for stage in sorted(self.calls)},
+                'counts': dict(sorted(self.counts.items()))}
+
+    def log(self, logger=None, level=logging.INFO):
+        """one log record, the message is as_dict() as json"""
+        (logger or logging.getLogger(__name__)).log(level, json.dumps(self.as_dict()))
+
+
+class _Timer(object):
+    __slots__ = ('instrumentation', 'stage', 'start')
+
+    def __init__(self, instrumentation, stage):
+        self.instrumentation = instrumentation
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.instrumentation.seconds[self.stage] += time.perf_counter() - self.start
+        self.instrumentation.calls[self.stage] += 1
+
+
+class _Off(object):
+    """disabled instrumentation"""
+
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def timer(self, stage):
+        return self
+
+    def count(self, event, n=1):
+        pass
+
+    def as_dict(self):
+        return {'stages': {}, 'counts': {}}
+
+    def log(self, logger=None, level=logging.INFO):
+        pass
+
+    def __reduce__(self):
+        # stays the singleton when pickled
+        return 'OFF'
+
+
+OFF = _Off()
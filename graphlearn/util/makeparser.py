@@ -9,13 +9,17 @@ def makeparser(text):
         hel = 'no help'
         hindex = line.find("#")
         if hindex != -1:
-            hel = line[hindex:].strip()
+            hel = line[hindex + 1:].strip()
             line = line[:hindex]
+        # lines end with a comma, or not
+        line = line.strip().rstrip(',')
+        if not line:
+            continue
         deli = line.find('=')
         if deli == - 1:
-            tmp.append((line[:-1], '', hel))
+            tmp.append((line, '', hel))
         else:
-            tmp.append((line[:deli], line[deli + 1:-1].strip(), hel))
+            tmp.append((line[:deli].strip(), line[deli + 1:].strip(), hel))
     used_names = []
 
     # optionlist gives a long name for the parameters
@@ -33,7 +37,7 @@ def makeparser(text):
         shortname = name[:3]
         if shortname not in used_names:
             used_names.append(shortname)
-        return shortname
+            return shortname
         return name
 
     # making a parser...
@@ -52,11 +56,19 @@ def makeparser(text):
         nargs = "+" if typ == list else None
         if typ == list:
             typ = int
+        # None: a string may be given
+        if value is None:
+            typ = str
+        names = ["--" + longname] if shortname == longname else ["--" + shortname, "--" + longname]
+        # booleans are switches
+        if typ == bool:
+            parser.add_argument(*names, dest=longname, action='store_false' if default else 'store_true',
+                                help=helpmsg, default=default)
+            continue
 
         # print arg,default,type(default),default
         parser.add_argument(
-            "--" + shortname,
-            "--" + longname,
+            *names,
             nargs=nargs,
             dest=longname,
             type=typ,
@@ -1,11 +1,143 @@
 
 
+"""
+Long-lived worker pools.
+
+creating a multiprocessing.Pool costs more than many of the jobs we run on
+it (e.g. scoring the proposals of one sampling step), so pools are started
+on first use and then kept.  get_pool(n) returns the shared pool with n
+processes, fitting, scoring and sampling all use it.  pools are shut down at
+exit or with shutdown().
+"""
+
+import atexit
 import multiprocessing as mp
-def mpmap(func, iterable, chunksize=10, poolsize=2):
-    """pmap."""
-    pool = mp.Pool(poolsize)
-    result = pool.map(func, iterable, chunksize=chunksize)
-    pool.close()
-    pool.join()
-    return list(result)
 
+
+class WorkerPool(object):
+    """
+    multiprocessing.Pool that starts on first use and is reused until close()
+
+    processes: number of worker processes, -1 for all cpus
+    tasks_per_worker: the default chunksize splits a job into about this
+        many chunks per process
+    initializer, initargs: run in each worker when it starts. with the fork
+        start method initargs are inherited, not pickled, e.g. a large
+        read-only grammar is shared copy-on-write
+    """
+
+    def __init__(self, processes=2, tasks_per_worker=4, initializer=None, initargs=()):
+        self.processes = mp.cpu_count() if processes == -1 else processes
+        self.tasks_per_worker = tasks_per_worker
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = mp.Pool(self.processes, initializer=self.initializer, initargs=self.initargs)
+        return self._pool
+
+    @property
+    def started(self):
+        return self._pool is not None
+
+    def chunksize(self, n):
+        """chunksize for n tasks, None: the length is unknown"""
+        if n is None:
+            return 1
+        return max(1, -(-n // (self.tasks_per_worker * self.processes)))
+
+    def map(self, func, iterable, chunksize=None):
+        """ordered results as a list"""
+        iterable = _sized(iterable)
+        if _in_worker():
+            return list(map(func, iterable))
+        return self.pool.map(func, iterable, chunksize=chunksize or self.chunksize(len(iterable)))
+
+    def imap(self, func, iterable, chunksize=None):
+        """ordered results as they become available"""
+        if _in_worker():
+            return map(func, iterable)
+        return self.pool.imap(func, iterable, chunksize=chunksize or self.chunksize(_len(iterable)))
+
+    def imap_unordered(self, func, iterable, chunksize=None):
+        """results in order of completion"""
+        if _in_worker():
+            return map(func, iterable)
+        return self.pool.imap_unordered(func, iterable, chunksize=chunksize or self.chunksize(_len(iterable)))
+
+    def close(self):
+        """wait for the workers to finish and stop them, the pool restarts on next use"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        """stop the workers immediately"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # the processes stay with their owner
+        state = dict(self.__dict__)
+        state['_pool'] = None
+        return state
+
+
+_pools = {}
+
+
+def get_pool(processes=2):
+    """the shared WorkerPool with this many processes"""
+    processes = mp.cpu_count() if processes == -1 else processes
+    if processes not in _pools:
+        _pools[processes] = WorkerPool(processes)
+    return _pools[processes]
+
+
+@atexit.register
+def shutdown():
+    """stop all shared pools"""
+    for pool in _pools.values():
+        pool.terminate()
+    _pools.clear()
+
+
+def mpmap(func, iterable, chunksize=None, poolsize=2):
+    """pmap on the shared pool."""
+    return get_pool(poolsize).map(func, iterable, chunksize=chunksize)
+
+
+def chunks(items, n):
+    """split the list items into n contiguous parts of about equal size (fewer if items is short)"""
+    n = max(1, min(n, len(items)))
+    size, rest = divmod(len(items), n)
+    bounds = [i * size + min(i, rest) for i in range(n + 1)]
+    return [items[bounds[i]:bounds[i + 1]] for i in range(n)]
+
+
+def _in_worker():
+    # daemonic pool workers can not have children, they run jobs themselves
+    return mp.current_process().daemon
+
+
+def _len(iterable):
+    try:
+        return len(iterable)
+    except TypeError:
+        return None
+
+
+def _sized(iterable):
+    return iterable if _len(iterable) is not None else list(iterable)
@@ -1,44 +1,157 @@
+"""
+set operations on the productions of grammars.
+
+the inputs are not changed. the result shares the interface buckets ({core_hash: cip})
+and cips that an operation leaves as they are with its inputs. its productions are
+copy-on-write: a shared bucket or cip is (shallow) copied when it is first looked up
+with [], which is how grammars write to their productions (fit, filters, _merge_cip),
+so fitting the result or changing its counts leaves the inputs alone. get, in,
+iteration and values() do not copy. the other way round, an input that is changed
+in place also changes the results that still share its buckets, copy.deepcopy them
+first.
+grammars can only be combined if their hashers compute the same hashes.
+"""
 
 import copy
+from collections import defaultdict
+
+
+class CopyOnWrite(defaultdict):
+    """defaultdict whose values may be shared, see the module docstring"""
+
+    def __init__(self, *args):
+        super(CopyOnWrite, self).__init__(*args)
+        self._shared = set()
+
+    def share(self, key, value):
+        """set key to value without copying it, value is copied on the first [] lookup"""
+        dict.__setitem__(self, key, value)
+        self._shared.add(key)
+
+    def __getitem__(self, key):
+        if key not in self._shared:
+            return super(CopyOnWrite, self).__getitem__(key)
+        value = self._copy(dict.__getitem__(self, key))
+        self[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._shared.discard(key)
+        super(CopyOnWrite, self).__setitem__(key, value)
+
+    def pop(self, key, *default):
+        self._shared.discard(key)
+        return super(CopyOnWrite, self).pop(key, *default)
+
+    def _copy(self, value):
+        return copy.copy(value)
+
+
+class _Productions(CopyOnWrite):
+    """{interface: bucket}, a shared bucket becomes a new bucket that shares its cips"""
+
+    def __init__(self, default_factory=dict, *args):
+        super(_Productions, self).__init__(default_factory, *args)
 
+    def _copy(self, bucket):
+        return _bucket(bucket.items())
 
 
+def _bucket(items):
+    """bucket that shares the cips of items"""
+    bucket = CopyOnWrite()
+    dict.update(bucket, items)
+    bucket._shared.update(bucket)
+    return bucket
+
+
+def _grammar(grammar, productions):
+    """shallow copy of grammar with productions"""
+    result = copy.copy(grammar)
+    result.productions = productions
+    # caches that belong to the productions of grammar
+    result.__dict__.pop('_size_buckets', None)
+    return result
+
+
+def _hasher(grammar):
+    hasher = grammar.hasher
+    return type(hasher), hasher.bits, hasher.key, hasher.depth
+
+
+def _check_hashers(grammars):
+    if len({_hasher(grammar) for grammar in grammars}) > 1:
+        raise ValueError("the grammars use different hashers, their productions can not be combined")
+
 
 def difference(grammar, other_grammar, substract_cip_count=False):
-    """difference between grammars"""
-    grammar = copy.deepcopy(grammar)
-    for interface in list(grammar.productions):
-        if interface in other_grammar.productions:
-            for core in list(grammar.productions[interface]):
-                if core in other_grammar.productions[interface].keys():
-                    grammar.productions[interface].pop(core)
-        if len(grammar.productions[interface]) < 2:
-            grammar.productions.pop(interface)
-    return grammar
-
-
-def union(grammar, other_grammar):
-    """union of grammars"""
-    grammar = copy.deepcopy(grammar)
-    for interface in list(grammar.productions):
-        if interface in other_grammar.productions:
-            for core in list(grammar.productions[interface]):
-                if core not in other_grammar.productions[interface]:
-                    grammar.productions[interface][core] = other_grammar.productions[interface][core]
-        else:
-            grammar.productions[interface] = copy.deepcopy(other_grammar[interface])
-    return grammar
+    """difference between grammars, interfaces with less than 2 cores are dropped.
+    substract_cip_count: subtract the counts of other_grammar, cips are dropped when
+        their count drops to 0"""
+    _check_hashers([grammar, other_grammar])
+    productions = _Productions()
+    other = other_grammar.productions
+    for interface, bucket in grammar.productions.items():
+        common = [core for core in bucket if interface in other and core in other[interface]]
+        if not common:
+            if len(bucket) >= 2:
+                productions.share(interface, bucket)
+            continue
+        bucket = _bucket(bucket.items())
+        for core in common:
+            count = bucket.get(core).count - other[interface][core].count if substract_cip_count else 0
+            if count > 0:
+                bucket[core].count = count
+            else:
+                bucket.pop(core)
+        if len(bucket) >= 2:
+            productions[interface] = bucket
+    return _grammar(grammar, productions)
+
+
+def union(grammar, other_grammar, sum_counts=False):
+    """union of grammars, cips of grammar are kept where both have a core.
+    sum_counts: their count is the sum of the counts"""
+    return merge([grammar, other_grammar], sum_counts=sum_counts)
+
+
+def merge(grammars, sum_counts=True):
+    """
+    union of many grammars, e.g. grammars fit on shards of the graphs.
+    the first cip of a core is kept, the others are merged into it with the
+    _merge_cip of the first grammar (sums the counts), unless not sum_counts.
+    the result is a copy of the first grammar with the merged productions.
+    """
+    grammars = list(grammars)
+    _check_hashers(grammars)
+    productions = _Productions()
+    for grammar in grammars:
+        for interface, bucket in grammar.productions.items():
+            if interface not in productions:
+                productions.share(interface, bucket)
+                continue
+            if not sum_counts and bucket.keys() <= productions.get(interface).keys():
+                continue
+            target = productions[interface]
+            for core, cip in bucket.items():
+                if core not in target:
+                    target.share(core, cip)
+                elif sum_counts:
+                    grammars[0]._merge_cip(target[core], cip)
+    return _grammar(grammars[0], productions)
+
 
 def intersect(grammar, other_grammar):
-    """intersection of grammars"""
-    grammar = copy.deepcopy(grammar)
-    for interface in list(grammar.productions.keys()):
-        if interface in other_grammar.productions:
-            for core in list(grammar.productions[interface].keys()):
-                if core not in other_grammar.productions[interface]:
-                    grammar.productions[interface].pop(core)
-            if len(grammar.productions[interface]) < 2:
-                grammar.productions.pop(interface)
-        else:
-            grammar.productions.pop(interface)
-    return grammar
+    """intersection of grammars, interfaces with less than 2 cores are dropped"""
+    _check_hashers([grammar, other_grammar])
+    productions = _Productions()
+    other = other_grammar.productions
+    for interface, bucket in grammar.productions.items():
+        if interface not in other:
+            continue
+        kept = [(core, cip) for core, cip in bucket.items() if core in other[interface]]
+        if len(kept) == len(bucket) >= 2:
+            productions.share(interface, bucket)
+        elif len(kept) >= 2:
+            productions[interface] = _bucket(kept)
+    return _grammar(grammar, productions)
@@ -0,0 +1,45 @@
+import numpy as np
+
+_MERSENNE = 2 ** 61 - 1
+
+
+class CountMinSketch(object):
+    """
+    count-min sketch over integer keys (or tuples of integers).
+
+    memory is width*depth counters, estimates never undercount and
+    overcount by at most e*N/width with probability 1-exp(-depth),
+    N being the number of added items.
+    """
+
+    def __init__(self, width=2 ** 18, depth=4, seed=0):
+        self.width = width
+        self.depth = depth
+        rng = np.random.RandomState(seed)
+        self._a = [int(x) for x in rng.randint(1, 2 ** 31, size=depth)]
+        self._b = [int(x) for x in rng.randint(0, 2 ** 31, size=depth)]
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, key):
+        if isinstance(key, tuple):
+            x = 0
+            for k in key:
+                x = (x * 0x100000001b3 + k) % _MERSENNE
+        else:
+            x = key % _MERSENNE
+        return [((a * x + b) % _MERSENNE) % self.width for a, b in zip(self._a, self._b)]
+
+    def add(self, key, count=1):
+        """add count to key, returns the new estimate"""
+        columns = self._columns(key)
+        estimate = None
+        for row, column in enumerate(columns):
+            value = self.table[row, column] + count
+            self.table[row, column] = value
+            estimate = value if estimate is None else min(estimate, value)
+        self.total += count
+        return int(estimate)
+
+    def estimate(self, key):
+        return int(min(self.table[row, column] for row, column in enumerate(self._columns(key))))
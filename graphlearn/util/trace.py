@@ -0,0 +1,133 @@
+"""
+Per-step trace of Sampler chains.
+
+    trace = Trace(JSONLSink('steps.jsonl'))
+    sampler = Sampler(..., trace=trace)
+    sampler.sample_burnin(graph)
+    trace.stats()    # acceptance rate, throughput, time split
+
+a record is a dict, one per step:
+    chain: index of the chain in sample_many, else None
+    step, method: sample_step or sample_step_multi
+    proposals: graphs proposed by the grammar, decoded: objects the transformer made of them
+    score: score of the object the step returns, delta: score - score of the start object
+        (None if that is unknown)
+    accepted: the step moved to a proposal
+    event: None, 'dead_end' (no proposal, or none better in sample_step_multi)
+        or 'backtrack' (dead end, the chain went back in its History)
+    propose_s, decode_s, score_s, total_s: wall time of the step and its parts
+
+a sink is any callable that takes a record, e.g. a function (callback),
+RingSink or JSONLSink.
+"""
+
+import json
+import os
+import time
+from collections import Counter, deque
+
+TIMES = ('propose_s', 'decode_s', 'score_s', 'total_s')
+
+
+class Trace(object):
+    """sends the records to the sink and aggregates them"""
+
+    def __init__(self, sink=None):
+        self.sink = RingSink() if sink is None else sink
+        self.counts = Counter()
+        self.seconds = Counter()
+
+    def emit(self, record):
+        self.counts['steps'] += 1
+        self.counts['accepted'] += bool(record['accepted'])
+        self.counts['proposals'] += record['proposals']
+        self.counts['decoded'] += record['decoded']
+        if record['event'] is not None:
+            self.counts[record['event']] += 1
+        for key in TIMES:
+            self.seconds[key] += record[key]
+        self.sink(record)
+
+    def stats(self):
+        """acceptance rate, steps and proposals per second, counts and seconds"""
+        steps, total = self.counts['steps'], self.seconds['total_s']
+        return {'steps': steps,
+                'acceptance_rate': self.counts['accepted'] / steps if steps else None,
+                'steps_per_s': steps / total if total else None,
+                'proposals_per_s': self.counts['proposals'] / total if total else None,
+                'counts': dict(self.counts), 'seconds': dict(self.seconds)}
+
+    def reset(self):
+        self.counts.clear()
+        self.seconds.clear()
+
+
+class RingSink(object):
+    """keeps the last size records in memory"""
+
+    def __init__(self, size=1000):
+        self.records = deque(maxlen=size)
+
+    def __call__(self, record):
+        self.records.append(record)
+
+
+class JSONLSink(object):
+    """
+    appends each record as a line of json to path.
+    the file is opened per process, chains in ParallelSampler workers append to the same file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._pid = None
+
+    def __call__(self, record):
+        if self._pid != os.getpid():
+            self._file = open(self.path, 'a')
+            self._pid = os.getpid()
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file, self._pid = None, None
+
+    def __getstate__(self):
+        return {'path': self.path, '_file': None, '_pid': None}
+
+
+class Clock(object):
+    """adds up the time spent in parts of a step"""
+
+    __slots__ = ('start', 'seconds')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = Counter()
+
+    def timed(self, key, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.seconds[key] += time.perf_counter() - start
+        return result
+
+    def timed_iter(self, key, iterable):
+        """iterable, the time spent in its next() calls is added to key"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.seconds[key] += time.perf_counter() - start
+                return
+            self.seconds[key] += time.perf_counter() - start
+            yield item
+
+    def times(self):
+        times = {key: self.seconds[key] for key in TIMES[:-1]}
+        times['total_s'] = time.perf_counter() - self.start
+        return times
@@ -1,5 +1,8 @@
 from collections import defaultdict
 import functools
+import json
+import os
+import sys
 import networkx as nx
 from graphlearn import local_substitution_graph_grammar
 from graphlearn.lsgg_core_interface_pair import CoreInterfacePair
@@ -85,6 +88,77 @@ def get_cyclegraphs():
     G.append(test_get_circular_graph())
     return G
 
+def get_chemgraphs():
+    """the molecules in graphlearn/test/chemtest.json"""
+    with open(os.path.join(os.path.dirname(__file__), '..', 'test', 'chemtest.json')) as handle:
+        data = json.load(handle)
+    return [node_link_graph(x) for x in data]
+
+
+def node_link_graph(data):
+    try:
+        return nx.readwrite.node_link_graph(data, edges='links')
+    except TypeError:  # networkx < 3.4
+        return nx.readwrite.node_link_graph(data)
+
+
+def node_link_data(graph):
+    """node-link dict of graph, graph attributes that are not json (e.g. 'substitution') are dropped"""
+    try:
+        data = nx.readwrite.node_link_data(graph, edges='links')
+    except TypeError:  # networkx < 3.4
+        data = nx.readwrite.node_link_data(graph)
+    if isinstance(graph.graph, dict):
+        data['graph'] = {k: v for k, v in graph.graph.items() if jsonable(v)}
+    return data
+
+
+def jsonable(value):
+    """True if json can serialize value"""
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def read_graphs(path):
+    """
+    graphs from a file, lazily.
+    path: gspan, .json (a list of node-link graphs, read at once) or .jsonl (a node-link graph per line)
+    """
+    if path.endswith('.jsonl'):
+        with open(path) as handle:
+            for line in handle:
+                if line.strip():
+                    yield node_link_graph(json.loads(line))
+    elif path.endswith('.json'):
+        with open(path) as handle:
+            data = json.load(handle)
+        for x in data:
+            yield node_link_graph(x)
+    else:
+        from eden.io.gspan import gspan_to_eden
+        yield from gspan_to_eden(path)
+
+
+class no_transform(object):
+    """identity transformer for a Sampler that works on graphs directly"""
+
+    def encode_single(self, thing):
+        return thing
+
+    def encode(self, thing):
+        for e in thing:
+            yield e
+
+    def _decode_single(self, thing):
+        return thing
+
+    def decode(self, thing):
+        for e in thing:
+            yield e
+
 
 def valid_gl_graph(graph):
     """checks if a graph is a valid graphlearn-intermediary product"""
@@ -110,6 +184,22 @@ def valid_gl_graph(graph):
     return True
 
 
+def nbytes(obj, seen=None):
+    """approximate memory of obj and what it holds: sys.getsizeof summed over containers and
+    object attributes, shared objects are counted once"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(nbytes(k, seen) + nbytes(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(nbytes(x, seen) for x in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += nbytes(vars(obj), seen)
+    return size
+
 
 def decorate_cip(cip):
     #print (cip.core_nodes)
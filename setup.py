@@ -96,7 +96,7 @@ setup(
     author='Stefan Mautner',
     author_email='myl4stn4m3@cs.uni-freiburg.de',
     packages=[ 'graphlearn', 'graphlearn.test', 'graphlearn.util' ],
-    scripts=[ ],
+    scripts=['bin/graphlearn_fit.py', 'bin/graphlearn_sample.py'],
     include_package_data=True,
     package_data={},
     url='https://github.com/fabriziocosta/GraphLearn',